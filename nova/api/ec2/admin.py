@@ -326,7 +326,8 @@ class AdminController(object):
                                            and s['binary'] == 'nova-compute']
             if compute:
                 compute = compute[0]
-            instances = db.instance_get_all_by_host(context, host)
+            instances = db.instance_get_all_by_host(context, host,
+                                                    profile='minimal')
             volume = [s for s in services if s['host'] == host \
                                            and s['binary'] == 'nova-volume']
             if volume:
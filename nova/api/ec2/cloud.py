@@ -960,18 +960,20 @@ class CloudController(object):
                 'status': volume['attach_status'],
                 'volumeId': ec2utils.id_to_ec2_vol_id(volume_id)}
 
-    def _format_kernel_id(self, context, instance_ref, result, key):
+    def _format_kernel_id(self, context, instance_ref, result, key,
+                          image_ids=None):
         kernel_uuid = instance_ref['kernel_id']
         if kernel_uuid is None or kernel_uuid == '':
             return
-        kernel_id = self._get_image_id(context, kernel_uuid)
+        kernel_id = self._get_image_id(context, kernel_uuid, image_ids)
         result[key] = ec2utils.image_ec2_id(kernel_id, 'aki')
 
-    def _format_ramdisk_id(self, context, instance_ref, result, key):
+    def _format_ramdisk_id(self, context, instance_ref, result, key,
+                           image_ids=None):
         ramdisk_uuid = instance_ref['ramdisk_id']
         if ramdisk_uuid is None or ramdisk_uuid == '':
             return
-        ramdisk_id = self._get_image_id(context, ramdisk_uuid)
+        ramdisk_id = self._get_image_id(context, ramdisk_uuid, image_ids)
         result[key] = ec2utils.image_ec2_id(ramdisk_id, 'ari')
 
     def describe_instance_attribute(self, context, instance_id, attribute,
@@ -1068,12 +1070,18 @@ class CloudController(object):
         return i[0]
 
     def _format_instance_bdm(self, context, instance_id, root_device_name,
-                             result):
-        """Format InstanceBlockDeviceMappingResponseItemType"""
+                             result, bdms=None, volumes=None):
+        """Format InstanceBlockDeviceMappingResponseItemType
+
+        bdms and volumes, a dict of volumes by id, may be given when they
+        have already been looked up.
+        """
+        if bdms is None:
+            bdms = db.block_device_mapping_get_all_by_instance(context,
+                                                               instance_id)
         root_device_type = 'instance-store'
         mapping = []
-        for bdm in db.block_device_mapping_get_all_by_instance(context,
-                                                               instance_id):
+        for bdm in bdms:
             volume_id = bdm['volume_id']
             if (volume_id is None or bdm['no_device']):
                 continue
@@ -1083,7 +1091,9 @@ class CloudController(object):
                 assert not bdm['virtual_name']
                 root_device_type = 'ebs'
 
-            vol = self.volume_api.get(context, volume_id=volume_id)
+            vol = (volumes or {}).get(volume_id)
+            if vol is None:
+                vol = self.volume_api.get(context, volume_id=volume_id)
             LOG.debug(_("vol = %s\n"), vol)
             # TODO(yamahata): volume attach time
             ebs = {'volumeId': volume_id,
@@ -1128,14 +1138,16 @@ class CloudController(object):
         reservations = {}
         # NOTE(vish): instance_id is an optional list of ids to filter by
         if instance_id:
-            instances = []
-            for ec2_id in instance_id:
-                internal_id = ec2utils.ec2_id_to_id(ec2_id)
-                try:
-                    instance = self.compute_api.get(context, internal_id)
-                except exception.NotFound:
-                    continue
-                instances.append(instance)
+            internal_ids = [ec2utils.ec2_id_to_id(ec2_id)
+                            for ec2_id in instance_id]
+            try:
+                instances = self.compute_api.get_all(context,
+                        search_opts={'id': internal_ids,
+                                     'local_zone_only': True})
+            except exception.NotFound:
+                instances = []
+            instances = [instance for instance in instances
+                         if not instance['deleted']]
         else:
             try:
                 # always filter out deleted instances
@@ -1144,19 +1156,39 @@ class CloudController(object):
                                                      search_opts=search_opts)
             except exception.NotFound:
                 instances = []
+        if not context.is_admin:
+            instances = [instance for instance in instances
+                         if instance['image_ref'] != str(FLAGS.vpn_image_id)]
+
+        # Look up what every instance needs at once, rather than instance
+        # by instance.
+        image_ids = self._get_image_ids(context,
+                [instance[key] for instance in instances
+                 for key in ('image_ref', 'kernel_id', 'ramdisk_id')])
+        bdms = {}
+        volumes = {}
+        for bdm in db.block_device_mapping_get_all_by_instances(context,
+                [instance['id'] for instance in instances]):
+            bdms.setdefault(bdm['instance_id'], []).append(bdm)
+            if bdm['volume_id'] is not None and bdm['volume']:
+                volumes[bdm['volume_id']] = bdm['volume']
+        services = {}
+        if instances:
+            for service in db.service_get_all(context.elevated()):
+                services.setdefault(service['host'], []).append(service)
+
         for instance in instances:
-            if not context.is_admin:
-                if instance['image_ref'] == str(FLAGS.vpn_image_id):
-                    continue
             i = {}
             instance_id = instance['id']
             ec2_id = ec2utils.id_to_ec2_id(instance_id)
             i['instanceId'] = ec2_id
             image_uuid = instance['image_ref']
-            image_id = self._get_image_id(context, image_uuid)
+            image_id = self._get_image_id(context, image_uuid, image_ids)
             i['imageId'] = ec2utils.image_ec2_id(image_id)
-            self._format_kernel_id(context, instance, i, 'kernelId')
-            self._format_ramdisk_id(context, instance, i, 'ramdiskId')
+            self._format_kernel_id(context, instance, i, 'kernelId',
+                                   image_ids)
+            self._format_ramdisk_id(context, instance, i, 'ramdiskId',
+                                    image_ids)
             i['instanceState'] = {
                 'code': instance['power_state'],
                 'name': state_description_from_vm_state(instance['vm_state'])}
@@ -1190,10 +1222,12 @@ class CloudController(object):
             i['displayDescription'] = instance['display_description']
             self._format_instance_root_device_name(instance, i)
             self._format_instance_bdm(context, instance_id,
-                                      i['rootDeviceName'], i)
+                                      i['rootDeviceName'], i,
+                                      bdms=bdms.get(instance_id, []),
+                                      volumes=volumes)
             host = instance['host']
-            services = db.service_get_all_by_host(context.elevated(), host)
-            zone = ec2utils.get_availability_zone_by_host(services, host)
+            zone = ec2utils.get_availability_zone_by_host(
+                    services.get(host, []), host)
             i['placement'] = {'availabilityZone': zone}
             if instance['reservation_id'] not in reservations:
                 r = {}
@@ -1395,9 +1429,18 @@ class CloudController(object):
         return self.image_service.get_image_uuid(context, internal_id)
 
     # NOTE(bcwaldon): We also need to be able to map image uuids to integers
-    def _get_image_id(self, context, image_uuid):
+    def _get_image_id(self, context, image_uuid, image_ids=None):
+        if image_ids and image_uuid in image_ids:
+            return image_ids[image_uuid]
         return self.image_service.get_image_id(context, image_uuid)
 
+    def _get_image_ids(self, context, image_uuids):
+        image_uuids = set(image_uuid for image_uuid in image_uuids
+                          if image_uuid)
+        if not image_uuids:
+            return {}
+        return self.image_service.get_image_ids(context, image_uuids)
+
     def _format_image(self, image):
         """Convert from format defined by GlanceImageService to S3 format."""
         i = {}
@@ -0,0 +1,92 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Cache of rendered metadata responses, keyed by fixed ip.
+
+Each entry records the owner of the fixed ip it was rendered for, and is
+only served while the ip still has that owner, so an ip handed to another
+instance never gets the previous instance's metadata.  Otherwise entries
+expire after FLAGS.metadata_cache_ttl seconds: instances see changes to
+their metadata, security groups or floating ips up to that many seconds
+late.
+"""
+
+import time
+
+from nova import flags
+from nova import log as logging
+
+
+LOG = logging.getLogger('nova.api.metadata.cache')
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('metadata_cache_ttl', 15,
+                     'Seconds to cache metadata for an instance, and so the '
+                     'longest changes take to show up '
+                     '(0 disables the cache)')
+flags.DEFINE_integer('metadata_cache_size', 1000,
+                     'Maximum number of instances to cache metadata for')
+
+
+class MetadataCache(object):
+    """Least recently used cache of metadata with per-entry expiry."""
+
+    def __init__(self, ttl=None, size=None):
+        self.ttl = FLAGS.metadata_cache_ttl if ttl is None else ttl
+        self.size = FLAGS.metadata_cache_size if size is None else size
+        # address -> [expires, last_used, owner, value]
+        self._entries = {}
+        self._clock = 0
+
+    def get(self, address, owner=None):
+        entry = self._entries.get(address)
+        if entry is None:
+            return None
+        if entry[0] < time.time() or entry[2] != owner:
+            del self._entries[address]
+            return None
+        self._clock += 1
+        entry[1] = self._clock
+        return entry[3]
+
+    def set(self, address, value, owner=None):
+        if self.ttl <= 0 or self.size <= 0:
+            return
+        if address not in self._entries and len(self._entries) >= self.size:
+            self._evict()
+        self._clock += 1
+        self._entries[address] = [time.time() + self.ttl, self._clock,
+                                  owner, value]
+
+    def _evict(self):
+        now = time.time()
+        expired = [address for address, entry in self._entries.iteritems()
+                   if entry[0] < now]
+        for address in expired:
+            del self._entries[address]
+        if len(self._entries) >= self.size:
+            oldest = min(self._entries, key=lambda a: self._entries[a][1])
+            del self._entries[oldest]
+
+    def invalidate(self, address):
+        self._entries.pop(address, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
@@ -24,6 +24,7 @@ import webob.dec
 import webob.exc
 
 from nova.api.ec2 import ec2utils
+from nova.api.metadata import cache
 from nova import block_device
 from nova import compute
 from nova import context
@@ -74,6 +75,7 @@ class MetadataRequestHandler(wsgi.Application):
         self.compute_api = compute.API(
                 network_api=network.API(),
                 volume_api=volume.API())
+        self.cache = cache.MetadataCache()
 
     def _get_mpi_data(self, context, project_id):
         result = {}
@@ -209,6 +211,60 @@ class MetadataRequestHandler(wsgi.Application):
             data['product-codes'] = []
         return data
 
+    def _get_address_owner(self, address):
+        """Return the ids of the instances address is bound to.
+
+        One indexed query on fixed_ips, cheap enough to run on every
+        request so cached metadata is never served for another instance.
+        """
+        ctxt = context.get_admin_context()
+        ips = db.fixed_ip_get_instance_ips_by_address(ctxt, address)
+        return tuple(sorted(ip['instance_id'] for ip in ips
+                            if not ip['floating']))
+
+    def get_rendered_metadata(self, address):
+        """Return the rendered metadata tree for address, cached.
+
+        See render_data for the structure of the tree.
+        """
+        owner = self._get_address_owner(address)
+        rendered = self.cache.get(address, owner)
+        if rendered is not None:
+            return rendered
+
+        data = self.get_metadata(address)
+        if data is None:
+            return None
+
+        rendered = self.render_data(data)
+        self.cache.set(address, rendered, owner)
+        return rendered
+
+    def render_data(self, data):
+        """Pre-serialize data into a tree of (output, children) pairs.
+
+        output is what print_data returns for the node and children maps
+        each key of a dict node to its rendered subtree (None for leaves),
+        so serving a path needs no further formatting.
+        """
+        if isinstance(data, dict):
+            children = dict((key, self.render_data(value))
+                            for key, value in data.iteritems())
+            return (self.print_data(data), children)
+        return (self.print_data(data), None)
+
+    def lookup_rendered(self, path, rendered):
+        """Rendered equivalent of lookup followed by print_data."""
+        for item in path.split('/'):
+            if item:
+                output, children = rendered
+                if children is None:
+                    return output
+                if not item in children:
+                    return None
+                rendered = children[item]
+        return rendered[0]
+
     def print_data(self, data):
         if isinstance(data, dict):
             output = ''
@@ -246,7 +302,7 @@ class MetadataRequestHandler(wsgi.Application):
         if FLAGS.use_forwarded_for:
             remote_address = req.headers.get('X-Forwarded-For', remote_address)
         try:
-            meta_data = self.get_metadata(remote_address)
+            meta_data = self.get_rendered_metadata(remote_address)
         except Exception:
             LOG.exception(_('Failed to get metadata for ip: %s'),
                           remote_address)
@@ -257,7 +313,7 @@ class MetadataRequestHandler(wsgi.Application):
         if meta_data is None:
             LOG.error(_('Failed to get metadata for ip: %s'), remote_address)
             raise webob.exc.HTTPNotFound()
-        data = self.lookup(req.path_info, meta_data)
+        data = self.lookup_rendered(req.path_info, meta_data)
         if data is None:
             raise webob.exc.HTTPNotFound()
-        return self.print_data(data)
+        return data
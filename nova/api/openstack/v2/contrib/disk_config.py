@@ -125,7 +125,8 @@ class Disk_config(extensions.ExtensionDescriptor):
 
         # Get DB information for servers
         uuids = [server['id'] for server in servers]
-        db_servers = db.instance_get_all_by_filters(context, {'uuid': uuids})
+        db_servers = db.instance_get_all_by_filters(context, {'uuid': uuids},
+                                                    profile='minimal')
         db_servers = dict([(s['uuid'], s) for s in db_servers])
 
         for server in servers:
@@ -77,6 +77,7 @@ class QuotaSetsController(object):
                     db.quota_create(context, project_id, key, value)
                 except exception.AdminRequired:
                     raise webob.exc.HTTPForbidden()
+        quota.invalidate_quotas(project_id)
         return {'quota_set': quota.get_project_quotas(context, project_id)}
 
     def defaults(self, req, id):
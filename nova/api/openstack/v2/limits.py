@@ -17,14 +17,14 @@
 Module dedicated functions/classes dealing with rate limiting requests.
 """
 
-from collections import defaultdict
-import copy
 import httplib
 import json
 import math
 import re
+import socket
 import time
 
+from eventlet import event
 from webob.dec import wsgify
 import webob.exc
 
@@ -123,6 +123,7 @@ class Limit(object):
         self.verb = verb
         self.uri = uri
         self.regex = regex
+        self.compiled_regex = re.compile(regex)
         self.value = int(value)
         self.unit = unit
         self.unit_string = self.display_unit().lower()
@@ -147,35 +148,50 @@ class Limit(object):
         @param verb: string http verb (POST, GET, etc.)
         @param url: string URL
         """
-        if self.verb != verb or not re.match(self.regex, url):
+        if self.verb != verb or not self.compiled_regex.match(url):
             return
 
-        now = self._get_time()
+        return self.consume(self, self._get_time())
 
-        if self.last_request is None:
-            self.last_request = now
+    def consume(self, bucket, now):
+        """
+        Record a request against this limit.
+
+        @param bucket: the limit's state for the user making the request,
+                       which is the limit itself when used on its own
+        @param now: time of the request
+        @return: delay in seconds if the request is over the limit
+        """
+        if bucket.last_request is None:
+            bucket.last_request = now
 
-        leak_value = now - self.last_request
+        leak_value = now - bucket.last_request
 
-        self.water_level -= leak_value
-        self.water_level = max(self.water_level, 0)
-        self.water_level += self.request_value
+        bucket.water_level -= leak_value
+        bucket.water_level = max(bucket.water_level, 0)
+        bucket.water_level += self.request_value
 
-        difference = self.water_level - self.capacity
+        difference = bucket.water_level - self.capacity
 
-        self.last_request = now
+        bucket.last_request = now
 
         if difference > 0:
-            self.water_level -= self.request_value
-            self.next_request = now + difference
+            bucket.water_level -= self.request_value
+            bucket.next_request = now + difference
             return difference
 
         cap = self.capacity
-        water = self.water_level
+        water = bucket.water_level
         val = self.value
 
-        self.remaining = math.floor(((cap - water) / cap) * val)
-        self.next_request = now
+        bucket.remaining = math.floor(((cap - water) / cap) * val)
+        bucket.next_request = now
+
+    def drained(self, bucket, now):
+        """Whether a bucket has leaked empty, so is as good as new."""
+        if bucket.last_request is None:
+            return True
+        return bucket.water_level <= now - bucket.last_request
 
     def _get_time(self):
         """Retrieve the current time. Broken out for testability."""
@@ -185,18 +201,83 @@ class Limit(object):
         """Display the string name of the unit."""
         return self.UNITS.get(self.unit, "UNKNOWN")
 
-    def display(self):
+    def display(self, bucket=None):
         """Return a useful representation of this class."""
+        if bucket is None:
+            bucket = self
         return {
             "verb": self.verb,
             "URI": self.uri,
             "regex": self.regex,
             "value": self.value,
-            "remaining": int(self.remaining),
+            "remaining": int(bucket.remaining),
             "unit": self.display_unit(),
-            "resetTime": int(self.next_request or self._get_time()),
+            "resetTime": int(bucket.next_request or self._get_time()),
         }
 
+
+class LimitBucket(object):
+    """
+    The state of one `Limit` for one user.
+    """
+
+    __slots__ = ['water_level', 'last_request', 'next_request', 'remaining']
+
+    def __init__(self, limit):
+        self.water_level = 0
+        self.last_request = None
+        self.next_request = None
+        self.remaining = limit.value
+
+
+class LimitDispatcher(object):
+    """
+    Finds the limits that apply to a request with a single regular
+    expression match per HTTP verb.
+    """
+
+    def __init__(self, limits):
+        """
+        Initialize the new `LimitDispatcher`.
+
+        @param limits: List of `Limit` objects
+        """
+        self.limits = limits
+        indexes = {}
+        for index, limit in enumerate(limits):
+            indexes.setdefault(limit.verb, []).append(index)
+        self._verbs = {}
+        for verb, verb_indexes in indexes.items():
+            self._verbs[verb] = (self._compile(verb_indexes), verb_indexes)
+
+    def _compile(self, indexes):
+        # Each limit's regex goes in an optional lookahead with a group of
+        # its own, so one match() at the start of the url tells which of
+        # them match just as re.match() on each would.  Patterns using
+        # numbered backreferences, or too many for one regex, are matched
+        # one at a time instead.
+        regexes = [self.limits[index].regex for index in indexes]
+        if any(re.search(r'\\\d', regex) for regex in regexes):
+            return None
+        pattern = ''.join('(?:(?=(?P<limit%d>%s)))?' % (index, regex)
+                          for index, regex in zip(indexes, regexes))
+        try:
+            return re.compile(pattern)
+        except (re.error, AssertionError):
+            return None
+
+    def match(self, verb, url):
+        """Return the indexes of the limits that apply to a request."""
+        if verb not in self._verbs:
+            return []
+        combined, indexes = self._verbs[verb]
+        if combined is None:
+            return [index for index in indexes
+                    if self.limits[index].compiled_regex.match(url)]
+        match = combined.match(url)
+        return [index for index in indexes
+                if match.group('limit%d' % index) is not None]
+
 # "Limit" format is a dictionary with the HTTP verb, human-readable URI,
 # a regular-expression to match, value and unit of measure (PER_DAY, etc.)
 
@@ -238,7 +319,7 @@ class RateLimitingMiddleware(base_wsgi.Middleware):
         if limits is not None:
             limits = limiter.parse_limits(limits)
 
-        self._limiter = limiter(limits or DEFAULT_LIMITS, **kwargs)
+        self._limiter = limiter(limits=limits or DEFAULT_LIMITS, **kwargs)
 
     @wsgify(RequestClass=wsgi.Request)
     def __call__(self, req):
@@ -276,14 +357,17 @@ class Limiter(object):
     Rate-limit checking class which handles limits in memory.
     """
 
+    # Seconds between sweeps for users whose buckets have all drained
+    expire_interval = PER_MINUTE
+
     def __init__(self, limits, **kwargs):
         """
         Initialize the new `Limiter`.
 
         @param limits: List of `Limit` objects
         """
-        self.limits = copy.deepcopy(limits)
-        self.levels = defaultdict(lambda: copy.deepcopy(limits))
+        self.limits = list(limits)
+        self.levels = {}
 
         # Pick up any per-user limit information
         for key, value in kwargs.items():
@@ -291,11 +375,26 @@ class Limiter(object):
                 username = key[5:]
                 self.levels[username] = self.parse_limits(value)
 
+        self._dispatcher = LimitDispatcher(self.limits)
+        self._user_dispatchers = dict((username, LimitDispatcher(limits))
+                                      for username, limits
+                                      in self.levels.items())
+
+        # username -> {limit index: LimitBucket} for limits the user has hit
+        self._buckets = {}
+        self._last_expire = None
+
+    def _get_dispatcher(self, username):
+        return self._user_dispatchers.get(username, self._dispatcher)
+
     def get_limits(self, username=None):
         """
         Return the limits for a given user.
         """
-        return [limit.display() for limit in self.levels[username]]
+        limits = self._get_dispatcher(username).limits
+        buckets = self._buckets.get(username, {})
+        return [limit.display(buckets.get(index) or LimitBucket(limit))
+                for index, limit in enumerate(limits)]
 
     def check_for_delay(self, verb, url, username=None):
         """
@@ -303,10 +402,23 @@ class Limiter(object):
 
         @return: Tuple of delay (in seconds) and error message (or None, None)
         """
+        dispatcher = self._get_dispatcher(username)
+        indexes = dispatcher.match(verb, url)
+        if not indexes:
+            return None, None
+
+        now = dispatcher.limits[indexes[0]]._get_time()
+        self._expire_buckets(now)
+
+        buckets = self._buckets.setdefault(username, {})
         delays = []
 
-        for limit in self.levels[username]:
-            delay = limit(verb, url)
+        for index in indexes:
+            limit = dispatcher.limits[index]
+            bucket = buckets.get(index)
+            if bucket is None:
+                bucket = buckets[index] = LimitBucket(limit)
+            delay = limit.consume(bucket, now)
             if delay:
                 delays.append((delay, limit.error_message))
 
@@ -316,6 +428,28 @@ class Limiter(object):
 
         return None, None
 
+    def check_for_delays(self, checks):
+        """
+        Check a batch of (verb, url, username) triplets for limit.
+
+        @return: List of (delay, error) tuples in the order of checks
+        """
+        return [self.check_for_delay(verb, url, username)
+                for verb, url, username in checks]
+
+    def _expire_buckets(self, now):
+        """Forget users whose buckets have all drained."""
+        if (self._last_expire is not None and
+            now - self._last_expire < self.expire_interval):
+            return
+        self._last_expire = now
+
+        for username, buckets in self._buckets.items():
+            limits = self._get_dispatcher(username).limits
+            if all(limits[index].drained(bucket, now)
+                   for index, bucket in buckets.iteritems()):
+                del self._buckets[username]
+
     # Note: This method gets called before the class is instantiated,
     # so this must be either a static method or a class method.  It is
     # used to develop a list of limits to feed to the constructor.  We
@@ -391,6 +525,15 @@ class WsgiLimiter(object):
     and receive a 204 No Content, or a 403 Forbidden with an X-Wait-Seconds
     header containing the number of seconds to wait before the action would
     succeed.
+
+    Several checks can be made at once by POSTing to / instead:
+        {
+            "checks" : [{"verb" : GET, "path" : "/servers",
+                         "username" : "user1"}, ...]
+        }
+
+    and receiving a 200 OK with a "delays" list holding a [delay, error]
+    pair for each check, both null when the action may go ahead.
     """
 
     def __init__(self, limits=None):
@@ -417,6 +560,10 @@ class WsgiLimiter(object):
             raise webob.exc.HTTPBadRequest()
 
         username = request.path_info_pop()
+
+        if not username and "checks" in info:
+            return self._check_batch(info["checks"])
+
         verb = info.get("verb")
         path = info.get("path")
 
@@ -428,37 +575,168 @@ class WsgiLimiter(object):
         else:
             return webob.exc.HTTPNoContent()
 
+    def _check_batch(self, checks):
+        try:
+            checks = [(check.get("verb"), check.get("path"),
+                       check.get("username"))
+                      for check in checks]
+        except (AttributeError, TypeError):
+            raise webob.exc.HTTPBadRequest()
+
+        delays = []
+        for delay, error in self._limiter.check_for_delays(checks):
+            if delay:
+                delays.append(["%.2f" % delay, error])
+            else:
+                delays.append([None, None])
+
+        response = webob.Response(content_type="application/json")
+        response.body = json.dumps({"delays": delays})
+        return response
+
+
+class _UnixHTTPConnection(httplib.HTTPConnection):
+    """HTTP connection to a server listening on a unix socket."""
+
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, "localhost")
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
 
 class WsgiLimiterProxy(object):
     """
     Rate-limit requests based on answers from a remote source.
+
+    Every API worker pointed at the same `WsgiLimiter` shares its limits.
+    The limiter may listen on TCP or, for workers on one host, on a unix
+    socket given as "unix:/path/to/socket".  Checks made while a request
+    to the limiter is outstanding are queued and sent together in one
+    batch, so a busy worker makes one round trip per batch rather than
+    one per API request.
     """
 
-    def __init__(self, limiter_address):
+    def __init__(self, limiter_address, limits=None):
         """
         Initialize the new `WsgiLimiterProxy`.
 
-        @param limiter_address: IP/port combination of where to request limit
+        @param limiter_address: IP/port combination or "unix:" socket path
+                                of where to request limit
+        @param limits: Ignored, the remote limiter has its own limits
         """
         self.limiter_address = limiter_address
+        # Idle keep-alive connections to the limiter
+        self._connections = []
+        # Checks waiting for the next batch, as (check, event) pairs
+        self._pending = []
+        self._sending = False
+
+    def get_limits(self, username=None):
+        """
+        Return the limits for a given user, which the remote limiter
+        does not report.
+        """
+        return []
 
     def check_for_delay(self, verb, path, username=None):
-        body = json.dumps({"verb": verb, "path": path})
+        """
+        Check the given verb/path/user triplet for limit, batched with
+        any other checks made in the meantime.
+        """
+        done = event.Event()
+        self._pending.append(((verb, path, username), done))
+
+        # The first caller sends batches until nothing is left pending,
+        # the others wait for it to hand back their answers.
+        if not self._sending:
+            self._sending = True
+            try:
+                while self._pending:
+                    self._send_pending()
+            finally:
+                self._sending = False
+
+        return done.wait()
+
+    def _send_pending(self):
+        batch, self._pending = self._pending, []
+        checks = [check for check, _done in batch]
+        try:
+            if len(checks) == 1:
+                delays = [self._check_one(*checks[0])]
+            else:
+                delays = self.check_for_delays(checks)
+        except Exception, e:
+            for _check, done in batch:
+                done.send_exception(e)
+            return
+
+        for (_check, done), delay in zip(batch, delays):
+            done.send(delay)
+
+    def check_for_delays(self, checks):
+        """
+        Check a batch of (verb, path, username) triplets for limit in one
+        request to the limiter.
+
+        @return: List of (delay, error) tuples in the order of checks
+        """
+        body = json.dumps({"checks": [{"verb": verb,
+                                       "path": path,
+                                       "username": username}
+                                      for verb, path, username in checks]})
         headers = {"Content-Type": "application/json"}
 
-        conn = httplib.HTTPConnection(self.limiter_address)
+        resp, content = self._request("POST", "/", body, headers)
+        if not 200 <= resp.status < 300:
+            raise webob.exc.HTTPServiceUnavailable(
+                    explanation=_("Rate limiter returned %s") % resp.status)
+
+        return [tuple(delay) for delay in json.loads(content)["delays"]]
+
+    def _check_one(self, verb, path, username=None):
+        body = json.dumps({"verb": verb, "path": path})
+        headers = {"Content-Type": "application/json"}
 
         if username:
-            conn.request("POST", "/%s" % (username), body, headers)
+            url = "/%s" % (username)
         else:
-            conn.request("POST", "/", body, headers)
+            url = "/"
 
-        resp = conn.getresponse()
+        resp, content = self._request("POST", url, body, headers)
 
-        if 200 >= resp.status < 300:
+        if 200 <= resp.status < 300:
             return None, None
 
-        return resp.getheader("X-Wait-Seconds"), resp.read() or None
+        return resp.getheader("X-Wait-Seconds"), content or None
+
+    def _request(self, method, url, body, headers):
+        """Make a request, on an idle connection to the limiter if any."""
+        while self._connections:
+            conn = self._connections.pop()
+            try:
+                return self._request_on(conn, method, url, body, headers)
+            except (httplib.HTTPException, socket.error):
+                # The limiter closed the idle connection
+                conn.close()
+
+        if self.limiter_address.startswith("unix:"):
+            conn = _UnixHTTPConnection(self.limiter_address[5:])
+        else:
+            conn = httplib.HTTPConnection(self.limiter_address)
+        return self._request_on(conn, method, url, body, headers)
+
+    def _request_on(self, conn, method, url, body, headers):
+        conn.request(method, url, body, headers)
+        resp = conn.getresponse()
+        content = resp.read()
+        if not resp.will_close:
+            self._connections.append(conn)
+        return resp, content
 
     # Note: This method gets called before the class is instantiated,
     # so this must be either a static method or a class method.  It is
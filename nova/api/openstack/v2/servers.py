@@ -440,10 +440,24 @@ class Controller(wsgi.Controller):
                 # No 'changes-since', so we only want non-deleted servers
                 search_opts['deleted'] = False
 
-        instance_list = self.compute_api.get_all(context,
-                                                 search_opts=search_opts)
+        # Paging is done by the compute api (in the db where possible), so
+        # only our validated limit and marker are passed down.
+        search_opts.pop('limit', None)
+        search_opts.pop('marker', None)
+        page_params = common.get_pagination_params(req)
+        limit = min(FLAGS.osapi_max_limit,
+                    page_params.get('limit', FLAGS.osapi_max_limit))
+        search_opts['limit'] = limit
+        if 'marker' in page_params:
+            search_opts['marker'] = page_params['marker']
 
-        limited_list = self._limit_items(instance_list, req)
+        try:
+            instance_list = self.compute_api.get_all(context,
+                                                     search_opts=search_opts)
+        except exception.MarkerNotFound as e:
+            raise exc.HTTPBadRequest(explanation=unicode(e))
+
+        limited_list = instance_list[:limit]
         if is_detail:
             self._add_instance_faults(context, limited_list)
             return self._view_builder.detail(req, limited_list)
@@ -27,6 +27,7 @@ import os
 import shutil
 import string  # pylint: disable=W0402
 import tempfile
+import time
 import uuid
 import zipfile
 
@@ -75,6 +76,11 @@ flags.DEFINE_string('credential_rc_file', '%src',
                     'replaced by name of the region (nova by default)')
 flags.DEFINE_string('auth_driver', 'nova.auth.dbdriver.DbDriver',
                     'Driver that auth manager uses')
+flags.DEFINE_integer('auth_cache_ttl', 30,
+                     'Seconds to cache the user, project and roles behind '
+                     'an access key (0 disables the cache)')
+flags.DEFINE_integer('auth_cache_size', 1000,
+                     'Maximum number of access keys to cache credentials for')
 
 LOG = logging.getLogger('nova.auth.manager')
 
@@ -85,6 +91,75 @@ else:
     from nova.testing.fake import memcache
 
 
+class _CredentialCache(object):
+    """Least recently used cache of credentials with per-entry expiry.
+
+    Entries are tagged with the user and project they were built from so
+    changes made through AuthManager can drop them; the ttl bounds
+    staleness for changes made by other processes.
+    """
+
+    def __init__(self):
+        # key -> [expires, last_used, user_id, project_id, value]
+        self._entries = {}
+        self._clock = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._entries[key]
+            return None
+        self._clock += 1
+        entry[1] = self._clock
+        return entry[4]
+
+    def set(self, key, value, user_id=None, project_id=None):
+        if FLAGS.auth_cache_ttl <= 0 or FLAGS.auth_cache_size <= 0:
+            return
+        if (key not in self._entries and
+            len(self._entries) >= FLAGS.auth_cache_size):
+            self._evict()
+        self._clock += 1
+        self._entries[key] = [time.time() + FLAGS.auth_cache_ttl,
+                              self._clock, user_id, project_id, value]
+
+    def _evict(self):
+        now = time.time()
+        expired = [key for key, entry in self._entries.iteritems()
+                   if entry[0] < now]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) >= FLAGS.auth_cache_size:
+            oldest = min(self._entries, key=lambda k: self._entries[k][1])
+            del self._entries[oldest]
+
+    def invalidate(self, user_id=None, project_id=None):
+        for key, entry in self._entries.items():
+            if ((user_id is not None and entry[2] == user_id) or
+                (project_id is not None and entry[3] == project_id)):
+                del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# "access:project" -> (User, Project, Signer) for authenticated requests.
+_CREDENTIALS = _CredentialCache()
+# (user id, project id) -> active roles.
+_ROLES = _CredentialCache()
+
+
+def invalidate_credentials(user_id=None, project_id=None):
+    """Drop cached credentials and roles of a user or project."""
+    _CREDENTIALS.invalidate(user_id=user_id, project_id=project_id)
+    _ROLES.invalidate(user_id=user_id, project_id=project_id)
+
+
 class AuthBase(object):
     """Base class for objects relating to auth
 
@@ -272,6 +347,47 @@ class AuthManager(object):
         @return: User and project that the request represents.
         """
         # TODO(vish): check for valid timestamp
+        (user, project, sign) = self._get_credentials(access)
+
+        if check_type == 's3':
+            expected_signature = sign.s3_authorization(headers, verb, path)
+            LOG.debug(_('expected_signature: %s'), expected_signature)
+            LOG.debug(_('signature: %s'), signature)
+            if signature != expected_signature:
+                LOG.audit(_("Invalid signature for user %s"), user.name)
+                raise exception.InvalidSignature(signature=signature,
+                                                 user=user)
+        elif check_type == 'ec2':
+            expected_signature = sign.generate(params, verb, server_string,
+                                               path)
+            LOG.debug(_('expected_signature: %s'), expected_signature)
+            LOG.debug(_('signature: %s'), signature)
+            if signature != expected_signature:
+                (addr_str, port_str) = utils.parse_server_string(server_string)
+                # If the given server_string contains port num, try without it.
+                if port_str != '':
+                    host_only_signature = sign.generate(params, verb,
+                                                        addr_str, path)
+                    LOG.debug(_('host_only_signature: %s'),
+                              host_only_signature)
+                    if signature == host_only_signature:
+                        return (user, project)
+                LOG.audit(_("Invalid signature for user %s"), user.name)
+                raise exception.InvalidSignature(signature=signature,
+                                                 user=user)
+        return (user, project)
+
+    def _get_credentials(self, access):
+        """Look up the user, project and signer for an access key.
+
+        Successful lookups are cached for FLAGS.auth_cache_ttl seconds, so
+        a client making many requests only hits the auth driver once.
+        Failed lookups are not cached.
+        """
+        credentials = _CREDENTIALS.get(access)
+        if credentials is not None:
+            return credentials
+
         (access_key, _sep, project_id) = access.partition(':')
 
         LOG.debug(_('Looking up user: %r'), access_key)
@@ -304,39 +420,13 @@ class AuthManager(object):
                     " and not member of project %(pjname)s") % locals())
             raise exception.ProjectMembershipNotFound(project_id=pjid,
                                                       user_id=uid)
-        if check_type == 's3':
-            sign = signer.Signer(user.secret.encode())
-            expected_signature = sign.s3_authorization(headers, verb, path)
-            LOG.debug(_('user.secret: %s'), user.secret)
-            LOG.debug(_('expected_signature: %s'), expected_signature)
-            LOG.debug(_('signature: %s'), signature)
-            if signature != expected_signature:
-                LOG.audit(_("Invalid signature for user %s"), user.name)
-                raise exception.InvalidSignature(signature=signature,
-                                                 user=user)
-        elif check_type == 'ec2':
-            # NOTE(vish): hmac can't handle unicode, so encode ensures that
-            #             secret isn't unicode
-            expected_signature = signer.Signer(user.secret.encode()).generate(
-                    params, verb, server_string, path)
-            LOG.debug(_('user.secret: %s'), user.secret)
-            LOG.debug(_('expected_signature: %s'), expected_signature)
-            LOG.debug(_('signature: %s'), signature)
-            if signature != expected_signature:
-                (addr_str, port_str) = utils.parse_server_string(server_string)
-                # If the given server_string contains port num, try without it.
-                if port_str != '':
-                    host_only_signature = signer.Signer(
-                        user.secret.encode()).generate(params, verb,
-                                                       addr_str, path)
-                    LOG.debug(_('host_only_signature: %s'),
-                              host_only_signature)
-                    if signature == host_only_signature:
-                        return (user, project)
-                LOG.audit(_("Invalid signature for user %s"), user.name)
-                raise exception.InvalidSignature(signature=signature,
-                                                 user=user)
-        return (user, project)
+
+        # NOTE(vish): hmac can't handle unicode, so encode ensures that
+        #             secret isn't unicode
+        credentials = (user, project, signer.Signer(user.secret.encode()))
+        _CREDENTIALS.set(access, credentials, user_id=user.id,
+                         project_id=project.id)
+        return credentials
 
     def get_access_key(self, user, project):
         """Get an access key that includes user and project"""
@@ -474,6 +564,7 @@ class AuthManager(object):
         with self.driver() as drv:
             self._clear_mc_key(uid, role, pid)
             drv.add_role(uid, role, pid)
+        invalidate_credentials(user_id=uid)
 
     def remove_role(self, user, role, project=None):
         """Removes role for user
@@ -503,6 +594,7 @@ class AuthManager(object):
         with self.driver() as drv:
             self._clear_mc_key(uid, role, pid)
             drv.remove_role(uid, role, pid)
+        invalidate_credentials(user_id=uid)
 
     @staticmethod
     def get_roles(project_roles=True):
@@ -520,11 +612,19 @@ class AuthManager(object):
 
     def get_active_roles(self, user, project=None):
         """Get all active roles for context"""
+        key = (User.safe_id(user), Project.safe_id(project))
+        active_roles = _ROLES.get(key)
+        if active_roles is not None:
+            return list(active_roles)
         if project:
             roles = FLAGS.allowed_roles + ['projectmanager']
         else:
             roles = FLAGS.global_roles
-        return [role for role in roles if self.has_role(user, role, project)]
+        active_roles = [role for role in roles
+                        if self.has_role(user, role, project)]
+        _ROLES.set(key, tuple(active_roles), user_id=key[0],
+                   project_id=key[1])
+        return active_roles
 
     def get_project(self, pid):
         """Get project object by id"""
@@ -596,6 +696,7 @@ class AuthManager(object):
             drv.modify_project(Project.safe_id(project),
                                manager_user,
                                description)
+        invalidate_credentials(project_id=Project.safe_id(project))
 
     def add_to_project(self, user, project):
         """Add user to project"""
@@ -603,8 +704,10 @@ class AuthManager(object):
         pid = Project.safe_id(project)
         LOG.audit(_("Adding user %(uid)s to project %(pid)s") % locals())
         with self.driver() as drv:
-            return drv.add_to_project(User.safe_id(user),
-                                      Project.safe_id(project))
+            result = drv.add_to_project(User.safe_id(user),
+                                        Project.safe_id(project))
+        invalidate_credentials(project_id=pid)
+        return result
 
     def is_project_manager(self, user, project):
         """Checks if user is project manager"""
@@ -624,7 +727,9 @@ class AuthManager(object):
         pid = Project.safe_id(project)
         LOG.audit(_("Remove user %(uid)s from project %(pid)s") % locals())
         with self.driver() as drv:
-            return drv.remove_from_project(uid, pid)
+            result = drv.remove_from_project(uid, pid)
+        invalidate_credentials(project_id=pid)
+        return result
 
     @staticmethod
     def get_project_vpn_data(project):
@@ -655,6 +760,7 @@ class AuthManager(object):
         LOG.audit(_("Deleting project %s"), Project.safe_id(project))
         with self.driver() as drv:
             drv.delete_project(Project.safe_id(project))
+        invalidate_credentials(project_id=Project.safe_id(project))
 
     def get_user(self, uid):
         """Retrieves a user by id"""
@@ -724,6 +830,7 @@ class AuthManager(object):
                                         uid)
         with self.driver() as drv:
             drv.delete_user(uid)
+        invalidate_credentials(user_id=uid)
 
     def modify_user(self, user, access_key=None, secret_key=None, admin=None):
         """Modify credentials for a user"""
@@ -737,6 +844,7 @@ class AuthManager(object):
                     " for user %(uid)s") % locals())
         with self.driver() as drv:
             drv.modify_user(uid, access_key, secret_key, admin)
+        invalidate_credentials(user_id=uid)
 
     def get_credentials(self, user, project=None, use_dmz=True):
         """Get credential zip for user in project"""
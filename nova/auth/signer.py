@@ -61,7 +61,11 @@ LOG = logging.getLogger('nova.signer')
 
 
 class Signer(object):
-    """Hacked up code from boto/connection.py"""
+    """Hacked up code from boto/connection.py
+
+    The keyed hmac objects are only ever copied, never updated, so one
+    Signer can sign any number of requests for the same secret key.
+    """
 
     def __init__(self, secret_key):
         self.hmac = hmac.new(secret_key, digestmod=hashlib.sha1)
@@ -106,26 +110,28 @@ class Signer(object):
     def _calc_signature_0(self, params):
         """Generate AWS signature version 0 string."""
         s = params['Action'] + params['Timestamp']
-        self.hmac.update(s)
+        hmac_copy = self.hmac.copy()
+        hmac_copy.update(s)
         keys = params.keys()
         keys.sort(cmp=lambda x, y: cmp(x.lower(), y.lower()))
         pairs = []
         for key in keys:
             val = self._get_utf8_value(params[key])
             pairs.append(key + '=' + urllib.quote(val))
-        return base64.b64encode(self.hmac.digest())
+        return base64.b64encode(hmac_copy.digest())
 
     def _calc_signature_1(self, params):
         """Generate AWS signature version 1 string."""
         keys = params.keys()
         keys.sort(cmp=lambda x, y: cmp(x.lower(), y.lower()))
         pairs = []
+        hmac_copy = self.hmac.copy()
         for key in keys:
-            self.hmac.update(key)
+            hmac_copy.update(key)
             val = self._get_utf8_value(params[key])
-            self.hmac.update(val)
+            hmac_copy.update(val)
             pairs.append(key + '=' + urllib.quote(val))
-        return base64.b64encode(self.hmac.digest())
+        return base64.b64encode(hmac_copy.digest())
 
     def _calc_signature_2(self, params, verb, server_string, path):
         """Generate AWS signature version 2 string."""
@@ -138,9 +144,9 @@ class Signer(object):
         if params['SignatureMethod'] == 'HmacSHA256':
             if not self.hmac_256:
                 raise exception.Error('SHA256 not supported on this server')
-            current_hmac = self.hmac_256
+            current_hmac = self.hmac_256.copy()
         elif params['SignatureMethod'] == 'HmacSHA1':
-            current_hmac = self.hmac
+            current_hmac = self.hmac.copy()
         else:
             raise exception.Error('SignatureMethod %s not supported'
                                   % params['SignatureMethod'])
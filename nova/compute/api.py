@@ -30,6 +30,7 @@ from nova import block_device
 from nova.compute import instance_types
 from nova.compute import power_state
 from nova.compute import task_states
+from nova.compute import utils as compute_utils
 from nova.compute import vm_states
 from nova.db import base
 from nova import exception
@@ -88,6 +89,31 @@ def check_instance_state(vm_state=None, task_state=None):
     return outer
 
 
+def _resize_quota_deltas(old_instance_type, new_instance_type, sense):
+    """Return the cores and ram quota deltas of a resize.
+
+    sense=1 keeps the increases, which are reserved when the resize
+    starts; sense=-1 keeps the decreases, which only apply once the resize
+    is confirmed.
+    """
+    deltas = {}
+    for resource, field in (('cores', 'vcpus'), ('ram', 'memory_mb')):
+        delta = new_instance_type[field] - old_instance_type[field]
+        if delta * sense > 0:
+            deltas[resource] = delta
+    return deltas
+
+
+def _migration_instance_types(migration_ref):
+    """Return the (old, new) instance types of a migration, or None."""
+    old_id = migration_ref['old_instance_type_id']
+    new_id = migration_ref['new_instance_type_id']
+    if old_id is None or new_id is None or old_id == new_id:
+        return None
+    return (instance_types.get_instance_type(old_id),
+            instance_types.get_instance_type(new_id))
+
+
 class API(base.Base):
     """API for interacting with the compute manager."""
 
@@ -307,32 +333,61 @@ class API(base.Base):
 
         LOG.debug(_("Going to run %s instances...") % num_instances)
 
-        if create_instance_here:
-            instance = self.create_db_entry_for_new_instance(
-                    context, instance_type, image, base_options,
-                    security_group, block_device_mapping)
-            # Tells scheduler we created the instance already.
-            base_options['uuid'] = instance['uuid']
-            rpc_method = rpc.cast
-        else:
-            # We need to wait for the scheduler to create the instance
-            # DB entries, because the instance *could* be # created in
-            # a child zone.
-            rpc_method = rpc.call
-
-        # TODO(comstud): We should use rpc.multicall when we can
-        # retrieve the full instance dictionary from the scheduler.
-        # Otherwise, we could exceed the AMQP max message size limit.
-        # This would require the schedulers' schedule_run_instances
-        # methods to return an iterator vs a list.
-        instances = self._schedule_run_instance(
-                rpc_method,
-                context, base_options,
-                instance_type, zone_blob,
-                availability_zone, injected_files,
-                admin_password, image,
-                num_instances, requested_networks,
-                block_device_mapping, security_group)
+        try:
+            reservations = quota.reserve(context,
+                    instances=num_instances,
+                    cores=num_instances * instance_type['vcpus'],
+                    ram=num_instances * instance_type['memory_mb'])
+        except exception.OverQuota:
+            # Another request used up the quota since it was checked above
+            pid = context.project_id
+            LOG.warn(_("Quota exceeded for %(pid)s,"
+                    " tried to run %(num_instances)s instances") % locals())
+            message = _("Instance quota exceeded. You cannot run any "
+                        "more instances of this type.")
+            raise exception.QuotaError(message, "InstanceLimitExceeded")
+
+        try:
+            if create_instance_here:
+                instance = self.create_db_entry_for_new_instance(
+                        context, instance_type, image, base_options,
+                        security_group, block_device_mapping)
+                # Tells scheduler we created the instance already.
+                base_options['uuid'] = instance['uuid']
+                rpc_method = rpc.cast
+            else:
+                # We need to wait for the scheduler to create the instance
+                # DB entries, because the instance *could* be # created in
+                # a child zone.
+                rpc_method = rpc.call
+
+            # TODO(comstud): We should use rpc.multicall when we can
+            # retrieve the full instance dictionary from the scheduler.
+            # Otherwise, we could exceed the AMQP max message size limit.
+            # This would require the schedulers' schedule_run_instances
+            # methods to return an iterator vs a list.
+            instances = self._schedule_run_instance(
+                    rpc_method,
+                    context, base_options,
+                    instance_type, zone_blob,
+                    availability_zone, injected_files,
+                    admin_password, image,
+                    num_instances, requested_networks,
+                    block_device_mapping, security_group)
+        except Exception:
+            with utils.save_and_reraise_exception():
+                quota.rollback(context, reservations)
+        quota.commit(context, reservations)
+
+        if not create_instance_here and instances is not None:
+            # The scheduler may have created fewer instances than asked
+            # for; give the quota for the rest back.
+            unused = num_instances - len(instances)
+            if unused > 0:
+                quota.commit(context, quota.reserve(context,
+                        instances=-unused,
+                        cores=-unused * instance_type['vcpus'],
+                        ram=-unused * instance_type['memory_mb']))
 
         if create_instance_here:
             return ([instance], reservation_id)
@@ -794,7 +849,7 @@ class API(base.Base):
         else:
             LOG.warning(_("No host for instance %s, deleting immediately"),
                         instance["uuid"])
-            self.db.instance_destroy(context, instance['id'])
+            compute_utils.destroy_instance_record(context, instance)
 
     def _delete(self, context, instance):
         host = instance['host']
@@ -807,7 +862,7 @@ class API(base.Base):
             self._cast_compute_message('terminate_instance', context,
                                        instance['uuid'], host)
         else:
-            self.db.instance_destroy(context, instance['id'])
+            compute_utils.destroy_instance_record(context, instance)
 
     # NOTE(jerdfelt): The API implies that only ACTIVE and ERROR are
     # allowed but the EC2 API appears to allow from RESCUED and STOPPED
@@ -931,6 +986,10 @@ class API(base.Base):
 
         Deleted instances will be returned by default, unless there is a
         search option that says otherwise.
+
+        The 'limit' and 'marker' search options return one page of
+        instances following the instance with uuid marker.  Unless zone
+        routing is enabled the page is fetched directly from the db.
         """
 
         if search_opts is None:
@@ -938,6 +997,10 @@ class API(base.Base):
 
         LOG.debug(_("Searching by: %s") % str(search_opts))
 
+        search_opts = search_opts.copy()
+        limit = search_opts.pop('limit', None)
+        marker = search_opts.pop('marker', None)
+
         # Fixups for the DB call
         filters = {}
 
@@ -980,7 +1043,15 @@ class API(base.Base):
 
         local_zone_only = search_opts.get('local_zone_only', False)
 
-        inst_models = self._get_instances_by_filters(context, filters)
+        # With zone routing a page can span zones, so the combined list
+        # is paged below instead.
+        page_in_db = local_zone_only or not FLAGS.enable_zone_routing
+        if page_in_db:
+            inst_models = self._get_instances_by_filters(context, filters,
+                                                         limit=limit,
+                                                         marker=marker)
+        else:
+            inst_models = self._get_instances_by_filters(context, filters)
 
         # Convert the models to dictionaries
         instances = []
@@ -1009,9 +1080,19 @@ class API(base.Base):
                 server._info['_is_precooked'] = True
                 instances.append(server._info)
 
+        if marker is not None and not page_in_db:
+            for i, instance in enumerate(instances):
+                if marker in (instance.get('uuid'), instance.get('id')):
+                    instances = instances[i + 1:]
+                    break
+            else:
+                raise exception.MarkerNotFound(marker=marker)
+        if limit is not None:
+            instances = instances[:limit]
         return instances
 
-    def _get_instances_by_filters(self, context, filters):
+    def _get_instances_by_filters(self, context, filters, limit=None,
+                                  marker=None):
         if 'ip6' in filters or 'ip' in filters:
             res = self.network_api.get_instance_uuids_by_ip_filter(context,
                                                                    filters)
@@ -1020,7 +1101,11 @@ class API(base.Base):
             uuids = set([r['instance_uuid'] for r in res])
             filters['uuid'] = uuids
 
-        return self.db.instance_get_all_by_filters(context, filters)
+        if limit is None and marker is None:
+            return self.db.instance_get_all_by_filters(context, filters)
+        return self.db.instance_get_all_by_filters(context, filters,
+                                                   limit=limit,
+                                                   marker=marker)
 
     def _cast_compute_message(self, method, context, instance_uuid, host=None,
                               params=None):
@@ -1233,12 +1318,25 @@ class API(base.Base):
             raise exception.MigrationNotFoundByStatus(
                     instance_id=instance['uuid'], status='finished')
 
+        # Give back the increases reserved when the resize started; the
+        # compute host commits this once the old flavor is restored.
+        reservations = None
+        types = _migration_instance_types(migration_ref)
+        if types:
+            deltas = _resize_quota_deltas(types[0], types[1], 1)
+            if deltas:
+                reservations = quota.reserve(context,
+                        project_id=instance['project_id'],
+                        **dict((resource, -delta)
+                               for resource, delta in deltas.items()))
+
         self.update(context,
                     instance,
                     vm_state=vm_states.ACTIVE,
                     task_state=None)
 
-        params = {'migration_id': migration_ref['id']}
+        params = {'migration_id': migration_ref['id'],
+                  'reservations': reservations}
         self._cast_compute_message('revert_resize', context,
                                    instance['uuid'],
                                    migration_ref['dest_compute'],
@@ -1275,6 +1373,14 @@ class API(base.Base):
         self.db.instance_update(context, instance['uuid'],
                 {'host': migration_ref['dest_compute'], })
 
+        # The instance already has the new flavor, so decreases apply now.
+        types = _migration_instance_types(migration_ref)
+        if types:
+            deltas = _resize_quota_deltas(types[0], types[1], -1)
+            if deltas:
+                quota.commit(context, quota.reserve(context,
+                        project_id=instance['project_id'], **deltas))
+
     @check_instance_state(vm_state=[vm_states.ACTIVE],
                           task_state=[None])
     @scheduler_api.reroute_compute("resize")
@@ -1308,6 +1414,23 @@ class API(base.Base):
         if (current_memory_mb == new_memory_mb) and flavor_id:
             raise exception.CannotResizeToSameSize()
 
+        # Reserve the increases now; the compute host commits them when it
+        # gives the instance the new flavor.
+        reservations = None
+        deltas = _resize_quota_deltas(current_instance_type,
+                                      new_instance_type, 1)
+        if deltas:
+            try:
+                reservations = quota.reserve(context,
+                        project_id=instance['project_id'], **deltas)
+            except exception.OverQuota:
+                pid = instance['project_id']
+                LOG.warn(_("Quota exceeded for %(pid)s,"
+                        " tried to resize instance") % locals())
+                message = _("Quota exceeded. You cannot resize this "
+                            "instance to %s.") % new_instance_type_name
+                raise exception.QuotaError(message, "InstanceLimitExceeded")
+
         self.update(context,
                     instance,
                     vm_state=vm_states.RESIZING,
@@ -1328,6 +1451,7 @@ class API(base.Base):
                               "instance_uuid": instance['uuid'],
                               "update_db": False,
                               "instance_type_id": new_instance_type['id'],
+                              "reservations": reservations,
                               "request_spec": request_spec}})
 
     @scheduler_api.reroute_compute("add_fixed_ip")
@@ -1397,6 +1521,17 @@ class API(base.Base):
         return self._call_compute_message_for_host("host_power_action",
                 context, host=host, params={"action": action})
 
+    def prefetch_images(self, context, image_ids, host=None):
+        """Warm the image cache of one compute host, or all of them, with
+        the given images so instances booted from them start sooner."""
+        kwargs = {'method': 'prefetch_images',
+                  'args': {'image_ids': image_ids}}
+        if host:
+            queue = self.db.queue_get_for(context, FLAGS.compute_topic, host)
+            rpc.cast(context, queue, kwargs)
+        else:
+            rpc.fanout_cast(context, FLAGS.compute_topic, kwargs)
+
     @scheduler_api.reroute_compute("diagnostics")
     def get_diagnostics(self, context, instance):
         """Retrieve diagnostics for the given instance."""
@@ -47,6 +47,7 @@ import nova.context
 from nova.compute import instance_types
 from nova.compute import power_state
 from nova.compute import task_states
+from nova.compute import utils as compute_utils
 from nova.compute.utils import notify_usage_exists
 from nova.compute import vm_states
 from nova import exception
@@ -56,7 +57,9 @@ from nova import log as logging
 from nova import manager
 from nova import network
 from nova.notifier import api as notifier
+from nova import quota
 from nova import rpc
+from nova.scheduler import api as scheduler_api
 from nova import utils
 from nova.virt import driver
 from nova import volume
@@ -92,6 +95,13 @@ flags.DEFINE_integer("running_deleted_instance_timeout", 0,
 flags.DEFINE_integer("running_deleted_instance_poll_interval", 30,
                      "Number of periodic scheduler ticks to wait between"
                      " runs of the cleanup task.")
+flags.DEFINE_integer("power_state_sync_max_backoff", 8,
+                     "Maximum number of periodic scheduler ticks to skip"
+                     " between power state syncs while they find nothing"
+                     " to change. Set to 0 to sync on every tick.")
+flags.DEFINE_integer("image_cache_manager_interval", 40 * 60,
+                     "Number of seconds between runs of the image cache"
+                     " manager, which evicts unused cached images.")
 flags.DEFINE_string("running_deleted_instance_action", "noop",
                      "Action to take if a running deleted instance is"
                      " detected. Valid options are 'noop', 'log', and"
@@ -179,6 +189,8 @@ class ComputeManager(manager.SchedulerDependentManager):
         self.network_manager = utils.import_object(FLAGS.network_manager)
         self._last_host_check = 0
         self._last_bw_usage_poll = 0
+        self._power_state_sync_backoff = 0
+        self._power_state_sync_ticks_to_skip = 0
         super(ComputeManager, self).__init__(service_name="compute",
                                              *args, **kwargs)
 
@@ -376,6 +388,7 @@ class ComputeManager(manager.SchedulerDependentManager):
             except Exception:
                 with utils.save_and_reraise_exception():
                     self._deallocate_network(context, instance)
+            scheduler_api.update_instance_info(context, self.host, instance)
             self._notify_about_instance_usage(instance)
             if self._is_instance_terminated(instance_uuid):
                 raise exception.InstanceNotFound
@@ -586,7 +599,7 @@ class ComputeManager(manager.SchedulerDependentManager):
             self.network_api.deallocate_for_instance(context, instance)
 
         if instance['power_state'] == power_state.SHUTOFF:
-            self.db.instance_destroy(context, instance_id)
+            compute_utils.destroy_instance_record(context, instance)
             raise exception.Error(_('trying to destroy already destroyed'
                                     ' instance: %s') % instance_uuid)
         # NOTE(vish) get bdms before destroying the instance
@@ -625,7 +638,8 @@ class ComputeManager(manager.SchedulerDependentManager):
                               task_state=None,
                               terminated_at=utils.utcnow())
 
-        self.db.instance_destroy(context, instance_id)
+        compute_utils.destroy_instance_record(context, instance)
+        scheduler_api.delete_instance_info(context, instance['uuid'])
 
         usage_info = utils.usage_from_instance(instance)
         notifier.notify('compute.%s' % self.host,
@@ -1052,7 +1066,8 @@ class ComputeManager(manager.SchedulerDependentManager):
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     @checks_instance_lock
     @wrap_instance_fault
-    def revert_resize(self, context, instance_uuid, migration_id):
+    def revert_resize(self, context, instance_uuid, migration_id,
+                      reservations=None):
         """Destroys the new instance on the destination machine.
 
         Reverts the model changes, and powers on the old instance on the
@@ -1070,13 +1085,15 @@ class ComputeManager(manager.SchedulerDependentManager):
         rpc.cast(context, topic,
                 {'method': 'finish_revert_resize',
                  'args': {'instance_uuid': instance_ref['uuid'],
-                          'migration_id': migration_ref['id']},
+                          'migration_id': migration_ref['id'],
+                          'reservations': reservations},
                 })
 
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     @checks_instance_lock
     @wrap_instance_fault
-    def finish_revert_resize(self, context, instance_uuid, migration_id):
+    def finish_revert_resize(self, context, instance_uuid, migration_id,
+                             reservations=None):
         """Finishes the second half of reverting a resize.
 
         Power back on the source instance and revert the resized attributes
@@ -1099,10 +1116,16 @@ class ComputeManager(manager.SchedulerDependentManager):
                               vcpus=instance_type['vcpus'],
                               local_gb=instance_type['local_gb'],
                               instance_type_id=instance_type['id'])
+        quota.commit(context, reservations)
 
         self.driver.finish_revert_migration(instance_ref)
         self.db.migration_update(context, migration_id,
                 {'status': 'reverted'})
+        scheduler_api.update_instance_info(context,
+                migration_ref['source_compute'],
+                dict(uuid=instance_ref['uuid'],
+                     local_gb=instance_type['local_gb'],
+                     memory_mb=instance_type['memory_mb']))
         usage_info = utils.usage_from_instance(instance_ref)
         notifier.notify('compute.%s' % self.host,
                             'compute.instance.resize.revert',
@@ -1112,7 +1135,8 @@ class ComputeManager(manager.SchedulerDependentManager):
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     @checks_instance_lock
     @wrap_instance_fault
-    def prep_resize(self, context, instance_uuid, instance_type_id):
+    def prep_resize(self, context, instance_uuid, instance_type_id,
+                    reservations=None):
         """Initiates the process of moving a running instance to another host.
 
         Possibly changes the RAM and disk size in the process.
@@ -1124,6 +1148,7 @@ class ComputeManager(manager.SchedulerDependentManager):
 
         same_host = instance_ref['host'] == FLAGS.host
         if same_host and not FLAGS.allow_resize_to_same_host:
+            quota.rollback(context, reservations)
             self._instance_update(context,
                                   instance_uuid,
                                   vm_state=vm_states.ERROR)
@@ -1151,7 +1176,8 @@ class ComputeManager(manager.SchedulerDependentManager):
         rpc.cast(context, topic,
                 {'method': 'resize_instance',
                  'args': {'instance_uuid': instance_ref['uuid'],
-                          'migration_id': migration_ref['id']}})
+                          'migration_id': migration_ref['id'],
+                          'reservations': reservations}})
 
         usage_info = utils.usage_from_instance(instance_ref,
                               new_instance_type=new_instance_type['name'],
@@ -1164,7 +1190,8 @@ class ComputeManager(manager.SchedulerDependentManager):
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     @checks_instance_lock
     @wrap_instance_fault
-    def resize_instance(self, context, instance_uuid, migration_id):
+    def resize_instance(self, context, instance_uuid, migration_id,
+                        reservations=None):
         """Starts the migration of a running instance to another host."""
         migration_ref = self.db.migration_get(context, migration_id)
         instance_ref = self.db.instance_get_by_uuid(context,
@@ -1184,6 +1211,7 @@ class ComputeManager(manager.SchedulerDependentManager):
             with utils.save_and_reraise_exception():
                 msg = _('%s. Setting instance vm_state to ERROR')
                 LOG.error(msg % error)
+                quota.rollback(context, reservations)
                 self._instance_update(context,
                                       instance_uuid,
                                       vm_state=vm_states.ERROR)
@@ -1199,14 +1227,16 @@ class ComputeManager(manager.SchedulerDependentManager):
                                       migration_ref['dest_compute'])
         params = {'migration_id': migration_id,
                   'disk_info': disk_info,
-                  'instance_uuid': instance_ref['uuid']}
+                  'instance_uuid': instance_ref['uuid'],
+                  'reservations': reservations}
         rpc.cast(context, topic, {'method': 'finish_resize',
                                   'args': params})
 
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     @checks_instance_lock
     @wrap_instance_fault
-    def finish_resize(self, context, instance_uuid, migration_id, disk_info):
+    def finish_resize(self, context, instance_uuid, migration_id, disk_info,
+                      reservations=None):
         """Completes the migration process.
 
         Sets up the newly transferred disk and turns on the instance at its
@@ -1229,6 +1259,8 @@ class ComputeManager(manager.SchedulerDependentManager):
                         vcpus=instance_type['vcpus'],
                         local_gb=instance_type['local_gb']))
             resize_instance = True
+        # Usage now matches the flavor recorded for the instance.
+        quota.commit(context, reservations)
 
         instance_ref = self.db.instance_get_by_uuid(context,
                                             instance_ref.uuid)
@@ -1255,6 +1287,8 @@ class ComputeManager(manager.SchedulerDependentManager):
                               vm_state=vm_states.ACTIVE,
                               host=migration_ref['dest_compute'],
                               task_state=task_states.RESIZE_VERIFY)
+        scheduler_api.update_instance_info(context,
+                migration_ref['dest_compute'], instance_ref)
 
         self.db.migration_update(context, migration_id,
                 {'status': 'finished', })
@@ -1345,6 +1379,14 @@ class ComputeManager(manager.SchedulerDependentManager):
         """Sets the specified host's ability to accept new instances."""
         return self.driver.set_host_enabled(host, enabled)
 
+    @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
+    def prefetch_images(self, context, image_ids=None):
+        """Download images into the hypervisor's image cache."""
+        try:
+            self.driver.prefetch_images(context, image_ids or [])
+        except NotImplementedError:
+            LOG.debug(_("Driver has no image cache, not prefetching"))
+
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     @wrap_instance_fault
     def get_diagnostics(self, context, instance_uuid):
@@ -1973,13 +2015,20 @@ class ComputeManager(manager.SchedulerDependentManager):
                 # they just don't get the info in the usage events.
                 return
 
+            network_labels = {}
+            usages = []
             for usage in bw_usage:
                 vif = usage['virtual_interface']
-                self.db.bw_usage_update(context,
-                                        vif.instance_id,
-                                        vif.network.label,
-                                        start_time,
-                                        usage['bw_in'], usage['bw_out'])
+                network_id = vif.network_id
+                if network_id not in network_labels:
+                    network = self.db.network_get(context, network_id)
+                    network_labels[network_id] = network['label']
+                usages.append(dict(instance_id=vif.instance_id,
+                                   network_label=network_labels[network_id],
+                                   bw_in=usage['bw_in'],
+                                   bw_out=usage['bw_out']))
+            if usages:
+                self.db.bw_usage_update_all(context, start_time, usages)
 
     @manager.periodic_task
     def _report_driver_status(self, context):
@@ -2002,10 +2051,19 @@ class ComputeManager(manager.SchedulerDependentManager):
         then it will be set to power_state.NOSTATE, because it doesn't exist
         on the hypervisor.
 
+        Changes are written back in one bulk update. While nothing changes
+        the sync backs off, skipping up to power_state_sync_max_backoff
+        ticks between runs.
+
         """
+        if self._power_state_sync_ticks_to_skip > 0:
+            self._power_state_sync_ticks_to_skip -= 1
+            return
+
         vm_instances = self.driver.list_instances_detail()
         vm_instances = dict((vm.name, vm) for vm in vm_instances)
-        db_instances = self.db.instance_get_all_by_host(context, self.host)
+        db_instances = self.db.instance_get_power_states_by_host(context,
+                                                                 self.host)
 
         num_vm_instances = len(vm_instances)
         num_db_instances = len(db_instances)
@@ -2014,6 +2072,8 @@ class ComputeManager(manager.SchedulerDependentManager):
             LOG.info(_("Found %(num_db_instances)s in the database and "
                        "%(num_vm_instances)s on the hypervisor.") % locals())
 
+        # { <power_state> : [instance_id, ...] }
+        power_states = {}
         for db_instance in db_instances:
             name = db_instance["name"]
             db_power_state = db_instance['power_state']
@@ -2027,9 +2087,19 @@ class ComputeManager(manager.SchedulerDependentManager):
             if vm_power_state == db_power_state:
                 continue
 
-            self._instance_update(context,
-                                  db_instance["id"],
-                                  power_state=vm_power_state)
+            power_states.setdefault(vm_power_state, []).append(
+                    db_instance["id"])
+
+        if power_states:
+            self.db.instance_update_power_states(context, power_states)
+            self._power_state_sync_backoff = 0
+        else:
+            # Nothing changed, so back off: skip 1, 2, 4, ... ticks up to
+            # power_state_sync_max_backoff before syncing again.
+            self._power_state_sync_backoff = min(
+                    max(1, self._power_state_sync_backoff * 2),
+                    FLAGS.power_state_sync_max_backoff)
+        self._power_state_sync_ticks_to_skip = self._power_state_sync_backoff
 
     @manager.periodic_task
     def _reclaim_queued_deletes(self, context):
@@ -2038,7 +2108,8 @@ class ComputeManager(manager.SchedulerDependentManager):
             LOG.debug(_("FLAGS.reclaim_instance_interval <= 0, skipping..."))
             return
 
-        instances = self.db.instance_get_all_by_host(context, self.host)
+        instances = self.db.instance_get_all_by_host(context, self.host,
+                                                     profile='minimal')
         for instance in instances:
             old_enough = (not instance.deleted_at or utils.is_older_than(
                     instance.deleted_at,
@@ -2049,8 +2120,14 @@ class ComputeManager(manager.SchedulerDependentManager):
                 instance_id = instance.id
                 LOG.info(_("Reclaiming deleted instance %(instance_id)s"),
                          locals())
+                instance = self.db.instance_get(context, instance_id)
                 self._delete_instance(context, instance)
 
+    @manager.periodic_task(spacing=FLAGS.image_cache_manager_interval)
+    def _manage_image_cache(self, context):
+        """Let the driver evict unused images and refill its image cache."""
+        self.driver.manage_image_cache(context)
+
     def add_instance_fault_from_exc(self, context, instance_uuid, fault):
         """Adds the specified fault to the database."""
         if hasattr(fault, "code"):
@@ -2097,7 +2174,8 @@ class ComputeManager(manager.SchedulerDependentManager):
 
         # NOTE(sirp): admin contexts don't ordinarily return deleted records
         with utils.temporary_mutation(context, read_deleted="yes"):
-            instances = self.db.instance_get_all_by_host(context, self.host)
+            instances = self.db.instance_get_all_by_host(context, self.host,
+                                                         profile='minimal')
             for instance in instances:
                 present = instance.name in present_name_labels
                 erroneously_running = instance.deleted and present
@@ -2120,6 +2198,7 @@ class ComputeManager(manager.SchedulerDependentManager):
                                    " name label '%(name_label)s' which is"
                                    " marked as DELETED but still present on"
                                    " host."), locals())
+                        instance = self.db.instance_get(context, instance_id)
                         self._shutdown_instance(
                                 context, instance, 'Terminating', True)
                         self._cleanup_volumes(context, instance_id)
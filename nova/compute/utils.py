@@ -20,6 +20,7 @@ from nova import context
 from nova import db
 from nova import flags
 from nova.notifier import api as notifier_api
+from nova import quota
 from nova import utils
 
 
@@ -53,3 +54,21 @@ def notify_usage_exists(instance_ref, current_period=False):
                         'compute.instance.exists',
                         notifier_api.INFO,
                         usage_info)
+
+
+def destroy_instance_record(context, instance):
+    """Destroy an instance in the db and release its quota.
+
+    Instances already marked deleted had their quota released when that
+    happened, so only the record is destroyed again.
+    """
+    if instance.get('deleted'):
+        db.instance_destroy(context, instance['id'])
+        return
+    reservations = quota.reserve(context,
+                                 project_id=instance['project_id'],
+                                 instances=-1,
+                                 cores=-(instance['vcpus'] or 0),
+                                 ram=-(instance['memory_mb'] or 0))
+    db.instance_destroy(context, instance['id'])
+    quota.commit(context, reservations)
@@ -60,6 +60,12 @@ flags.DEFINE_string('snapshot_name_template', 'snapshot-%08x',
                     'Template string to be used to generate snapshot names')
 flags.DEFINE_string('vsa_name_template', 'vsa-%08x',
                     'Template string to be used to generate VSA names')
+flags.DEFINE_integer('instance_filter_chunk_size', 100,
+                     'Number of instances fetched at a time when a page of '
+                     'instances has filters that cannot be done in SQL')
+flags.DEFINE_integer('fixed_ip_pool_batch', 16,
+                     'Number of free fixed ips fetched at a time by '
+                     'fixed_ip_associate_pool')
 
 IMPL = utils.LazyPluggable(FLAGS['db_backend'],
                            sqlalchemy='nova.db.sqlalchemy.api')
@@ -364,7 +370,7 @@ def fixed_ip_associate(context, address, instance_id, network_id=None,
 def fixed_ip_associate_pool(context, network_id, instance_id=None, host=None):
     """Find free ip in network and associate it to instance or host.
 
-    Raises if one is not available.
+    One of instance_id or host is required. Raises if no ip is available.
 
     """
     return IMPL.fixed_ip_associate_pool(context, network_id,
@@ -411,6 +417,16 @@ def fixed_ip_get_by_address(context, address):
     return IMPL.fixed_ip_get_by_address(context, address)
 
 
+def fixed_ip_get_instance_ips_by_address(context, address, exact=True):
+    """Get instance ids and addresses of fixed and floating ips matching.
+
+    address is compared for equality, or as a LIKE pattern if not exact.
+    Returns dicts with instance_id, address and floating keys.
+    """
+    return IMPL.fixed_ip_get_instance_ips_by_address(context, address,
+                                                     exact=exact)
+
+
 def fixed_ip_get_by_instance(context, instance_id):
     """Get fixed ips by instance or raise if none exist."""
     return IMPL.fixed_ip_get_by_instance(context, instance_id)
@@ -529,14 +545,32 @@ def instance_get(context, instance_id):
     return IMPL.instance_get(context, instance_id)
 
 
-def instance_get_all(context):
-    """Get all instances."""
-    return IMPL.instance_get_all(context)
+def instance_get_all(context, profile='full'):
+    """Get all instances.
+
+    profile names the relationships to load with each instance: 'minimal'
+    loads none, 'network' loads fixed and floating ips, networks, virtual
+    interfaces and the info cache, and 'full' adds security groups,
+    metadata and the instance type but not virtual interfaces.  The other
+    instance_get_all_* calls take the same argument.
+    """
+    return IMPL.instance_get_all(context, profile=profile)
 
 
-def instance_get_all_by_filters(context, filters):
-    """Get all instances that match all filters."""
-    return IMPL.instance_get_all_by_filters(context, filters)
+def instance_get_all_by_filters(context, filters, sort_key='created_at',
+                                sort_dir='desc', limit=None, marker=None,
+                                profile='full'):
+    """Get all instances that match all filters.
+
+    Optionally returns one page of at most limit instances following the
+    instance marker (uuid or id) in sort_key, sort_dir order.  The 'full'
+    profile also loads virtual interfaces here.
+    """
+    return IMPL.instance_get_all_by_filters(context, filters,
+                                            sort_key=sort_key,
+                                            sort_dir=sort_dir,
+                                            limit=limit, marker=marker,
+                                            profile=profile)
 
 
 def instance_get_active_by_window(context, begin, end=None, project_id=None):
@@ -555,24 +589,40 @@ def instance_get_active_by_window_joined(context, begin, end=None,
                                               project_id)
 
 
-def instance_get_all_by_user(context, user_id):
+def instance_get_all_by_user(context, user_id, profile='full'):
     """Get all instances."""
-    return IMPL.instance_get_all_by_user(context, user_id)
+    return IMPL.instance_get_all_by_user(context, user_id, profile=profile)
 
 
-def instance_get_all_by_project(context, project_id):
+def instance_get_all_by_project(context, project_id, profile='full'):
     """Get all instance belonging to a project."""
-    return IMPL.instance_get_all_by_project(context, project_id)
+    return IMPL.instance_get_all_by_project(context, project_id,
+                                            profile=profile)
 
 
-def instance_get_all_by_host(context, host):
+def instance_get_all_by_host(context, host, profile='full'):
     """Get all instance belonging to a host."""
-    return IMPL.instance_get_all_by_host(context, host)
+    return IMPL.instance_get_all_by_host(context, host, profile=profile)
 
 
-def instance_get_all_by_reservation(context, reservation_id):
+def instance_get_power_states_by_host(context, host):
+    """Get the id, name and power_state of each instance on a host."""
+    return IMPL.instance_get_power_states_by_host(context, host)
+
+
+def instance_update_power_states(context, power_states):
+    """Set power_state on many instances in one transaction.
+
+    :param power_states: dict of {power_state: [instance_id, ...]}
+
+    """
+    return IMPL.instance_update_power_states(context, power_states)
+
+
+def instance_get_all_by_reservation(context, reservation_id, profile='full'):
     """Get all instances belonging to a reservation."""
-    return IMPL.instance_get_all_by_reservation(context, reservation_id)
+    return IMPL.instance_get_all_by_reservation(context, reservation_id,
+                                                profile=profile)
 
 
 def instance_get_fixed_addresses(context, instance_id):
@@ -931,6 +981,42 @@ def quota_destroy_all_by_project(context, project_id):
     return IMPL.quota_get_all_by_project(context, project_id)
 
 
+def quota_usage_get_all_by_project(context, project_id):
+    """Retrieve the in_use and reserved counts of a project's resources."""
+    return IMPL.quota_usage_get_all_by_project(context, project_id)
+
+
+def quota_reserve(context, project_id, quotas, deltas, expire,
+                  until_refresh=None, max_age=None):
+    """Check deltas against quotas and reserve them for a project.
+
+    Usages that do not exist yet, are negative, have counted down
+    until_refresh reservations or are older than max_age seconds are
+    recounted first.  Returns a list of reservation uuids, or raises
+    OverQuota if a positive delta would take a resource over its quota.
+    """
+    return IMPL.quota_reserve(context, project_id, quotas, deltas, expire,
+                              until_refresh=until_refresh, max_age=max_age)
+
+
+def reservation_commit(context, reservations):
+    """Apply reservations to the in_use counts of their resources."""
+    return IMPL.reservation_commit(context, reservations)
+
+
+def reservation_rollback(context, reservations):
+    """Release reservations without changing in_use counts."""
+    return IMPL.reservation_rollback(context, reservations)
+
+
+def reservation_expire(context):
+    """Roll back all reservations that have passed their expiry time.
+
+    Also purges finished reservations left behind as deleted rows.
+    """
+    return IMPL.reservation_expire(context)
+
+
 ###################
 
 
@@ -1074,6 +1160,13 @@ def block_device_mapping_get_all_by_instance(context, instance_id):
     return IMPL.block_device_mapping_get_all_by_instance(context, instance_id)
 
 
+def block_device_mapping_get_all_by_instances(context, instance_ids):
+    """Get all block device mappings belonging to the instances, with
+    their volumes loaded."""
+    return IMPL.block_device_mapping_get_all_by_instances(context,
+                                                          instance_ids)
+
+
 def block_device_mapping_destroy(context, bdm_id):
     """Destroy the block device mapping."""
     return IMPL.block_device_mapping_destroy(context, bdm_id)
@@ -1509,6 +1602,15 @@ def bw_usage_update(context,
                                 session=None)
 
 
+def bw_usage_update_all(context, start_period, usages):
+    """Update cached bw usage for many instances and networks at once.
+
+    usages is a list of dicts with instance_id, network_label, bw_in and
+    bw_out keys.  Creates new records as needed.
+    """
+    return IMPL.bw_usage_update_all(context, start_period, usages)
+
+
 ####################
 
 
@@ -1652,6 +1754,11 @@ def s3_image_get_by_uuid(context, image_uuid):
     return IMPL.s3_image_get_by_uuid(context, image_uuid)
 
 
+def s3_image_get_all_by_uuids(context, image_uuids):
+    """Find the local s3 images represented by the provided uuids"""
+    return IMPL.s3_image_get_all_by_uuids(context, image_uuids)
+
+
 def s3_image_create(context, image_uuid):
     """Create local s3 image represented by provided uuid"""
     return IMPL.s3_image_create(context, image_uuid)
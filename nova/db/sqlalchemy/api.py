@@ -19,6 +19,7 @@
 """Implementation of SQLAlchemy backend."""
 
 import datetime
+import random
 import re
 import warnings
 
@@ -517,10 +518,11 @@ def floating_ip_create(context, values):
 
 
 @require_context
-def floating_ip_count_by_project(context, project_id):
+def floating_ip_count_by_project(context, project_id, session=None):
     authorize_project_context(context, project_id)
     # TODO(tr3buchet): why leave auto_assigned floating IPs out?
-    return model_query(context, models.FloatingIp, read_deleted="no").\
+    return model_query(context, models.FloatingIp, session=session,
+                       read_deleted="no").\
                    filter_by(project_id=project_id).\
                    filter_by(auto_assigned=False).\
                    count()
@@ -711,36 +713,70 @@ def fixed_ip_associate(context, address, instance_id, network_id=None,
     return fixed_ip_ref['address']
 
 
+def _fixed_ip_pool_query(context, network_id, session, *args):
+    """Query free, unreserved fixed ips usable on network_id."""
+    network_or_none = or_(models.FixedIp.network_id == network_id,
+                          models.FixedIp.network_id == None)
+    return model_query(context, *(args or (models.FixedIp,)),
+                       session=session, read_deleted="no").\
+                   filter(network_or_none).\
+                   filter_by(reserved=False).\
+                   filter_by(instance_id=None).\
+                   filter_by(host=None)
+
+
 @require_admin_context
 def fixed_ip_associate_pool(context, network_id, instance_id=None, host=None):
+    """Claim a free fixed ip on network_id without locking the table.
+
+    One query fetches a small batch of the lowest free ips. Each is claimed
+    with an UPDATE that only matches while the ip is still free, so
+    concurrent allocators never block each other. The lowest ip is tried
+    first; a caller that loses that race goes on from a random point in
+    the rest of the batch, so concurrent callers spread over the batch
+    instead of all failing on the same candidates in turn.
+    """
+    if not instance_id and not host:
+        # NOTE: an ip claimed for neither would still look free.
+        raise exception.InvalidInput(
+                reason=_("fixed ip needs an instance or a host"))
+
     session = get_session()
-    with session.begin():
-        network_or_none = or_(models.FixedIp.network_id == network_id,
-                              models.FixedIp.network_id == None)
-        fixed_ip_ref = model_query(context, models.FixedIp, session=session,
-                                   read_deleted="no").\
-                               filter(network_or_none).\
-                               filter_by(reserved=False).\
-                               filter_by(instance=None).\
-                               filter_by(host=None).\
-                               with_lockmode('update').\
-                               first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not fixed_ip_ref:
+    if instance_id:
+        # Make sure the instance exists before handing out an ip.
+        instance_get(context, instance_id, session=session)
+
+    values = {'network_id': network_id,
+              'updated_at': utils.utcnow()}
+    if instance_id:
+        values['instance_id'] = instance_id
+    if host:
+        values['host'] = host
+
+    while True:
+        free = _fixed_ip_pool_query(context, network_id, session,
+                                    models.FixedIp.id,
+                                    models.FixedIp.address).\
+                       order_by(models.FixedIp.id).\
+                       limit(max(1, FLAGS.fixed_ip_pool_batch)).\
+                       all()
+        if not free:
             raise exception.NoMoreFixedIps()
-        if not fixed_ip_ref.network:
-            fixed_ip_ref.network = network_get(context,
-                                           network_id,
-                                           session=session)
-        if instance_id:
-            fixed_ip_ref.instance = instance_get(context,
-                                                 instance_id,
-                                                 session=session)
-        if host:
-            fixed_ip_ref.host = host
-        session.add(fixed_ip_ref)
-    return fixed_ip_ref['address']
+
+        candidates, rest = free[:1], free[1:]
+        if rest:
+            start = random.randrange(len(rest))
+            candidates += rest[start:] + rest[:start]
+
+        for fixed_ip_id, address in candidates:
+            with session.begin():
+                claimed = _fixed_ip_pool_query(context, network_id,
+                                               session).\
+                                  filter_by(id=fixed_ip_id).\
+                                  filter_by(address=address).\
+                                  update(values, synchronize_session=False)
+            if claimed:
+                return address
 
 
 @require_context
@@ -865,6 +901,38 @@ def fixed_ip_get_by_address(context, address, session=None):
     return result
 
 
+@require_context
+def fixed_ip_get_instance_ips_by_address(context, address, exact=True):
+    session = get_session()
+    if exact:
+        fixed_match = models.FixedIp.address == address
+        floating_match = models.FloatingIp.address == address
+    else:
+        fixed_match = models.FixedIp.address.like(address)
+        floating_match = models.FloatingIp.address.like(address)
+
+    fixed_ips = model_query(context, models.FixedIp.instance_id,
+                            models.FixedIp.address, session=session,
+                            read_deleted="no").\
+                    filter(models.FixedIp.instance_id != None).\
+                    filter(fixed_match).\
+                    all()
+    floating_ips = model_query(context, models.FixedIp.instance_id,
+                               models.FloatingIp.address, session=session,
+                               read_deleted="no").\
+                    filter(models.FloatingIp.fixed_ip_id ==
+                           models.FixedIp.id).\
+                    filter(models.FloatingIp.deleted == False).\
+                    filter(models.FixedIp.instance_id != None).\
+                    filter(floating_match).\
+                    all()
+
+    return ([{'instance_id': instance_id, 'address': address,
+              'floating': False} for instance_id, address in fixed_ips] +
+            [{'instance_id': instance_id, 'address': address,
+              'floating': True} for instance_id, address in floating_ips])
+
+
 @require_context
 def fixed_ip_get_by_instance(context, instance_id):
     result = model_query(context, models.FixedIp, read_deleted="no").\
@@ -1101,11 +1169,12 @@ def instance_create(context, values):
 
 
 @require_admin_context
-def instance_data_get_for_project(context, project_id):
+def instance_data_get_for_project(context, project_id, session=None):
     result = model_query(context,
                          func.count(models.Instance.id),
                          func.sum(models.Instance.vcpus),
                          func.sum(models.Instance.memory_mb),
+                         session=session,
                          read_deleted="no").\
                      filter_by(project_id=project_id).\
                      first()
@@ -1198,23 +1267,56 @@ def _build_instance_get(context, session=None):
             options(joinedload('instance_type'))
 
 
+# Relationships joined in for each instance load profile.  Relationships
+# left out are lazy loaded, so only touch them while the session is alive.
+_INSTANCE_LOAD_PROFILES = {
+    'minimal': (),
+    'network': ('fixed_ips.floating_ips',
+                'fixed_ips.network',
+                'fixed_ips.virtual_interface',
+                'info_cache'),
+    'full': ('fixed_ips.floating_ips',
+             'fixed_ips.network',
+             'info_cache',
+             'security_groups',
+             'metadata',
+             'instance_type'),
+}
+
+
+def _instance_load_profile(query, profile):
+    """Add the eager loads for a named load profile to an instance query."""
+    try:
+        relations = _INSTANCE_LOAD_PROFILES[profile]
+    except KeyError:
+        raise exception.InvalidInput(
+                reason=_("Unknown instance load profile %s") % profile)
+    for relation in relations:
+        query = query.options(joinedload_all(relation))
+    return query
+
+
 @require_admin_context
-def instance_get_all(context):
-    return model_query(context, models.Instance).\
-                   options(joinedload_all('fixed_ips.floating_ips')).\
-                   options(joinedload('info_cache')).\
-                   options(joinedload('security_groups')).\
-                   options(joinedload_all('fixed_ips.network')).\
-                   options(joinedload('metadata')).\
-                   options(joinedload('instance_type')).\
-                   all()
+def instance_get_all(context, profile='full'):
+    query = model_query(context, models.Instance)
+    return _instance_load_profile(query, profile).all()
 
 
 @require_context
-def instance_get_all_by_filters(context, filters):
+def instance_get_all_by_filters(context, filters, sort_key='created_at',
+                                sort_dir='desc', limit=None, marker=None,
+                                profile='full'):
     """Return instances that match all filters.  Deleted instances
     will be returned by default, unless there's a filter that says
-    otherwise"""
+    otherwise
+
+    Results are ordered by sort_key (ties broken by id) in sort_dir.  If
+    marker, the uuid or id of an instance, is given only instances after
+    it in that order are returned, and at most limit of them if limit is
+    given.  Filters that cannot be expressed in SQL are applied to chunks
+    of rows until the page is full.  Filtering on metadata needs it to be
+    loaded, which profiles other than 'full' do lazily.
+    """
 
     def _regexp_filter_by_metadata(instance, meta):
         inst_metadata = [{node['key']: node['value']} \
@@ -1251,15 +1353,13 @@ def instance_get_all_by_filters(context, filters):
             return query.filter_by(**filter_dict)
 
     session = get_session()
-    query_prefix = session.query(models.Instance).\
-            options(joinedload_all('fixed_ips.floating_ips')).\
-            options(joinedload_all('fixed_ips.network')).\
-            options(joinedload_all('fixed_ips.virtual_interface')).\
-            options(joinedload('info_cache')).\
-            options(joinedload('security_groups')).\
-            options(joinedload('metadata')).\
-            options(joinedload('instance_type')).\
-            order_by(desc(models.Instance.created_at))
+    query_prefix = _instance_load_profile(session.query(models.Instance),
+                                          profile)
+    if profile == 'full':
+        # NOTE: instance listings have always had virtual interfaces
+        #       loaded along with the rest of the full profile.
+        query_prefix = query_prefix.\
+                options(joinedload_all('fixed_ips.virtual_interface'))
 
     # Make a copy of the filters dictionary to use going forward, as we'll
     # be modifying it and we shouldn't affect the caller's use of it.
@@ -1292,7 +1392,7 @@ def instance_get_all_by_filters(context, filters):
     # Filters for exact matches that we can do along with the SQL query...
     # For other filters that don't match this, we will do regexp matching
     exact_match_filter_names = ['project_id', 'user_id', 'image_ref',
-            'vm_state', 'instance_type_id', 'uuid']
+            'vm_state', 'instance_type_id', 'uuid', 'id']
 
     query_filters = [key for key in filters.iterkeys()
             if key in exact_match_filter_names]
@@ -1303,31 +1403,87 @@ def instance_get_all_by_filters(context, filters):
         query_prefix = _exact_match_filter(query_prefix, filter_name,
                 filters.pop(filter_name))
 
-    instances = query_prefix.all()
-    if not instances:
-        return []
-
     # Now filter on everything else for regexp matching..
     # For filters not in the list, we'll attempt to use the filter_name
     # as a column name in Instance..
-    regexp_filter_funcs = {}
-
-    for filter_name in filters.iterkeys():
-        filter_func = regexp_filter_funcs.get(filter_name, None)
-        filter_re = re.compile(str(filters[filter_name]))
-        if filter_func:
-            filter_l = lambda instance: filter_func(instance, filter_re)
-        elif filter_name == 'metadata':
-            filter_l = lambda instance: _regexp_filter_by_metadata(instance,
-                    filters[filter_name])
+    regexp_filters = []
+    for filter_name, value in filters.iteritems():
+        if filter_name == 'metadata':
+            regexp_filters.append(
+                    lambda instance, meta=value:
+                        _regexp_filter_by_metadata(instance, meta))
         else:
-            filter_l = lambda instance: _regexp_filter_by_column(instance,
-                    filter_name, filter_re)
-        instances = filter(filter_l, instances)
-        if not instances:
-            break
+            regexp_filters.append(
+                    lambda instance, name=filter_name,
+                           filter_re=re.compile(str(value)):
+                        _regexp_filter_by_column(instance, name, filter_re))
+
+    def _matches(instance):
+        for regexp_filter in regexp_filters:
+            if not regexp_filter(instance):
+                return False
+        return True
 
-    return instances
+    sort_column = getattr(models.Instance, sort_key)
+    if sort_dir == 'desc':
+        query_prefix = query_prefix.order_by(desc(sort_column),
+                                             desc(models.Instance.id))
+    else:
+        query_prefix = query_prefix.order_by(sort_column, models.Instance.id)
+
+    if marker is not None:
+        marker_ref = _instance_get_marker(context, marker, session)
+        query_prefix = query_prefix.filter(_instance_keyset_after(
+                sort_column, sort_dir, marker_ref[sort_key], marker_ref.id))
+
+    if limit is None:
+        return filter(_matches, query_prefix.all())
+
+    if not regexp_filters:
+        return query_prefix.limit(limit).all()
+
+    # Fetch in chunks, continuing after the last row seen, until enough
+    # instances pass the filters that could not be done in SQL.
+    chunk_size = max(limit, FLAGS.instance_filter_chunk_size)
+    instances = []
+    query = query_prefix
+    while len(instances) < limit:
+        chunk = query.limit(chunk_size).all()
+        instances.extend(filter(_matches, chunk))
+        if len(chunk) < chunk_size:
+            break
+        last = chunk[-1]
+        query = query_prefix.filter(_instance_keyset_after(
+                sort_column, sort_dir, last[sort_key], last.id))
+    return instances[:limit]
+
+
+def _instance_get_marker(context, marker, session):
+    """Return the instance a page marker (uuid or id) refers to."""
+    query = model_query(context, models.Instance, session=session,
+                        read_deleted="yes", project_only=True)
+    if utils.is_uuid_like(marker):
+        query = query.filter_by(uuid=marker)
+    else:
+        try:
+            query = query.filter_by(id=int(marker))
+        except ValueError:
+            raise exception.MarkerNotFound(marker=marker)
+    marker_ref = query.first()
+    if not marker_ref:
+        raise exception.MarkerNotFound(marker=marker)
+    return marker_ref
+
+
+def _instance_keyset_after(sort_column, sort_dir, sort_value, instance_id):
+    """Condition for rows after (sort_value, instance_id) in sort order."""
+    if sort_dir == 'desc':
+        return or_(sort_column < sort_value,
+                   and_(sort_column == sort_value,
+                        models.Instance.id < instance_id))
+    return or_(sort_column > sort_value,
+               and_(sort_column == sort_value,
+                    models.Instance.id > instance_id))
 
 
 @require_context
@@ -1368,37 +1524,63 @@ def instance_get_active_by_window_joined(context, begin, end=None,
 
 
 @require_admin_context
-def _instance_get_all_query(context, project_only=False):
-    return model_query(context, models.Instance, project_only=project_only).\
-                   options(joinedload_all('fixed_ips.floating_ips')).\
-                   options(joinedload('info_cache')).\
-                   options(joinedload('security_groups')).\
-                   options(joinedload_all('fixed_ips.network')).\
-                   options(joinedload('metadata')).\
-                   options(joinedload('instance_type'))
+def _instance_get_all_query(context, project_only=False, profile='full'):
+    query = model_query(context, models.Instance, project_only=project_only)
+    return _instance_load_profile(query, profile)
 
 
 @require_admin_context
-def instance_get_all_by_user(context, user_id):
-    return _instance_get_all_query(context).filter_by(user_id=user_id).all()
+def instance_get_all_by_user(context, user_id, profile='full'):
+    return _instance_get_all_query(context, profile=profile).\
+                    filter_by(user_id=user_id).\
+                    all()
 
 
 @require_admin_context
-def instance_get_all_by_host(context, host):
-    return _instance_get_all_query(context).filter_by(host=host).all()
+def instance_get_all_by_host(context, host, profile='full'):
+    return _instance_get_all_query(context, profile=profile).\
+                    filter_by(host=host).\
+                    all()
+
+
+@require_admin_context
+def instance_get_power_states_by_host(context, host):
+    # NOTE: instance names come from instance_name_template, which may
+    # use any column, so load the rows but none of the relationships.
+    instances = model_query(context, models.Instance).\
+                        filter_by(host=host).\
+                        all()
+    return [{'id': instance['id'],
+             'name': instance['name'],
+             'power_state': instance['power_state']}
+            for instance in instances]
+
+
+@require_admin_context
+def instance_update_power_states(context, power_states):
+    session = get_session()
+    with session.begin():
+        for state, instance_ids in power_states.iteritems():
+            if not instance_ids:
+                continue
+            session.query(models.Instance).\
+                    filter(models.Instance.id.in_(instance_ids)).\
+                    update({'power_state': state},
+                           synchronize_session=False)
 
 
 @require_context
-def instance_get_all_by_project(context, project_id):
+def instance_get_all_by_project(context, project_id, profile='full'):
     authorize_project_context(context, project_id)
-    return _instance_get_all_query(context).\
+    return _instance_get_all_query(context, profile=profile).\
                     filter_by(project_id=project_id).\
                     all()
 
 
 @require_context
-def instance_get_all_by_reservation(context, reservation_id):
-    return _instance_get_all_query(context, project_only=True).\
+def instance_get_all_by_reservation(context, reservation_id, profile='full'):
+    return _instance_get_all_query(context, project_only=True,
+                                   profile=profile).\
                     filter_by(reservation_id=reservation_id).\
                     all()
 
@@ -2127,6 +2309,215 @@ def quota_destroy_all_by_project(context, project_id):
 ###################
 
 
+def _sync_instances(context, project_id, session):
+    instances, cores, ram = instance_data_get_for_project(context,
+                                                          project_id,
+                                                          session=session)
+    return {'instances': instances, 'cores': cores, 'ram': ram}
+
+
+def _sync_volumes(context, project_id, session):
+    volumes, gigabytes = volume_data_get_for_project(context, project_id,
+                                                     session=session)
+    return {'volumes': volumes, 'gigabytes': gigabytes}
+
+
+def _sync_floating_ips(context, project_id, session):
+    return {'floating_ips': floating_ip_count_by_project(context, project_id,
+                                                         session=session)}
+
+
+# How to recount the usage of each resource that quota_usages tracks.
+_QUOTA_USAGE_SYNC = {
+    'instances': _sync_instances,
+    'cores': _sync_instances,
+    'ram': _sync_instances,
+    'volumes': _sync_volumes,
+    'gigabytes': _sync_volumes,
+    'floating_ips': _sync_floating_ips,
+}
+
+
+@require_context
+def quota_usage_get_all_by_project(context, project_id):
+    authorize_project_context(context, project_id)
+
+    rows = model_query(context, models.QuotaUsage, read_deleted="no").\
+                   filter_by(project_id=project_id).\
+                   all()
+
+    result = {'project_id': project_id}
+    for row in rows:
+        result[row.resource] = dict(in_use=row.in_use, reserved=row.reserved)
+
+    return result
+
+
+def _quota_usage_create(context, project_id, resource, until_refresh,
+                        session):
+    quota_usage_ref = models.QuotaUsage()
+    quota_usage_ref.project_id = project_id
+    quota_usage_ref.resource = resource
+    quota_usage_ref.in_use = 0
+    quota_usage_ref.reserved = 0
+    quota_usage_ref.until_refresh = until_refresh
+    quota_usage_ref.save(session=session)
+    return quota_usage_ref
+
+
+@require_context
+def quota_reserve(context, project_id, quotas, deltas, expire,
+                  until_refresh=None, max_age=None):
+    authorize_project_context(context, project_id)
+    try:
+        return _quota_reserve(context, project_id, quotas, deltas, expire,
+                              until_refresh, max_age)
+    except (exception.Duplicate, IntegrityError):
+        # NOTE: a concurrent reservation created the project's first usage
+        #       rows; they exist now, so this attempt locks and reads them.
+        return _quota_reserve(context, project_id, quotas, deltas, expire,
+                              until_refresh, max_age)
+
+
+def _quota_reserve(context, project_id, quotas, deltas, expire,
+                   until_refresh, max_age):
+    session = get_session()
+    with session.begin():
+        # NOTE: locking the project's usage rows serializes reservations
+        #       for the project; sqlite ignores the lock.
+        rows = model_query(context, models.QuotaUsage, session=session,
+                           read_deleted="no").\
+                       filter_by(project_id=project_id).\
+                       with_lockmode('update').\
+                       all()
+        usages = dict((row.resource, row) for row in rows)
+
+        # Recount usages that are new, have gone negative, or are due
+        refresh = set()
+        for resource in deltas:
+            usage = usages.get(resource)
+            if usage is None:
+                refresh.add(resource)
+            elif usage.in_use < 0:
+                refresh.add(resource)
+            elif usage.until_refresh is not None:
+                usage.until_refresh -= 1
+                if usage.until_refresh <= 0:
+                    refresh.add(resource)
+            elif max_age and utils.is_older_than(
+                    usage.updated_at or usage.created_at, max_age):
+                refresh.add(resource)
+
+        synced = set()
+        for resource in refresh:
+            if resource in synced:
+                continue
+            sync = _QUOTA_USAGE_SYNC[resource]
+            for res, in_use in sync(context, project_id, session).items():
+                if res not in usages:
+                    usages[res] = _quota_usage_create(context, project_id,
+                                                      res, None, session)
+                usages[res].in_use = in_use
+                usages[res].until_refresh = until_refresh or None
+                synced.add(res)
+
+        overs = [resource for resource, delta in deltas.items()
+                 if delta > 0 and quotas.get(resource) is not None and
+                    quotas[resource] < usages[resource].total + delta]
+
+        reservations = []
+        if not overs:
+            for resource, delta in deltas.items():
+                reservation_ref = models.Reservation()
+                reservation_ref.uuid = str(utils.gen_uuid())
+                reservation_ref.usage_id = usages[resource].id
+                reservation_ref.project_id = project_id
+                reservation_ref.resource = resource
+                reservation_ref.delta = delta
+                reservation_ref.expire = expire
+                reservation_ref.save(session=session)
+                reservations.append(reservation_ref.uuid)
+                # Only increases are held back; decreases take effect
+                # when committed.
+                if delta > 0:
+                    usages[resource].reserved += delta
+
+        # Save refreshed usages even when over quota.
+        for usage in usages.values():
+            usage.save(session=session)
+
+    if overs:
+        raise exception.OverQuota(overs=', '.join(sorted(overs)))
+
+    return reservations
+
+
+def _reservations_finish(context, query, commit, session):
+    """Commit or roll back the reservations matched by query."""
+    reservations = query.with_lockmode('update').all()
+    usage_ids = set(reservation.usage_id for reservation in reservations)
+    if not usage_ids:
+        return
+
+    usages = model_query(context, models.QuotaUsage, session=session,
+                         read_deleted="no").\
+                     filter(models.QuotaUsage.id.in_(usage_ids)).\
+                     with_lockmode('update').\
+                     all()
+    usages = dict((usage.id, usage) for usage in usages)
+
+    for reservation in reservations:
+        usage = usages.get(reservation.usage_id)
+        if usage is not None:
+            if reservation.delta > 0:
+                usage.reserved -= reservation.delta
+            if commit:
+                usage.in_use += reservation.delta
+        # NOTE: finished reservations are of no further use, so they are
+        #       removed rather than left behind as deleted rows.
+        session.delete(reservation)
+
+    for usage in usages.values():
+        usage.save(session=session)
+
+
+@require_context
+def reservation_commit(context, reservations):
+    session = get_session()
+    with session.begin():
+        query = model_query(context, models.Reservation, session=session,
+                            read_deleted="no").\
+                        filter(models.Reservation.uuid.in_(reservations))
+        _reservations_finish(context, query, True, session)
+
+
+@require_context
+def reservation_rollback(context, reservations):
+    session = get_session()
+    with session.begin():
+        query = model_query(context, models.Reservation, session=session,
+                            read_deleted="no").\
+                        filter(models.Reservation.uuid.in_(reservations))
+        _reservations_finish(context, query, False, session)
+
+
+@require_admin_context
+def reservation_expire(context):
+    session = get_session()
+    with session.begin():
+        query = model_query(context, models.Reservation, session=session,
+                            read_deleted="no").\
+                        filter(models.Reservation.expire < utils.utcnow())
+        _reservations_finish(context, query, False, session)
+        # Purge reservations soft deleted by earlier releases.
+        model_query(context, models.Reservation, session=session,
+                    read_deleted="only").\
+                delete(synchronize_session=False)
+
+
+###################
+
+
 @require_admin_context
 def volume_allocate_iscsi_target(context, volume_id, host):
     session = get_session()
@@ -2176,10 +2567,11 @@ def volume_create(context, values):
 
 
 @require_admin_context
-def volume_data_get_for_project(context, project_id):
+def volume_data_get_for_project(context, project_id, session=None):
     result = model_query(context,
                          func.count(models.Volume.id),
                          func.sum(models.Volume.size),
+                         session=session,
                          read_deleted="no").\
                      filter_by(project_id=project_id).\
                      first()
@@ -2509,6 +2901,17 @@ def block_device_mapping_get_all_by_instance(context, instance_id):
                  all()
 
 
+@require_context
+def block_device_mapping_get_all_by_instances(context, instance_ids):
+    if not instance_ids:
+        return []
+    return _block_device_mapping_get_query(context).\
+                 options(joinedload('volume')).\
+                 filter(models.BlockDeviceMapping.instance_id.in_(
+                        instance_ids)).\
+                 all()
+
+
 @require_context
 def block_device_mapping_destroy(context, bdm_id):
     session = get_session()
@@ -3497,6 +3900,39 @@ def bw_usage_update(context,
         bwusage.save(session=session)
 
 
+@require_context
+def bw_usage_update_all(context, start_period, usages):
+    session = get_session()
+    with session.begin():
+        instance_ids = set(usage['instance_id'] for usage in usages)
+        bwusages = {}
+        if instance_ids:
+            rows = model_query(context, models.BandwidthUsage,
+                               session=session, read_deleted="yes").\
+                           filter_by(start_period=start_period).\
+                           filter(models.BandwidthUsage.instance_id.in_(
+                                  instance_ids)).\
+                           all()
+            for bwusage in rows:
+                key = (bwusage.instance_id, bwusage.network_label)
+                bwusages[key] = bwusage
+
+        now = utils.utcnow()
+        for usage in usages:
+            key = (usage['instance_id'], usage['network_label'])
+            bwusage = bwusages.get(key)
+            if not bwusage:
+                bwusage = bwusages[key] = models.BandwidthUsage()
+                bwusage.instance_id = usage['instance_id']
+                bwusage.start_period = start_period
+                bwusage.network_label = usage['network_label']
+                session.add(bwusage)
+
+            bwusage.last_refreshed = now
+            bwusage.bw_in = usage['bw_in']
+            bwusage.bw_out = usage['bw_out']
+
+
 ####################
 
 
@@ -3840,6 +4276,15 @@ def s3_image_get_by_uuid(context, image_uuid):
     return result
 
 
+def s3_image_get_all_by_uuids(context, image_uuids):
+    """Find the local s3 images represented by the provided uuids"""
+    if not image_uuids:
+        return []
+    return model_query(context, models.S3Image, read_deleted="yes").\
+                 filter(models.S3Image.uuid.in_(list(image_uuids))).\
+                 all()
+
+
 def s3_image_create(context, image_uuid):
     """Create local s3 image represented by provided uuid"""
     try:
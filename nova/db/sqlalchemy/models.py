@@ -439,6 +439,48 @@ class Quota(BASE, NovaBase):
     hard_limit = Column(Integer, nullable=True)
 
 
+class QuotaUsage(BASE, NovaBase):
+    """Represents the current usage of a quota resource by a project.
+
+    in_use counts resources that exist; reserved counts resources that
+    reservations have been made for but not yet committed.
+    """
+
+    __tablename__ = 'quota_usages'
+    __table_args__ = (schema.UniqueConstraint("project_id", "resource"),
+                      {'mysql_engine': 'InnoDB'})
+    id = Column(Integer, primary_key=True)
+
+    project_id = Column(String(255), index=True)
+    resource = Column(String(255))
+
+    in_use = Column(Integer)
+    reserved = Column(Integer)
+
+    until_refresh = Column(Integer, nullable=True)
+
+    @property
+    def total(self):
+        return self.in_use + self.reserved
+
+
+class Reservation(BASE, NovaBase):
+    """Represents a change to a project's usage of a quota resource that
+    has been checked against the quota but not yet committed."""
+
+    __tablename__ = 'reservations'
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String(36), nullable=False)
+
+    usage_id = Column(Integer, ForeignKey('quota_usages.id'), nullable=False)
+
+    project_id = Column(String(255), index=True)
+    resource = Column(String(255))
+
+    delta = Column(Integer)
+    expire = Column(DateTime)
+
+
 class Snapshot(BASE, NovaBase):
     """Represents a block storage device that can be attached to a vm."""
     __tablename__ = 'snapshots'
@@ -938,7 +980,7 @@ def register_models():
               VolumeMetadata, VolumeTypes, VolumeTypeExtraSpecs,
               AgentBuild, InstanceMetadata, InstanceTypeExtraSpecs, Migration,
               VirtualStorageArray, SMFlavors, SMBackendConf, SMVolume,
-              InstanceFault)
+              InstanceFault, QuotaUsage, Reservation)
     engine = create_engine(FLAGS.sql_connection, echo=False)
     for model in models:
         model.metadata.create_all(engine)
@@ -272,6 +272,20 @@ DEFINE_list('glance_api_servers',
             'list of glance api servers available to nova (host:port)')
 DEFINE_integer('glance_num_retries', 0,
                'The number of times to retry downloading an image from glance')
+DEFINE_integer('glance_api_server_backoff', 2,
+               'Seconds to avoid a glance api server after a connection to '
+               'it fails, doubling with each further failure')
+DEFINE_integer('glance_api_server_max_backoff', 60,
+               'Maximum seconds to avoid a failing glance api server')
+DEFINE_integer('glance_client_cache_size', 100,
+               'Number of glance clients to keep for reuse')
+DEFINE_integer('glance_image_cache_ttl', 10,
+               'Seconds to cache metadata of active images from glance '
+               '(0 disables the cache).  Each process caches separately, '
+               'so changes made through other services or API workers can '
+               'take this long to be seen')
+DEFINE_integer('glance_image_cache_size', 1000,
+               'Maximum number of image metadata entries to cache')
 DEFINE_integer('s3_port', 3333, 's3 port')
 DEFINE_string('s3_host', '$my_ip', 's3 host (for infrastructure)')
 DEFINE_string('s3_dmz', '$my_ip', 's3 dmz ip (for instances)')
@@ -429,6 +443,11 @@ DEFINE_bool('resume_guests_state_on_host_boot', False,
 
 DEFINE_string('root_helper', 'sudo',
               'Command prefix to use for running commands as root')
+DEFINE_bool('use_rootwrap_daemon', False,
+            'Send commands run as root to a long running "nova-rootwrap'
+            ' --daemon", started through root_helper when needed, instead'
+            ' of running root_helper for each of them.  root_helper must'
+            ' run nova-rootwrap.')
 
 DEFINE_string('network_driver', 'nova.network.linux_net',
               'Driver to use for network creation')
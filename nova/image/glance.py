@@ -23,6 +23,7 @@ import copy
 import datetime
 import json
 import random
+import socket
 import time
 from urlparse import urlparse
 
@@ -58,6 +59,19 @@ def _parse_image_ref(image_href):
     return (image_id, host, port)
 
 
+# NOTE: glance wraps socket errors in ClientConnectionError, which older
+# clients do not have.
+_CONNECTION_ERRORS = (socket.error, IOError,
+                      getattr(glance_exception, 'ClientConnectionError',
+                              IOError))
+
+# (host, port) -> (consecutive failures, time before which to avoid it)
+_SERVER_FAILURES = {}
+
+# (host, port, strategy, auth_token, user_id, project_id) -> client
+_CLIENTS = {}
+
+
 def _create_glance_client(context, host, port):
     if context.strategy == 'keystone':
         # NOTE(dprince): Glance client just needs auth_tok right? Should we
@@ -72,6 +86,21 @@ def _create_glance_client(context, host, port):
     return glance_client
 
 
+def _get_glance_client(context, host, port):
+    """Return a glance client for host and port, reusing an earlier one
+    made for the same credentials if there is one."""
+    key = (host, port, context.strategy, context.auth_token,
+           context.user_id, context.project_id)
+    client = _CLIENTS.get(key)
+    if client is None:
+        client = _create_glance_client(context, host, port)
+        if FLAGS.glance_client_cache_size > 0:
+            while len(_CLIENTS) >= FLAGS.glance_client_cache_size:
+                _CLIENTS.popitem()
+            _CLIENTS[key] = client
+    return client
+
+
 def pick_glance_api_server():
     """Return which Glance API server to use for the request
 
@@ -79,12 +108,92 @@ def pick_glance_api_server():
     testing and sandbox environments. In production, it would be better to use
     one IP and route that to a real load-balancer.
 
+    Servers that recently failed are avoided, with exponential backoff, for
+    as long as there is another server to use.
+
         Returns (host, port)
     """
-    host_port = random.choice(FLAGS.glance_api_servers)
-    host, port_str = host_port.split(':')
-    port = int(port_str)
-    return host, port
+    servers = []
+    for host_port in FLAGS.glance_api_servers:
+        host, port_str = host_port.split(':')
+        servers.append((host, int(port_str)))
+
+    now = time.time()
+    healthy = [server for server in servers
+               if _SERVER_FAILURES.get(server, (0, 0))[1] <= now]
+    if healthy:
+        return random.choice(healthy)
+    # Every server is failing, try the one that has been given up on longest.
+    return min(servers, key=lambda server: _SERVER_FAILURES[server][1])
+
+
+def _server_failed(host, port):
+    failures = _SERVER_FAILURES.get((host, port), (0, 0))[0] + 1
+    backoff = min(FLAGS.glance_api_server_backoff * 2 ** (failures - 1),
+                  FLAGS.glance_api_server_max_backoff)
+    LOG.warn(_('Glance api server %(host)s:%(port)s failed, avoiding it for '
+               '%(backoff)d seconds'), locals())
+    _SERVER_FAILURES[(host, port)] = (failures, time.time() + backoff)
+
+
+def _server_ok(host, port):
+    _SERVER_FAILURES.pop((host, port), None)
+
+
+class _ImageMetaCache(object):
+    """Image metadata from glance, kept for FLAGS.glance_image_cache_ttl.
+
+    Entries are per auth token since what glance returns depends on who
+    asks.  Only active images are kept: the metadata of images still being
+    uploaded or saved changes as they progress.  Each process has its own
+    cache, so changes made through another process may go unseen for up
+    to the ttl.
+    """
+
+    def __init__(self):
+        # image_id -> {auth_token: (expires, image_meta)}
+        self._entries = {}
+        self._size = 0
+
+    def get(self, context, image_id):
+        entry = self._entries.get(str(image_id), {}).get(context.auth_token)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def set(self, context, image_meta):
+        ttl = FLAGS.glance_image_cache_ttl
+        if (ttl <= 0 or image_meta.get('id') is None or
+            image_meta.get('status') != 'active'):
+            return
+        if self._size >= FLAGS.glance_image_cache_size:
+            self._expire()
+            if self._size >= FLAGS.glance_image_cache_size:
+                return
+        tokens = self._entries.setdefault(str(image_meta['id']), {})
+        if context.auth_token not in tokens:
+            self._size += 1
+        tokens[context.auth_token] = (time.time() + ttl, image_meta)
+
+    def _expire(self):
+        now = time.time()
+        for image_id, tokens in self._entries.items():
+            for token, entry in tokens.items():
+                if entry[0] < now:
+                    del tokens[token]
+                    self._size -= 1
+            if not tokens:
+                del self._entries[image_id]
+
+    def invalidate(self, image_id):
+        self._size -= len(self._entries.pop(str(image_id), {}))
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+
+_IMAGE_META_CACHE = _ImageMetaCache()
 
 
 def get_glance_client(context, image_href):
@@ -103,9 +212,7 @@ def get_glance_client(context, image_href):
 
     # check if this is an id
     if '/' not in str(image_href):
-        glance_client = _create_glance_client(context,
-                                              glance_host,
-                                              glance_port)
+        glance_client = _get_glance_client(context, glance_host, glance_port)
         return (glance_client, image_href)
 
     else:
@@ -114,9 +221,7 @@ def get_glance_client(context, image_href):
         except ValueError:
             raise exception.InvalidImageRef(image_href=image_href)
 
-        glance_client = _create_glance_client(context,
-                                              glance_host,
-                                              glance_port)
+        glance_client = _get_glance_client(context, glance_host, glance_port)
         return (glance_client, image_id)
 
 
@@ -126,14 +231,24 @@ class GlanceImageService(object):
     def __init__(self, client=None):
         self._client = client
 
-    def _get_client(self, context):
-        # NOTE(sirp): we want to load balance each request across glance
-        # servers. Since GlanceImageService is a long-lived object, `client`
-        # is made to choose a new server each time via this property.
+    def _call(self, context, method, *args, **kwargs):
+        """Call a glance client method, tracking the health of the server
+        it went to."""
         if self._client is not None:
-            return self._client
+            return getattr(self._client, method)(*args, **kwargs)
+
+        # NOTE(sirp): we want to load balance each request across glance
+        # servers. Since GlanceImageService is a long-lived object, a new
+        # server is chosen for each call.
         glance_host, glance_port = pick_glance_api_server()
-        return _create_glance_client(context, glance_host, glance_port)
+        client = _get_glance_client(context, glance_host, glance_port)
+        try:
+            result = getattr(client, method)(*args, **kwargs)
+        except _CONNECTION_ERRORS:
+            with utils.save_and_reraise_exception():
+                _server_failed(glance_host, glance_port)
+        _server_ok(glance_host, glance_port)
+        return result
 
     def index(self, context, **kwargs):
         """Calls out to Glance for a list of images available."""
@@ -157,6 +272,7 @@ class GlanceImageService(object):
 
         images = []
         for image_meta in image_metas:
+            _IMAGE_META_CACHE.set(context, image_meta)
             if self._is_image_available(context, image_meta):
                 base_image_meta = self._translate_from_glance(image_meta)
                 images.append(base_image_meta)
@@ -180,44 +296,39 @@ class GlanceImageService(object):
         # NOTE(vish): don't filter out private images
         kwargs['filters'].setdefault('is_public', 'none')
 
-        client = self._get_client(context)
-        return self._fetch_images(client.get_images_detailed, **kwargs)
+        return self._fetch_images(context, **kwargs)
 
-    def _fetch_images(self, fetch_func, **kwargs):
+    def _fetch_images(self, context, **kwargs):
         """Paginate through results from glance server"""
-        images = fetch_func(**kwargs)
-
-        if not images:
-            # break out of recursive loop to end pagination
-            return
-
-        for image in images:
-            yield image
+        while True:
+            images = self._call(context, 'get_images_detailed', **kwargs)
+            if not images:
+                return
 
-        try:
-            # attempt to advance the marker in order to fetch next page
-            kwargs['marker'] = images[-1]['id']
-        except KeyError:
-            raise exception.ImagePaginationFailed()
+            for image in images:
+                yield image
 
-        try:
-            kwargs['limit'] = kwargs['limit'] - len(images)
-            # break if we have reached a provided limit
-            if kwargs['limit'] <= 0:
-                return
-        except KeyError:
-            # ignore missing limit, just proceed without it
-            pass
+            try:
+                # attempt to advance the marker in order to fetch next page
+                kwargs['marker'] = images[-1]['id']
+            except KeyError:
+                raise exception.ImagePaginationFailed()
 
-        for image in self._fetch_images(fetch_func, **kwargs):
-            yield image
+            if 'limit' in kwargs:
+                kwargs['limit'] = kwargs['limit'] - len(images)
+                # break if we have reached a provided limit
+                if kwargs['limit'] <= 0:
+                    return
 
     def show(self, context, image_id):
         """Returns a dict with image data for the given opaque image id."""
-        try:
-            image_meta = self._get_client(context).get_image_meta(image_id)
-        except glance_exception.NotFound:
-            raise exception.ImageNotFound(image_id=image_id)
+        image_meta = _IMAGE_META_CACHE.get(context, image_id)
+        if image_meta is None:
+            try:
+                image_meta = self._call(context, 'get_image_meta', image_id)
+            except glance_exception.NotFound:
+                raise exception.ImageNotFound(image_id=image_id)
+            _IMAGE_META_CACHE.set(context, image_meta)
 
         if not self._is_image_available(context, image_meta):
             raise exception.ImageNotFound(image_id=image_id)
@@ -239,9 +350,9 @@ class GlanceImageService(object):
         """Calls out to Glance for metadata and data and writes data."""
         num_retries = FLAGS.glance_num_retries
         for count in xrange(1 + num_retries):
-            client = self._get_client(context)
             try:
-                image_meta, image_chunks = client.get_image(image_id)
+                image_meta, image_chunks = self._call(context, 'get_image',
+                                                      image_id)
                 break
             except glance_exception.NotFound:
                 raise exception.ImageNotFound(image_id=image_id)
@@ -269,8 +380,8 @@ class GlanceImageService(object):
         LOG.debug(_('Metadata after formatting for Glance %s'),
                   sent_service_image_meta)
 
-        recv_service_image_meta = self._get_client(context).add_image(
-            sent_service_image_meta, data)
+        recv_service_image_meta = self._call(context, 'add_image',
+                                             sent_service_image_meta, data)
 
         # Translate Service -> Base
         base_image_meta = self._translate_from_glance(recv_service_image_meta)
@@ -288,10 +399,12 @@ class GlanceImageService(object):
         self.show(context, image_id)
         image_meta = self._translate_to_glance(image_meta)
         try:
-            client = self._get_client(context)
-            image_meta = client.update_image(image_id, image_meta, data)
+            image_meta = self._call(context, 'update_image', image_id,
+                                    image_meta, data)
         except glance_exception.NotFound:
             raise exception.ImageNotFound(image_id=image_id)
+        finally:
+            _IMAGE_META_CACHE.invalidate(image_id)
 
         base_image_meta = self._translate_from_glance(image_meta)
         return base_image_meta
@@ -323,9 +436,11 @@ class GlanceImageService(object):
                 raise exception.NotAuthorized(_("Not the image owner"))
 
         try:
-            result = self._get_client(context).delete_image(image_id)
+            result = self._call(context, 'delete_image', image_id)
         except glance_exception.NotFound:
             raise exception.ImageNotFound(image_id=image_id)
+        finally:
+            _IMAGE_META_CACHE.invalidate(image_id)
         return result
 
     def delete_all(self):
@@ -61,6 +61,12 @@ class S3ImageService(object):
     def get_image_id(self, context, image_uuid):
         return nova.db.api.s3_image_get_by_uuid(context, image_uuid)['id']
 
+    def get_image_ids(self, context, image_uuids):
+        """Map each of image_uuids that has an id to it, in one query."""
+        return dict((s3_image['uuid'], s3_image['id']) for s3_image in
+                    nova.db.api.s3_image_get_all_by_uuids(context,
+                                                          image_uuids))
+
     def _create_image_id(self, context, image_uuid):
         return nova.db.api.s3_image_create(context, image_uuid)['id']
 
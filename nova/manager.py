@@ -53,14 +53,30 @@ This module provides Manager, a base class for managers.
 
 """
 
+import random
+import time
+
+import eventlet
+from eventlet import greenpool
+
 from nova.db import base
 from nova import flags
 from nova import log as logging
 from nova.scheduler import api
+from nova import utils
 from nova import version
 
 
 FLAGS = flags.FLAGS
+flags.DEFINE_boolean('periodic_tasks_concurrent', False,
+                     'Run each due periodic task in its own greenthread '
+                     'so a slow task does not delay the others')
+flags.DEFINE_integer('periodic_task_timeout', 0,
+                     'Default number of seconds a periodic task may run '
+                     'before it is interrupted (0 means no limit)')
+flags.DEFINE_float('periodic_task_jitter', 0.1,
+                   'Random extra delay, as a fraction of the task spacing, '
+                   'added between runs of periodic tasks with a spacing')
 
 
 LOG = logging.getLogger('nova.manager')
@@ -76,10 +92,21 @@ def periodic_task(*args, **kwargs):
 
         2. With arguments, @periodic_task(ticks_between_runs=N), this will be
            run on every N ticks of the periodic scheduler.
+
+    Further keyword arguments:
+
+        spacing: run at most once every this many seconds (plus jitter, see
+                 FLAGS.periodic_task_jitter) rather than counting ticks.
+
+        timeout: interrupt the task after this many seconds, overriding
+                 FLAGS.periodic_task_timeout.  As with any eventlet timeout
+                 the task is only interrupted when it next yields.
     """
     def decorator(f):
         f._periodic_task = True
         f._ticks_between_runs = kwargs.pop('ticks_between_runs', 0)
+        f._periodic_spacing = kwargs.pop('spacing', 0)
+        f._periodic_timeout = kwargs.pop('timeout', None)
         return f
 
     # NOTE(sirp): The `if` is necessary to allow the decorator to be used with
@@ -134,10 +161,26 @@ class Manager(base.Base):
         if not host:
             host = FLAGS.host
         self.host = host
+        self._periodic_next_run = {}
+        self._periodic_running = {}
+        self._periodic_stats = {}
+        self._periodic_pool = None
         super(Manager, self).__init__(db_driver)
 
     def periodic_tasks(self, context, raise_on_error=False):
-        """Tasks to be run at a periodic interval."""
+        """Tasks to be run at a periodic interval.
+
+        Due tasks are run one after another unless
+        FLAGS.periodic_tasks_concurrent is set, in which case each is started
+        in its own greenthread and a task still running from an earlier tick
+        is not started again.
+        """
+        concurrent = FLAGS.periodic_tasks_concurrent and not raise_on_error
+        if concurrent and self._periodic_pool is None:
+            self._periodic_pool = greenpool.GreenPool(
+                    max(1, len(self._periodic_tasks)))
+
+        now = utils.utcnow_ts()
         for task_name, task in self._periodic_tasks:
             full_task_name = '.'.join([self.__class__.__name__, task_name])
 
@@ -148,16 +191,73 @@ class Manager(base.Base):
                 self._ticks_to_skip[task_name] -= 1
                 continue
 
+            next_run = self._periodic_next_run.get(task_name, 0)
+            if now < next_run:
+                LOG.debug(_("Skipping %(full_task_name)s, not due for "
+                            "%(next_run)s"), locals())
+                continue
+
+            if self._periodic_running.get(task_name):
+                LOG.warn(_("Skipping %(full_task_name)s, previous run is "
+                           "still in progress"), locals())
+                continue
+
             self._ticks_to_skip[task_name] = task._ticks_between_runs
+            spacing = task._periodic_spacing
+            if spacing:
+                jitter = spacing * FLAGS.periodic_task_jitter
+                jitter = random.uniform(0, jitter)
+                self._periodic_next_run[task_name] = now + spacing + jitter
             LOG.debug(_("Running periodic task %(full_task_name)s"), locals())
 
+            if concurrent:
+                self._periodic_running[task_name] = True
+                self._periodic_pool.spawn_n(self._run_periodic_task, context,
+                                            task_name, task, False)
+            else:
+                self._run_periodic_task(context, task_name, task,
+                                        raise_on_error)
+
+    def _run_periodic_task(self, context, task_name, task, raise_on_error):
+        """Run one periodic task with its timeout, recording statistics."""
+        full_task_name = '.'.join([self.__class__.__name__, task_name])
+        timeout = task._periodic_timeout
+        if timeout is None:
+            timeout = FLAGS.periodic_task_timeout
+
+        stats = self._periodic_stats.setdefault(task_name,
+                {'runs': 0, 'failures': 0, 'timeouts': 0,
+                 'last_duration': 0.0, 'max_duration': 0.0,
+                 'total_duration': 0.0})
+        start = time.time()
+        try:
             try:
-                task(self, context)
+                with eventlet.Timeout(timeout or None):
+                    task(self, context)
+            except eventlet.Timeout:
+                stats['timeouts'] += 1
+                LOG.error(_("Periodic task %(full_task_name)s timed out "
+                            "after %(timeout)s seconds"), locals())
+                if raise_on_error:
+                    raise
             except Exception as e:
+                stats['failures'] += 1
                 if raise_on_error:
                     raise
                 LOG.exception(_("Error during %(full_task_name)s: %(e)s"),
                               locals())
+        finally:
+            duration = time.time() - start
+            stats['runs'] += 1
+            stats['last_duration'] = duration
+            stats['total_duration'] += duration
+            stats['max_duration'] = max(stats['max_duration'], duration)
+            self._periodic_running[task_name] = False
+
+    def periodic_task_stats(self):
+        """Return run-time statistics for each periodic task run so far."""
+        return dict((name, stats.copy())
+                    for name, stats in self._periodic_stats.iteritems())
 
     def init_host(self):
         """Handle initialization if this is a standalone service.
@@ -22,6 +22,7 @@ import calendar
 import inspect
 import netaddr
 import os
+import time
 
 from nova import db
 from nova import exception
@@ -69,6 +70,10 @@ flags.DEFINE_bool('send_arp_for_ha', False,
 flags.DEFINE_bool('use_single_default_gateway',
                    False, 'Use single default gateway. Only first nic of vm'
                           ' will get default gateway from dhcp server')
+flags.DEFINE_integer('iptables_resync_interval', 300,
+                     'Seconds after which iptables tables are rewritten even '
+                     'if our rules have not changed, to repair rules removed '
+                     'behind our back (0 to rewrite on every apply)')
 binary_name = os.path.basename(inspect.stack()[-1][1])
 
 
@@ -234,6 +239,16 @@ class IptablesManager(object):
         else:
             self.execute = execute
 
+        # Rules last written to each (command, table) and when, so apply()
+        # can skip tables whose rules have not changed since.
+        self._applied_rules = {}
+        self._applied_at = {}
+
+        # apply() requests are numbered so that one apply can satisfy every
+        # request made while an earlier apply held the lock.
+        self._apply_requested = 0
+        self._apply_completed = 0
+
         self.ipv4 = {'filter': IptablesTable(),
                      'nat': IptablesTable()}
         self.ipv6 = {'filter': IptablesTable()}
@@ -287,21 +302,42 @@ class IptablesManager(object):
         self.ipv4['nat'].add_chain('float-snat')
         self.ipv4['nat'].add_rule('snat', '-j $float-snat')
 
-    @utils.synchronized('iptables', external=True)
-    def apply(self):
+    def apply(self, force=False):
         """Apply the current in-memory set of iptables rules.
 
         This will blow away any rules left over from previous runs of the
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        Tables whose rules are unchanged since they were last written are
+        left alone unless force is set or FLAGS.iptables_resync_interval
+        has passed. Callers that wait on the lock while another apply runs
+        are satisfied by a single follow-up apply.
+
         """
+        self._apply_requested += 1
+        self._apply(self._apply_requested, force)
+
+    @utils.synchronized('iptables', external=True)
+    def _apply(self, request, force):
+        if request <= self._apply_completed and not force:
+            LOG.debug(_('iptables changes already applied, skipping'))
+            return
+
+        # Everything requested so far is covered by the rules we read now.
+        covered = self._apply_requested
+
         s = [('iptables', self.ipv4)]
         if FLAGS.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
             for table in tables:
+                key = (cmd, table)
+                rules = self._table_state(tables[table])
+                if not force and not self._needs_apply(key, rules):
+                    continue
+
                 current_table, _ = self.execute('%s-save' % (cmd,),
                                                 '-t', '%s' % (table,),
                                                 run_as_root=True,
@@ -312,6 +348,21 @@ class IptablesManager(object):
                 self.execute('%s-restore' % (cmd,), run_as_root=True,
                              process_input='\n'.join(new_filter),
                              attempts=5)
+                self._applied_rules[key] = rules
+                self._applied_at[key] = time.time()
+
+        self._apply_completed = max(self._apply_completed, covered)
+
+    @staticmethod
+    def _table_state(table):
+        return (frozenset(table.chains), frozenset(table.unwrapped_chains),
+                tuple((str(rule), rule.top) for rule in table.rules))
+
+    def _needs_apply(self, key, rules):
+        if self._applied_rules.get(key) != rules:
+            return True
+        age = time.time() - self._applied_at.get(key, 0)
+        return age >= FLAGS.iptables_resync_interval
 
     def _modify_rules(self, current_lines, table, binary=None):
         unwrapped_chains = table.unwrapped_chains
@@ -333,16 +384,20 @@ class IptablesManager(object):
                     break
 
         our_rules = []
+        top_rules = set()
         for rule in rules:
             rule_str = str(rule)
             if rule.top:
-                # rule.top == True means we want this rule to be at the top.
-                # Further down, we weed out duplicates from the bottom of the
-                # list, so here we remove the dupes ahead of time.
-                new_filter = filter(lambda s: s.strip() != rule_str.strip(),
-                                    new_filter)
+                top_rules.add(rule_str.strip())
             our_rules += [rule_str]
 
+        if top_rules:
+            # rule.top == True means we want this rule to be at the top.
+            # Further down, we weed out duplicates from the bottom of the
+            # list, so here we remove the dupes ahead of time.
+            new_filter = [line for line in new_filter
+                          if line.strip() not in top_rules]
+
         new_filter[rules_index:rules_index] = our_rules
 
         new_filter[rules_index:rules_index] = [':%s - [0:0]' % \
@@ -119,6 +119,29 @@ flags.DEFINE_string('dhcp_domain',
                     'domain to use for building the hostnames')
 
 
+# An ip filter made only of address characters and escaped dots, optionally
+# anchored, which can be answered with an indexed LIKE query.
+_LITERAL_IP_FILTER = re.compile(r'^\^?((?:[0-9a-fA-F:]|\\?\.)+)(\$?)$')
+
+
+def _ip_filter_to_like(ip_filter):
+    """Turn an ip regex into an equivalent SQL match if possible.
+
+    Returns (pattern, exact) or None if the filter needs a real regex.
+    re.match anchors at the start, an unescaped '.' matches any single
+    character like '_' in LIKE, and without '$' any suffix may follow.
+    """
+    match = _LITERAL_IP_FILTER.match(ip_filter)
+    if not match:
+        return None
+    body, anchored = match.groups()
+    pattern = ''.join(token == '.' and '_' or token[-1]
+                      for token in re.findall(r'\\\.|.', body))
+    if not anchored:
+        return pattern + '%', False
+    return pattern, '_' not in pattern
+
+
 class AddressAlreadyAllocated(exception.Error):
     """Address was already allocated."""
     pass
@@ -227,6 +250,10 @@ class FloatingIP(object):
             floating_address = self.allocate_floating_ip(context, project_id)
             # set auto_assigned column to true for the floating ip
             self.db.floating_ip_set_auto_assigned(context, floating_address)
+            # auto assigned floating ips do not count against the quota
+            reservations = quota.reserve(context, project_id=project_id,
+                                         floating_ips=-1)
+            quota.commit(context, reservations)
 
             # get the first fixed address belonging to the instance
             for nw, info in nw_info:
@@ -289,16 +316,26 @@ class FloatingIP(object):
     def allocate_floating_ip(self, context, project_id):
         """Gets an floating ip from the pool."""
         # NOTE(tr3buchet): all network hosts in zone now use the same pool
-        LOG.debug("QUOTA: %s" % quota.allowed_floating_ips(context, 1))
-        if quota.allowed_floating_ips(context, 1) < 1:
+        try:
+            if quota.allowed_floating_ips(context, 1) < 1:
+                raise exception.OverQuota(overs='floating_ips')
+            reservations = quota.reserve(context, project_id=project_id,
+                                         floating_ips=1)
+        except exception.OverQuota:
             LOG.warn(_('Quota exceeded for %s, tried to allocate '
                        'address'),
                      context.project_id)
             raise exception.QuotaError(_('Address quota exceeded. You cannot '
                                      'allocate any more addresses'))
-        # TODO(vish): add floating ips through manage command
-        return self.db.floating_ip_allocate_address(context,
-                                                    project_id)
+        try:
+            # TODO(vish): add floating ips through manage command
+            floating_address = self.db.floating_ip_allocate_address(
+                    context, project_id)
+        except Exception:
+            with utils.save_and_reraise_exception():
+                quota.rollback(context, reservations)
+        quota.commit(context, reservations)
+        return floating_address
 
     def deallocate_floating_ip(self, context, address,
                                affect_auto_assigned=False):
@@ -317,7 +354,14 @@ class FloatingIP(object):
             floating_address = floating_ip['address']
             raise exception.FloatingIpAssociated(address=floating_address)
 
+        reservations = None
+        if not floating_ip.get('auto_assigned'):
+            reservations = quota.reserve(context,
+                                         project_id=floating_ip.get(
+                                                 'project_id'),
+                                         floating_ips=-1)
         self.db.floating_ip_deallocate(context, address)
+        quota.commit(context, reservations)
 
     def associate_floating_ip(self, context, floating_address, fixed_address,
                                                  affect_auto_assigned=False):
@@ -565,39 +609,87 @@ class NetworkManager(manager.SchedulerDependentManager):
 
     def get_instance_uuids_by_ip_filter(self, context, filters):
         fixed_ip_filter = filters.get('fixed_ip')
-        ip_filter = re.compile(str(filters.get('ip')))
-        ipv6_filter = re.compile(str(filters.get('ip6')))
+        ip_filter = filters.get('ip')
+        ipv6_filter = filters.get('ip6')
+        results = []
+
+        # Exact and prefix matches are answered from the address indexes;
+        # only real regexes need to walk every virtual interface.
+        if fixed_ip_filter:
+            for ip in self.db.fixed_ip_get_instance_ips_by_address(context,
+                    fixed_ip_filter):
+                if not ip['floating']:
+                    results.append({'instance_id': ip['instance_id'],
+                                    'ip': ip['address']})
+
+        if ip_filter is not None:
+            sql_filter = _ip_filter_to_like(str(ip_filter))
+            if sql_filter is not None:
+                pattern, exact = sql_filter
+                for ip in self.db.fixed_ip_get_instance_ips_by_address(
+                        context, pattern, exact=exact):
+                    results.append({'instance_id': ip['instance_id'],
+                                    'ip': ip['address']})
+                ip_filter = None
+
+        if ip_filter is not None or ipv6_filter is not None:
+            results.extend(self._get_instance_ips_by_regex(context,
+                                                           ip_filter,
+                                                           ipv6_filter))
+
+        seen = set()
+        unique_results = []
+        for res in results:
+            key = (res['instance_id'], res['ip'])
+            if key not in seen:
+                seen.add(key)
+                unique_results.append(res)
+        results = unique_results
+
+        # NOTE(jkoelker) Until we switch over to instance_uuid ;)
+        ids = [res['instance_id'] for res in results]
+        uuid_map = self.db.instance_get_id_to_uuid_mapping(context, ids)
+        for res in results:
+            res['instance_uuid'] = uuid_map.get(res['instance_id'])
+        return results
 
-        # NOTE(jkoelker) Should probably figure out a better way to do
-        #                this. But for now it "works", this could suck on
-        #                large installs.
+    def _get_instance_ips_by_regex(self, context, ip_filter, ipv6_filter):
+        """Match ip regexes against every virtual interface's addresses."""
+        if ip_filter is not None:
+            ip_filter = re.compile(str(ip_filter))
+        if ipv6_filter is not None:
+            ipv6_filter = re.compile(str(ipv6_filter))
 
         vifs = self.db.virtual_interface_get_all(context)
+        networks = {}
         results = []
 
         for vif in vifs:
             if vif['instance_id'] is None:
                 continue
 
-            network = self.db.network_get(context, vif['network_id'])
-            fixed_ipv6 = None
-            if network['cidr_v6'] is not None:
-                fixed_ipv6 = ipv6.to_global(network['cidr_v6'],
-                                            vif['address'],
-                                            context.project_id)
+            if ipv6_filter:
+                network_id = vif['network_id']
+                if network_id not in networks:
+                    networks[network_id] = self.db.network_get(context,
+                                                               network_id)
+                network = networks[network_id]
+                if network['cidr_v6'] is not None:
+                    fixed_ipv6 = ipv6.to_global(network['cidr_v6'],
+                                                vif['address'],
+                                                context.project_id)
+                    if ipv6_filter.match(fixed_ipv6):
+                        # NOTE(jkoelker) Will need to update for the UUID
+                        #                flip
+                        results.append({'instance_id': vif['instance_id'],
+                                        'ip': fixed_ipv6})
 
-            if fixed_ipv6 and ipv6_filter.match(fixed_ipv6):
-                # NOTE(jkoelker) Will need to update for the UUID flip
-                results.append({'instance_id': vif['instance_id'],
-                                'ip': fixed_ipv6})
+            if not ip_filter:
+                continue
 
             for fixed_ip in vif['fixed_ips']:
                 if not fixed_ip or not fixed_ip['address']:
                     continue
-                if fixed_ip['address'] == fixed_ip_filter:
-                    results.append({'instance_id': vif['instance_id'],
-                                    'ip': fixed_ip['address']})
-                    continue
                 if ip_filter.match(fixed_ip['address']):
                     results.append({'instance_id': vif['instance_id'],
                                     'ip': fixed_ip['address']})
@@ -608,13 +700,6 @@ class NetworkManager(manager.SchedulerDependentManager):
                     if ip_filter.match(floating_ip['address']):
                         results.append({'instance_id': vif['instance_id'],
                                         'ip': floating_ip['address']})
-                        continue
-
-        # NOTE(jkoelker) Until we switch over to instance_uuid ;)
-        ids = [res['instance_id'] for res in results]
-        uuid_map = self.db.instance_get_id_to_uuid_mapping(context, ids)
-        for res in results:
-            res['instance_uuid'] = uuid_map.get(res['instance_id'])
         return results
 
     def _get_networks_for_instance(self, context, instance_id, project_id,
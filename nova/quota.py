@@ -16,10 +16,20 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-"""Quotas for instances, volumes, and floating ips."""
+"""Quotas for instances, volumes, and floating ips.
+
+Usage of instances, cores, ram, volumes, gigabytes and floating ips is
+kept in the quota_usages table.  Callers reserve() a change before making
+it and commit() or rollback() the reservations afterwards, so concurrent
+requests cannot take a project over its quota.
+"""
+
+import datetime
+import time
 
 from nova import db
 from nova import flags
+from nova import utils
 
 
 FLAGS = flags.FLAGS
@@ -43,6 +53,20 @@ flags.DEFINE_integer('quota_max_injected_file_content_bytes', 10 * 1024,
                      'number of bytes allowed per injected file')
 flags.DEFINE_integer('quota_max_injected_file_path_bytes', 255,
                      'number of bytes allowed per injected file path')
+flags.DEFINE_integer('quota_cache_ttl', 5,
+                     'Seconds to cache project quotas for when checking '
+                     'them (0 disables the cache)')
+flags.DEFINE_integer('quota_reservation_expire', 86400,
+                     'Seconds until an uncommitted reservation expires')
+flags.DEFINE_integer('quota_until_refresh', 0,
+                     'Number of reservations until usage is recounted '
+                     '(0 disables)')
+flags.DEFINE_integer('quota_max_age', 0,
+                     'Seconds between recounts of usage (0 disables)')
+
+
+# project_id -> (expires, quotas)
+_QUOTA_CACHE = {}
 
 
 def _get_default_quotas():
@@ -74,6 +98,38 @@ def get_project_quotas(context, project_id):
     return rval
 
 
+def _get_cached_quotas(context, project_id):
+    """Return a project's quotas, from the cache if they are fresh."""
+    now = time.time()
+    entry = _QUOTA_CACHE.get(project_id)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    quotas = get_project_quotas(context, project_id)
+    if FLAGS.quota_cache_ttl > 0:
+        _QUOTA_CACHE[project_id] = (now + FLAGS.quota_cache_ttl, quotas)
+    return quotas
+
+
+def invalidate_quotas(project_id=None):
+    """Drop the cached quotas of a project, or of every project."""
+    if project_id is None:
+        _QUOTA_CACHE.clear()
+    else:
+        _QUOTA_CACHE.pop(project_id, None)
+
+
+def _get_usages(context, project_id, resources, count):
+    """Return the reserved plus in use amount of each resource.
+
+    Falls back to count() for projects whose usage is not tracked yet.
+    """
+    usages = db.quota_usage_get_all_by_project(context, project_id)
+    if not all(resource in usages for resource in resources):
+        return count()
+    return [usages[resource]['in_use'] + usages[resource]['reserved']
+            for resource in resources]
+
+
 def _get_request_allotment(requested, used, quota):
     if quota is None:
         return requested
@@ -86,9 +142,11 @@ def allowed_instances(context, requested_instances, instance_type):
     context = context.elevated()
     requested_cores = requested_instances * instance_type['vcpus']
     requested_ram = requested_instances * instance_type['memory_mb']
-    usage = db.instance_data_get_for_project(context, project_id)
+    usage = _get_usages(context, project_id, ('instances', 'cores', 'ram'),
+                        lambda: db.instance_data_get_for_project(context,
+                                                                 project_id))
     used_instances, used_cores, used_ram = usage
-    quota = get_project_quotas(context, project_id)
+    quota = _get_cached_quotas(context, project_id)
     allowed_instances = _get_request_allotment(requested_instances,
                                                used_instances,
                                                quota['instances'])
@@ -107,9 +165,11 @@ def allowed_volumes(context, requested_volumes, size):
     context = context.elevated()
     size = int(size)
     requested_gigabytes = requested_volumes * size
-    used_volumes, used_gigabytes = db.volume_data_get_for_project(context,
-                                                                  project_id)
-    quota = get_project_quotas(context, project_id)
+    usage = _get_usages(context, project_id, ('volumes', 'gigabytes'),
+                        lambda: db.volume_data_get_for_project(context,
+                                                               project_id))
+    used_volumes, used_gigabytes = usage
+    quota = _get_cached_quotas(context, project_id)
     allowed_volumes = _get_request_allotment(requested_volumes, used_volumes,
                                              quota['volumes'])
     allowed_gigabytes = _get_request_allotment(requested_gigabytes,
@@ -125,8 +185,11 @@ def allowed_floating_ips(context, requested_floating_ips):
     """Check quota and return min(requested, allowed) floating ips."""
     project_id = context.project_id
     context = context.elevated()
-    used_floating_ips = db.floating_ip_count_by_project(context, project_id)
-    quota = get_project_quotas(context, project_id)
+    usage = _get_usages(context, project_id, ('floating_ips',),
+                        lambda: [db.floating_ip_count_by_project(context,
+                                                                 project_id)])
+    used_floating_ips = usage[0]
+    quota = _get_cached_quotas(context, project_id)
     allowed_floating_ips = _get_request_allotment(requested_floating_ips,
                                                   used_floating_ips,
                                                   quota['floating_ips'])
@@ -135,7 +198,7 @@ def allowed_floating_ips(context, requested_floating_ips):
 
 def _calculate_simple_quota(context, resource, requested):
     """Check quota for resource; return min(requested, allowed)."""
-    quota = get_project_quotas(context, context.project_id)
+    quota = _get_cached_quotas(context, context.project_id)
     allowed = _get_request_allotment(requested, 0, quota[resource])
     return min(requested, allowed)
 
@@ -161,3 +224,40 @@ def allowed_injected_file_content_bytes(context, requested_bytes):
 def allowed_injected_file_path_bytes(context):
     """Return the number of bytes allowed in an injected file path."""
     return FLAGS.quota_max_injected_file_path_bytes
+
+
+def reserve(context, project_id=None, **deltas):
+    """Check changes in usage against a project's quotas and reserve them.
+
+    deltas maps resources (instances, cores, ram, volumes, gigabytes or
+    floating_ips) to the change in their usage; project_id defaults to the
+    context's project.  Returns reservations to commit() once the change
+    has been made or rollback() if it fails.  Raises OverQuota if an
+    increase would take a resource over its quota.
+    """
+    if project_id is None:
+        project_id = context.project_id
+    context = context.elevated()
+    quotas = _get_cached_quotas(context, project_id)
+    expire = utils.utcnow() + datetime.timedelta(
+            seconds=FLAGS.quota_reservation_expire)
+    return db.quota_reserve(context, project_id, quotas, deltas, expire,
+                            until_refresh=FLAGS.quota_until_refresh,
+                            max_age=FLAGS.quota_max_age)
+
+
+def commit(context, reservations):
+    """Apply reservations to usage once their change has been made."""
+    if reservations:
+        db.reservation_commit(context.elevated(), reservations)
+
+
+def rollback(context, reservations):
+    """Release reservations whose change was not made."""
+    if reservations:
+        db.reservation_rollback(context.elevated(), reservations)
+
+
+def expire_reservations(context):
+    """Roll back reservations that were never committed or rolled back."""
+    db.reservation_expire(context.elevated())
@@ -0,0 +1,247 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long running root wrapper serving commands over a UNIX socket.
+
+"nova-rootwrap --daemon" loads the filters once and then runs every
+command it is sent that matches one of them, so callers only pay for a
+connection instead of sudo plus a Python interpreter per command.
+
+The daemon listens on SOCKET_PATH, inside SOCKET_DIR.  Neither can be
+chosen by the caller: the directory is created by root and only root can
+write to it, so nothing in it can be replaced by the nova user while the
+daemon sets up its socket.
+
+Each connection carries one command.  The client sends a JSON object with
+"cmd" (the command line, as for nova-rootwrap) and "stdin", then shuts
+down its side of the socket.  The daemon answers with a JSON object with
+"returncode", "stdout" and "stderr" and closes the connection.  Process
+input and output are base64 encoded since they need not be text.
+
+This module only uses the standard library, as it runs as root outside of
+the nova services.
+"""
+
+import base64
+import errno
+import json
+import os
+import socket
+import stat
+import struct
+import subprocess
+import threading
+
+from nova.rootwrap import wrapper
+
+
+# Same exit codes as bin/nova-rootwrap.
+RC_UNAUTHORIZED = 99
+RC_NOCOMMAND = 98
+
+# Linux only; the socket module of python 2 does not define it.
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+SOCKET_DIR = '/var/run/nova-rootwrap'
+SOCKET_PATH = os.path.join(SOCKET_DIR, 'rootwrap.sock')
+
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return ''.join(chunks)
+        chunks.append(chunk)
+
+
+def _encode(data):
+    if data is None:
+        return None
+    return base64.b64encode(data)
+
+
+def _decode(data):
+    if data is None:
+        return None
+    return base64.b64decode(data)
+
+
+class DaemonUnavailable(Exception):
+    """Nothing is listening on the socket, so the command was not sent."""
+    pass
+
+
+class UnsafeSocketDir(Exception):
+    """The socket directory could be written to by someone but root."""
+    pass
+
+
+def _connect(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error, e:
+        sock.close()
+        raise DaemonUnavailable(e)
+    return sock
+
+
+def is_running(socket_path=SOCKET_PATH):
+    """Return whether a daemon is listening on socket_path."""
+    try:
+        _connect(socket_path).close()
+    except DaemonUnavailable:
+        return False
+    return True
+
+
+def execute(cmd, process_input=None, socket_path=SOCKET_PATH):
+    """Run cmd through the daemon listening on socket_path.
+
+    Returns (returncode, stdout, stderr).  Raises DaemonUnavailable if the
+    daemon cannot be reached.  Once the command is sent, failures raise
+    socket.error or ValueError, as the command may have run.
+    """
+    sock = _connect(socket_path)
+    try:
+        sock.sendall(json.dumps({'cmd': list(cmd),
+                                 'stdin': _encode(process_input)}))
+        sock.shutdown(socket.SHUT_WR)
+        response = json.loads(_recv_all(sock))
+    finally:
+        sock.close()
+    return (response['returncode'], _decode(response['stdout']),
+            _decode(response['stderr']))
+
+
+def _split_env(command):
+    """Split leading VAR=value arguments off a command, as sudo does."""
+    env = None
+    while command and '=' in command[0] and not command[0].startswith('/'):
+        if env is None:
+            env = os.environ.copy()
+        name, _sep, value = command.pop(0).partition('=')
+        env[name] = value
+    return env, command
+
+
+def run_command(filters, userargs, process_input=None):
+    """Run userargs if a filter allows it, returning (rc, out, err)."""
+    if not userargs:
+        return (RC_NOCOMMAND, '', 'No command specified\n')
+    filtermatch = wrapper.match_filter(filters, userargs)
+    if not filtermatch:
+        return (RC_UNAUTHORIZED, '',
+                'Unauthorized command: %s\n' % ' '.join(userargs))
+    env, command = _split_env(filtermatch.get_command(userargs))
+    try:
+        obj = subprocess.Popen(command,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               close_fds=True,
+                               env=env)
+    except OSError, e:
+        return (RC_NOCOMMAND, '', '%s: %s\n' % (command[0], e))
+    stdout, stderr = obj.communicate(process_input)
+    return (obj.returncode, stdout, stderr)
+
+
+class Daemon(object):
+    """Accepts commands on a UNIX socket and runs the allowed ones."""
+
+    def __init__(self, filters, allowed_uid=None, socket_dir=SOCKET_DIR):
+        self.socket_dir = socket_dir
+        self.socket_path = os.path.join(socket_dir,
+                                        os.path.basename(SOCKET_PATH))
+        self.filters = filters
+        if allowed_uid is None:
+            # NOTE: started through sudo, so serve whoever ran sudo.
+            allowed_uid = int(os.environ.get('SUDO_UID', os.getuid()))
+        self.allowed_uid = allowed_uid
+        self.allowed_gid = int(os.environ.get('SUDO_GID', os.getgid()))
+        self.sock = None
+
+    def _make_socket_dir(self):
+        """Create socket_dir, or check that only root can write to it."""
+        try:
+            os.mkdir(self.socket_dir, 0755)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        st = os.lstat(self.socket_dir)
+        if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+            st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+            raise UnsafeSocketDir(self.socket_dir)
+
+    def bind(self):
+        self._make_socket_dir()
+        # NOTE: only this one path is ever removed, and it lives in a
+        # directory that nobody but root can change.
+        try:
+            if stat.S_ISSOCK(os.lstat(self.socket_path).st_mode):
+                os.unlink(self.socket_path)
+        except OSError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0177)
+        try:
+            self.sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        os.lchown(self.socket_path, self.allowed_uid, self.allowed_gid)
+        self.sock.listen(128)
+
+    def serve_forever(self):
+        while True:
+            conn, _addr = self.sock.accept()
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _peer_uid(self, conn):
+        creds = conn.getsockopt(socket.SOL_SOCKET, SO_PEERCRED,
+                                struct.calcsize('3i'))
+        _pid, uid, _gid = struct.unpack('3i', creds)
+        return uid
+
+    def handle(self, conn):
+        try:
+            if self._peer_uid(conn) not in (0, self.allowed_uid):
+                return
+            request = json.loads(_recv_all(conn))
+            userargs = [arg.encode('utf-8') if isinstance(arg, unicode)
+                        else str(arg) for arg in request['cmd']]
+            returncode, stdout, stderr = run_command(
+                    self.filters, userargs, _decode(request.get('stdin')))
+            conn.sendall(json.dumps({'returncode': returncode,
+                                     'stdout': _encode(stdout),
+                                     'stderr': _encode(stderr)}))
+        except Exception:
+            # A broken request or a client that went away; nothing can
+            # be reported back on this connection.
+            pass
+        finally:
+            conn.close()
+
+
+def serve(filters):
+    """Serve commands matching filters on SOCKET_PATH until killed."""
+    daemon = Daemon(filters)
+    daemon.bind()
+    daemon.serve_forever()
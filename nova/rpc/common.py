@@ -17,17 +17,143 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import bisect
 
 from nova import exception
 from nova import flags
 from nova import log as logging
+from nova import utils
 
 LOG = logging.getLogger('nova.rpc')
+FLAGS = flags.FLAGS
 
 flags.DEFINE_integer('rpc_thread_pool_size', 1024,
                              'Size of RPC thread pool')
 flags.DEFINE_integer('rpc_conn_pool_size', 30,
                              'Size of RPC connection pool')
+flags.DEFINE_integer('rpc_response_timeout', 0,
+                             'Seconds to wait for a response from call or '
+                             'multicall (0=wait forever)')
+flags.DEFINE_integer('rpc_stats_interval', 0,
+                             'Seconds between reports of per-method rpc '
+                             'dispatch statistics (0=disabled)')
+flags.DEFINE_integer('rpc_stats_reply_sample', 10,
+                             'Measure the size of one rpc reply in this '
+                             'many for the reply_bytes statistics, which '
+                             'are scaled up to estimate the total')
+
+
+class RpcStats(object):
+    """Per-method counters and latency histograms for the rpc messages
+    dispatched by this process, plus thread pool saturation.
+
+    Time queued is measured from the message arriving to its greenthread
+    starting; time executing from then until the last reply was sent.
+
+    """
+
+    # Upper bounds in seconds of the latency histogram buckets. The
+    # last bucket counts everything slower than the final bound.
+    buckets = (0.001, 0.01, 0.1, 1.0, 10.0, 60.0)
+
+    def __init__(self):
+        self.reset()
+        self._replies = 0
+
+    def reset(self):
+        self.methods = {}  # { <method> : { <stat> : value }}
+        self.pool_size = 0
+        self.max_running = 0
+        self.max_waiting = 0
+
+    def _new_method_stats(self):
+        stats = {'calls': 0, 'failures': 0,
+                 'reply_bytes': 0, 'reply_bytes_max': 0}
+        for phase in ('queued', 'executing'):
+            stats['%s_total' % phase] = 0.0
+            stats['%s_max' % phase] = 0.0
+            stats['%s_histogram' % phase] = [0] * (len(self.buckets) + 1)
+        return stats
+
+    def reply_size(self, reply):
+        """Estimate the serialized size of a reply.  Only one reply in
+        rpc_stats_reply_sample is serialized to measure it, counting for
+        all of them, the others count as 0 bytes."""
+        sample = max(FLAGS.rpc_stats_reply_sample, 1)
+        self._replies += 1
+        if self._replies % sample:
+            return 0
+        return len(utils.dumps(reply)) * sample
+
+    def record_dispatch(self, pool):
+        """Note how busy the pool is as a message is handed to it."""
+        self.pool_size = pool.size
+        self.max_running = max(self.max_running, pool.running())
+        self.max_waiting = max(self.max_waiting, pool.waiting())
+
+    def record(self, method, queued, executing, reply_bytes=0,
+               failed=False):
+        """Record one dispatched message."""
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = self._new_method_stats()
+        stats['calls'] += 1
+        if failed:
+            stats['failures'] += 1
+        for phase, seconds in (('queued', queued),
+                               ('executing', executing)):
+            stats['%s_total' % phase] += seconds
+            stats['%s_max' % phase] = max(stats['%s_max' % phase], seconds)
+            bucket = bisect.bisect_left(self.buckets, seconds)
+            stats['%s_histogram' % phase][bucket] += 1
+        stats['reply_bytes'] += reply_bytes
+        stats['reply_bytes_max'] = max(stats['reply_bytes_max'],
+                                       reply_bytes)
+
+    def to_dict(self):
+        return dict(buckets=list(self.buckets), methods=self.methods,
+                    pool_size=self.pool_size, max_running=self.max_running,
+                    max_waiting=self.max_waiting)
+
+    def report(self):
+        """Log and emit a notification with the stats gathered since
+        the last report, then start over."""
+        # Imported here to avoid circular imports
+        from nova.notifier import api as notifier
+
+        stats = self.to_dict()
+        for method, method_stats in sorted(stats['methods'].iteritems()):
+            calls = method_stats['calls']
+            queued_avg = method_stats['queued_total'] / calls
+            executing_avg = method_stats['executing_total'] / calls
+            LOG.info(_("rpc stats %(method)s: calls=%(calls)d "
+                       "queued avg=%(queued_avg).3fs "
+                       "executing avg=%(executing_avg).3fs") % locals())
+        LOG.info(_("rpc pool stats: size=%(pool_size)d "
+                   "max running=%(max_running)d "
+                   "max waiting=%(max_waiting)d") % stats)
+        try:
+            notifier.notify(notifier.publisher_id('rpc'), 'rpc.stats',
+                            notifier.INFO, stats)
+        except Exception:
+            LOG.exception(_("Failed to send rpc stats notification"))
+        self.reset()
+
+
+_STATS = None
+
+
+def get_stats():
+    """Return the process-wide RpcStats, or None if rpc_stats_interval
+    is not set. Reporting starts on first use."""
+    global _STATS
+    if FLAGS.rpc_stats_interval <= 0:
+        return None
+    if _STATS is None:
+        _STATS = RpcStats()
+        utils.LoopingCall(_STATS.report).start(FLAGS.rpc_stats_interval,
+                                               now=False)
+    return _STATS
 
 
 class RemoteError(exception.NovaException):
@@ -48,6 +174,20 @@ class RemoteError(exception.NovaException):
         super(RemoteError, self).__init__(**self.__dict__)
 
 
+class Timeout(exception.NovaException):
+    """Signifies that a timeout has occurred.
+
+    This exception is raised if the rpc_response_timeout is reached while
+    waiting for a response from the remote side.
+    """
+    message = _("Timeout while waiting on RPC response.")
+
+
+class UnsupportedRpcEnvelopeVersion(exception.NovaException):
+    message = _("Specified RPC envelope version, %(version)s, "
+                "not supported by this endpoint.")
+
+
 class Connection(object):
     """A connection, returned by rpc.create_connection().
 
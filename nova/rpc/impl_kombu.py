@@ -18,16 +18,20 @@ import kombu
 import kombu.entity
 import kombu.messaging
 import kombu.connection
+import base64
 import inspect
 import itertools
 import sys
 import time
 import traceback
 import uuid
+import zlib
 
 import eventlet
 from eventlet import greenpool
 from eventlet import pools
+from eventlet import semaphore
+import eventlet.queue
 import greenlet
 
 from nova import context
@@ -35,11 +39,28 @@ from nova import exception
 from nova import flags
 from nova.rpc import common as rpc_common
 from nova.rpc.common import RemoteError, LOG
+from nova import utils
 
 # Needed for tests
 eventlet.monkey_patch()
 
 FLAGS = flags.FLAGS
+flags.DEFINE_bool('rabbit_single_reply_queue', False,
+                  'Receive call/multicall replies on one long-lived queue '
+                  'per process instead of declaring a new queue for every '
+                  'call. Only enable once all services understand the '
+                  '_reply_q message key.')
+flags.DEFINE_bool('rpc_compact_envelope', False,
+                  'Send call/cast messages in the versioned envelope, with '
+                  'the context as a single sub-object and large bodies '
+                  'compressed. Only enable once all services understand '
+                  'it; replies always use the format of the request.')
+flags.DEFINE_integer('rpc_compress_threshold', 4096,
+                     'Compress enveloped message bodies larger than this '
+                     'many bytes of JSON (0=never compress)')
+
+# Version of the message envelope produced by _pack_message()
+ENVELOPE_VERSION = 1
 
 
 class ConsumerBase(object):
@@ -612,6 +633,7 @@ class ProxyCallback(object):
     def __init__(self, proxy):
         self.proxy = proxy
         self.pool = greenpool.GreenPool(FLAGS.rpc_thread_pool_size)
+        self.stats = rpc_common.get_stats()
 
     def __call__(self, message_data):
         """Consumer callback to call a method on a proxy object.
@@ -626,21 +648,38 @@ class ProxyCallback(object):
         Example: {'method': 'echo', 'args': {'value': 42}}
 
         """
-        LOG.debug(_('received %s') % message_data)
-        ctxt = _unpack_context(message_data)
+        received = time.time()
+        LOG.debug(_('received %s'), message_data)
+        try:
+            ctxt, message_data = _unpack_message(message_data)
+        except rpc_common.UnsupportedRpcEnvelopeVersion:
+            msg_id = message_data.get('_msg_id')
+            if not msg_id:
+                LOG.exception(_('Dropping message'))
+                return
+            # Fail the call now rather than leave the caller to time out.
+            # The reply is not enveloped as the caller understands that.
+            msg_reply(msg_id, failure=sys.exc_info(),
+                      reply_q=message_data.get('_reply_q'))
+            return
         method = message_data.get('method')
         args = message_data.get('args', {})
         if not method:
             LOG.warn(_('no method for message: %s') % message_data)
             ctxt.reply(_('No method for message: %s') % message_data)
             return
-        self.pool.spawn_n(self._process_data, ctxt, method, args)
+        if self.stats:
+            self.stats.record_dispatch(self.pool)
+        self.pool.spawn_n(self._process_data, ctxt, method, args, received)
 
     @exception.wrap_exception()
-    def _process_data(self, ctxt, method, args):
+    def _process_data(self, ctxt, method, args, received=None):
         """Thread that magically looks for a method on the proxy
         object and calls it.
         """
+        started = time.time()
+        reply_bytes = 0
+        failed = False
 
         node_func = getattr(self.proxy, str(method))
         node_args = dict((str(k), v) for k, v in args.iteritems())
@@ -651,13 +690,24 @@ class ProxyCallback(object):
             if inspect.isgenerator(rval):
                 for x in rval:
                     ctxt.reply(x, None)
+                    if self.stats:
+                        reply_bytes += self.stats.reply_size(x)
             else:
                 ctxt.reply(rval, None)
+                if self.stats:
+                    reply_bytes += self.stats.reply_size(rval)
             # This final None tells multicall that it is done.
             ctxt.reply(ending=True)
         except Exception as e:
+            failed = True
             LOG.exception('Exception during message handling')
             ctxt.reply(None, sys.exc_info())
+        finally:
+            if self.stats:
+                finished = time.time()
+                self.stats.record(method, started - (received or started),
+                                  finished - started,
+                                  reply_bytes=reply_bytes, failed=failed)
         return
 
 
@@ -672,10 +722,77 @@ def _unpack_context(msg):
             value = msg.pop(key)
             context_dict[key[9:]] = value
     context_dict['msg_id'] = msg.pop('_msg_id', None)
+    context_dict['reply_q'] = msg.pop('_reply_q', None)
     LOG.debug(_('unpacked context: %s'), context_dict)
     return RpcContext.from_dict(context_dict)
 
 
+def _envelope_body(envelope, body):
+    """Store body in envelope, compressed if its JSON is larger than
+    rpc_compress_threshold."""
+    threshold = FLAGS.rpc_compress_threshold
+    if threshold > 0:
+        serialized = utils.dumps(body)
+        if len(serialized) > threshold:
+            envelope['_body_zlib'] = base64.b64encode(
+                    zlib.compress(serialized))
+            return envelope
+    envelope['_body'] = body
+    return envelope
+
+
+def _open_envelope(envelope):
+    """Return the body stored in envelope by _envelope_body()."""
+    version = envelope['_envelope']
+    if version > ENVELOPE_VERSION:
+        raise rpc_common.UnsupportedRpcEnvelopeVersion(version=version)
+    if '_body_zlib' in envelope:
+        return utils.loads(zlib.decompress(
+                base64.b64decode(envelope['_body_zlib'])))
+    return envelope['_body']
+
+
+def _pack_message(msg, context):
+    """Return the message to send for msg and context.
+
+    Unless rpc_compact_envelope is set, this is msg with the context
+    packed in by _pack_context(), which every endpoint understands.
+
+    """
+    if not FLAGS.rpc_compact_envelope:
+        _pack_context(msg, context)
+        return msg
+    envelope = {'_envelope': ENVELOPE_VERSION,
+                '_context': context.to_dict()}
+    for key in ('_msg_id', '_reply_q'):
+        if key in msg:
+            envelope[key] = msg.pop(key)
+    return _envelope_body(envelope, msg)
+
+
+def _unpack_message(msg):
+    """Unpack a message in either format into (context, msg)."""
+    if '_envelope' not in msg:
+        return _unpack_context(msg), msg
+    body = _open_envelope(msg)
+    # NOTE(vish): Some versions of python don't like unicode keys
+    #             in kwargs.
+    context_dict = dict((str(key), value)
+                        for key, value in msg['_context'].iteritems())
+    context_dict['msg_id'] = msg.get('_msg_id')
+    context_dict['reply_q'] = msg.get('_reply_q')
+    context_dict['envelope'] = msg['_envelope']
+    LOG.debug(_('unpacked context: %s'), context_dict)
+    return RpcContext.from_dict(context_dict), body
+
+
+def _unpack_reply(data):
+    """Return the result/failure/ending dict from a reply message."""
+    if '_envelope' in data:
+        return _open_envelope(data)
+    return data
+
+
 def _pack_context(msg, context):
     """Pack context into msg.
 
@@ -695,11 +812,14 @@ class RpcContext(context.RequestContext):
     def __init__(self, *args, **kwargs):
         msg_id = kwargs.pop('msg_id', None)
         self.msg_id = msg_id
+        self.reply_q = kwargs.pop('reply_q', None)
+        self.envelope = kwargs.pop('envelope', None)
         super(RpcContext, self).__init__(*args, **kwargs)
 
     def reply(self, reply=None, failure=None, ending=False):
         if self.msg_id:
-            msg_reply(self.msg_id, reply, failure, ending)
+            msg_reply(self.msg_id, reply, failure, ending,
+                      reply_q=self.reply_q, envelope=self.envelope)
             if ending:
                 self.msg_id = None
 
@@ -722,6 +842,7 @@ class MulticallWaiter(object):
 
     def __call__(self, data):
         """The consume() callback will call this.  Store the result."""
+        data = _unpack_reply(data)
         if data['failure']:
             self._result = RemoteError(*data['failure'])
         elif data.get('ending', False):
@@ -745,6 +866,100 @@ class MulticallWaiter(object):
             yield result
 
 
+class ReplyProxy(object):
+    """Owns the per-process reply queue used when
+    rabbit_single_reply_queue is set, and routes each reply arriving on
+    it to the greenthread waiting on its msg_id.
+    """
+
+    def __init__(self):
+        self.reply_q = 'reply_%s' % uuid.uuid4().hex
+        self._waiters = {}
+        self.connection = Connection()
+        self.connection.declare_direct_consumer(self.reply_q,
+                                                self._process_data)
+        self.connection.consume_in_thread()
+
+    def _process_data(self, message_data):
+        msg_id = message_data.pop('_msg_id', None)
+        waiter = self._waiters.get(msg_id)
+        if waiter is None:
+            LOG.warn(_('No calling threads waiting for msg_id '
+                       '%(msg_id)s, dropping reply') % locals())
+            return
+        waiter.put(_unpack_reply(message_data))
+
+    def add_waiter(self, msg_id):
+        waiter = eventlet.queue.LightQueue()
+        self._waiters[msg_id] = waiter
+        return waiter
+
+    def del_waiter(self, msg_id):
+        self._waiters.pop(msg_id, None)
+
+    def close(self):
+        self.connection.close()
+
+
+class ReplyWaiter(object):
+    """Iterates over the replies to one call that come in through the
+    ReplyProxy, the same way MulticallWaiter does for a private queue.
+
+    The waiter is removed from the ReplyProxy once the call has ended, or
+    when the caller stops iterating early or drops the ReplyWaiter.
+    """
+
+    def __init__(self, reply_proxy, msg_id, timeout=None):
+        self._reply_proxy = reply_proxy
+        self._msg_id = msg_id
+        self._timeout = timeout
+        self._queue = reply_proxy.add_waiter(msg_id)
+        self._done = False
+
+    def done(self):
+        if self._done:
+            return
+        self._done = True
+        self._reply_proxy.del_waiter(self._msg_id)
+
+    close = done
+
+    def __del__(self):
+        self.done()
+
+    def __iter__(self):
+        """Return a result until we get an 'ending' response"""
+        if self._done:
+            raise StopIteration
+        try:
+            while True:
+                try:
+                    data = self._queue.get(timeout=self._timeout)
+                except eventlet.queue.Empty:
+                    raise rpc_common.Timeout()
+                if data['failure']:
+                    raise RemoteError(*data['failure'])
+                if data.get('ending', False):
+                    raise StopIteration
+                yield data['result']
+        finally:
+            # Also runs when an abandoned iterator is closed
+            self.done()
+
+
+_REPLY_PROXY = None
+_REPLY_PROXY_SEM = semaphore.Semaphore()
+
+
+def _get_reply_proxy():
+    """Return the ReplyProxy for this process, creating it on first use."""
+    global _REPLY_PROXY
+    with _REPLY_PROXY_SEM:
+        if _REPLY_PROXY is None:
+            _REPLY_PROXY = ReplyProxy()
+    return _REPLY_PROXY
+
+
 def create_connection(new=True):
     """Create a connection"""
     return ConnectionContext(pooled=not new)
@@ -760,8 +975,24 @@ def multicall(context, topic, msg):
     msg_id = uuid.uuid4().hex
     msg.update({'_msg_id': msg_id})
     LOG.debug(_('MSG_ID is %s') % (msg_id))
-    _pack_context(msg, context)
 
+    if FLAGS.rabbit_single_reply_queue:
+        # Replies come back on the shared reply queue; register the
+        # waiter before sending so an early reply can't be dropped.
+        reply_proxy = _get_reply_proxy()
+        msg['_reply_q'] = reply_proxy.reply_q
+        msg = _pack_message(msg, context)
+        wait_msg = ReplyWaiter(reply_proxy, msg_id,
+                               timeout=FLAGS.rpc_response_timeout or None)
+        try:
+            with ConnectionContext() as conn:
+                conn.topic_send(topic, msg)
+        except Exception:
+            with utils.save_and_reraise_exception():
+                wait_msg.done()
+        return wait_msg
+
+    msg = _pack_message(msg, context)
     conn = ConnectionContext()
     wait_msg = MulticallWaiter(conn)
     conn.declare_direct_consumer(msg_id, wait_msg)
@@ -782,7 +1013,7 @@ def call(context, topic, msg):
 def cast(context, topic, msg):
     """Sends a message on a topic without waiting for a response."""
     LOG.debug(_('Making asynchronous cast on %s...'), topic)
-    _pack_context(msg, context)
+    msg = _pack_message(msg, context)
     with ConnectionContext() as conn:
         conn.topic_send(topic, msg)
 
@@ -790,7 +1021,7 @@ def cast(context, topic, msg):
 def fanout_cast(context, topic, msg):
     """Sends a message on a fanout exchange without waiting for a response."""
     LOG.debug(_('Making asynchronous fanout cast...'))
-    _pack_context(msg, context)
+    msg = _pack_message(msg, context)
     with ConnectionContext() as conn:
         conn.fanout_send(topic, msg)
 
@@ -803,11 +1034,17 @@ def notify(context, topic, msg):
         conn.notify_send(topic, msg, durable=True)
 
 
-def msg_reply(msg_id, reply=None, failure=None, ending=False):
+def msg_reply(msg_id, reply=None, failure=None, ending=False,
+              reply_q=None, envelope=None):
     """Sends a reply or an error on the channel signified by msg_id.
 
     Failure should be a sys.exc_info() tuple.
 
+    If reply_q is given the caller is waiting on a shared reply queue,
+    so the reply is sent there tagged with msg_id. If envelope is given
+    the caller sent its request in that envelope version, so the reply
+    is enveloped too.
+
     """
     with ConnectionContext() as conn:
         if failure:
@@ -825,4 +1062,10 @@ def msg_reply(msg_id, reply=None, failure=None, ending=False):
                     'failure': failure}
         if ending:
             msg['ending'] = True
-        conn.direct_send(msg_id, msg)
+        if envelope:
+            msg = _envelope_body({'_envelope': ENVELOPE_VERSION}, msg)
+        if reply_q:
+            msg['_msg_id'] = msg_id
+            conn.direct_send(reply_q, msg)
+        else:
+            conn.direct_send(msg_id, msg)
@@ -105,6 +105,24 @@ def update_service_capabilities(context, service_name, host, capabilities):
     return rpc.fanout_cast(context, 'scheduler', kwargs)
 
 
+def update_instance_info(context, host, instance):
+    """Inform all the scheduler services that an instance now uses
+       resources on the given host."""
+    kwargs = dict(method='update_instance_info',
+                  args=dict(host=host, instance_uuid=instance['uuid'],
+                            local_gb=instance['local_gb'],
+                            memory_mb=instance['memory_mb']))
+    return rpc.fanout_cast(context, 'scheduler', kwargs)
+
+
+def delete_instance_info(context, instance_uuid):
+    """Inform all the scheduler services that an instance no longer
+       uses any host resources."""
+    kwargs = dict(method='delete_instance_info',
+                  args=dict(instance_uuid=instance_uuid))
+    return rpc.fanout_cast(context, 'scheduler', kwargs)
+
+
 def call_zone_method(context, method_name, errors_to_ignore=None,
                      novaclient_collection_name='zones', zones=None,
                      *args, **kwargs):
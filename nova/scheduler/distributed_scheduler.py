@@ -19,6 +19,7 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import heapq
 import json
 import operator
 
@@ -61,6 +62,7 @@ class DistributedScheduler(driver.Scheduler):
     def __init__(self, *args, **kwargs):
         super(DistributedScheduler, self).__init__(*args, **kwargs)
         self.cost_function_cache = {}
+        self.filter_classes = None
         self.options = scheduler_options.SchedulerOptions()
 
     def schedule(self, context, topic, method, *args, **kwargs):
@@ -170,6 +172,10 @@ class DistributedScheduler(driver.Scheduler):
                                     kwargs):
         """Create the requested resource in this Zone."""
         instance = self.create_instance_db_entry(context, request_spec)
+        # Claim the resources in the host state cache right away so the
+        # next request sees them before the compute node reports back.
+        self.zone_manager.update_instance_info(weighted_host.host,
+                instance['uuid'], instance['local_gb'], instance['memory_mb'])
         driver.cast_to_compute_host(context, weighted_host.host,
                 'run_instance', instance_uuid=instance['uuid'], **kwargs)
         inst = driver.encode_instance(instance, local=True)
@@ -304,10 +310,11 @@ class DistributedScheduler(driver.Scheduler):
 
         options = self._get_configuration_options()
 
-        # Find our local list of acceptable hosts by repeatedly
-        # filtering and weighing our options. Each time we choose a
-        # host, we virtually consume resources on it so subsequent
-        # selections can adjust accordingly.
+        # Find our local list of acceptable hosts by filtering and
+        # weighing them once, then placing the instances one at a time
+        # from a heap ordered by weight. Each time we choose a host, we
+        # virtually consume resources on it, so only that host needs to
+        # be re-filtered and re-weighed for the next selection.
 
         # unfiltered_hosts_dict is {host : ZoneManager.HostInfo()}
         unfiltered_hosts_dict = self.zone_manager.get_all_host_data(elevated)
@@ -315,28 +322,43 @@ class DistributedScheduler(driver.Scheduler):
 
         num_instances = request_spec.get('num_instances', 1)
         selected_hosts = []
-        for num in xrange(num_instances):
-            # Filter local hosts based on requirements ...
-            filtered_hosts = self._filter_hosts(topic, request_spec,
-                    unfiltered_hosts, options)
 
-            if not filtered_hosts:
+        # Filter local hosts based on requirements ...
+        filtered_hosts = self._filter_hosts(topic, request_spec,
+                unfiltered_hosts, options)
+        LOG.debug(_("Filtered %(filtered_hosts)s") % locals())
+
+        host_infos = [host_info for host, host_info in filtered_hosts]
+        scores = least_cost.score_hosts(cost_functions, host_infos, options)
+        # The index breaks ties so HostInfo objects are never compared.
+        host_heap = [(float(scores[idx]), idx, host, host_info)
+                     for idx, (host, host_info) in enumerate(filtered_hosts)]
+        heapq.heapify(host_heap)
+
+        for num in xrange(num_instances):
+            if not host_heap:
                 # Can't get any more locally.
                 break
 
-            LOG.debug(_("Filtered %(filtered_hosts)s") % locals())
-
-            # weighted_host = WeightedHost() ... the best
-            # host for the job.
-            weighted_host = least_cost.weighted_sum(cost_functions,
-                                                filtered_hosts, options)
+            weight, idx, host, host_info = heapq.heappop(host_heap)
+            weighted_host = least_cost.WeightedHost(weight, host=host,
+                                                    hostinfo=host_info)
             LOG.debug(_("Weighted %(weighted_host)s") % locals())
             selected_hosts.append(weighted_host)
 
+            if num == num_instances - 1:
+                break
+
             # Now consume the resources so the filter/weights
             # will change for the next instance.
-            weighted_host.hostinfo.consume_resources(disk_requirement_gb,
+            host_info.consume_resources(disk_requirement_gb,
                                         ram_requirement_mb)
+            if self._filter_hosts(topic, request_spec, [(host, host_info)],
+                                  options):
+                weight = least_cost.score_hosts(cost_functions,
+                                                [host_info], options)[0]
+                heapq.heappush(host_heap,
+                               (float(weight), idx, host, host_info))
 
         # Next, tack on the host weights from the child zones
         if not request_spec.get('local_zone', False):
@@ -350,16 +372,20 @@ class DistributedScheduler(driver.Scheduler):
         return selected_hosts[:num_instances]
 
     def _get_filter_classes(self):
+        if self.filter_classes is not None:
+            return self.filter_classes
+
         # Imported here to avoid circular imports
         from nova.scheduler import filters
 
         def get_itm(nm):
             return getattr(filters, nm)
 
-        return [get_itm(itm) for itm in dir(filters)
+        self.filter_classes = [get_itm(itm) for itm in dir(filters)
                 if isinstance(get_itm(itm), type)
                 and issubclass(get_itm(itm), filters.AbstractHostFilter)
                 and get_itm(itm) is not filters.AbstractHostFilter]
+        return self.filter_classes
 
     def _choose_host_filters(self, filters=None):
         """Since the caller may specify which filters to use we need
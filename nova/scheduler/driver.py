@@ -371,7 +371,8 @@ class Scheduler(object):
         # It should be sum of memories that are assigned as max value,
         # because overcommiting is risky.
         used = 0
-        instance_refs = db.instance_get_all_by_host(context, dest)
+        instance_refs = db.instance_get_all_by_host(context, dest,
+                                                    profile='minimal')
         used_list = [i['memory_mb'] for i in instance_refs]
         if used_list:
             used = reduce(lambda x, y: x + y, used_list)
@@ -402,7 +403,8 @@ class Scheduler(object):
         # It should be sum of disks that are assigned as max value
         # because overcommiting is risky.
         used = 0
-        instance_refs = db.instance_get_all_by_host(context, dest)
+        instance_refs = db.instance_get_all_by_host(context, dest,
+                                                    profile='minimal')
         used_list = [i['local_gb'] for i in instance_refs]
         if used_list:
             used = reduce(lambda x, y: x + y, used_list)
@@ -87,6 +87,19 @@ class JsonFilter(abstract_filter.AbstractHostFilter):
         'and': _and,
     }
 
+    compare_ops = {
+        '=': operator.eq,
+        '<': operator.lt,
+        '>': operator.gt,
+        '<=': operator.le,
+        '>=': operator.ge,
+    }
+
+    # Compiled queries shared by all JsonFilter objects, keyed by
+    # filter class and JSON query string.
+    _compiled_queries = {}
+    max_compiled_queries = 128
+
     def instance_type_to_filter(self, instance_type):
         """Convert instance_type into JSON filter object."""
         required_ram = instance_type['memory_mb']
@@ -96,49 +109,117 @@ class JsonFilter(abstract_filter.AbstractHostFilter):
                 ['>=', '$compute.disk_available', required_disk]]
         return json.dumps(query)
 
-    def _parse_string(self, string, host, hostinfo):
+    def _compile_lookup(self, string):
         """Strings prefixed with $ are capability lookups in the
-        form '$service.capability[.subcap*]'.
+        form '$service.capability[.subcap*]'. Returns a function of
+        hostinfo doing the lookup, or None if the service is unknown.
         """
-        if not string:
-            return None
-        if not string.startswith("$"):
-            return string
-
         path = string[1:].split(".")
-        services = dict(compute=hostinfo.compute, network=hostinfo.network,
-                        volume=hostinfo.volume)
-        service = services.get(path[0], None)
-        if not service:
+        if path[0] not in ('compute', 'network', 'volume'):
             return None
-        for item in path[1:]:
-            service = service.get(item, None)
+        service_name = path[0]
+        items = path[1:]
+
+        def lookup(hostinfo):
+            service = getattr(hostinfo, service_name)
             if not service:
                 return None
-        return service
-
-    def _process_filter(self, query, host, hostinfo):
-        """Recursively parse the query structure."""
+            for item in items:
+                service = service.get(item, None)
+                if not service:
+                    return None
+            return service
+        return lookup
+
+    def _compile_compare(self, cmd, args):
+        """Fast path for the common ['>=', '$capability', number] form
+        (in either order): a single lookup and comparison per host
+        instead of building and walking an argument list.
+        """
+        if cmd not in self.compare_ops or len(args) != 2:
+            return None
+        numeric = [isinstance(arg, (int, long, float))
+                   and not isinstance(arg, bool) for arg in args]
+        lookups = [isinstance(arg, basestring) and arg.startswith("$")
+                   for arg in args]
+        op = self.compare_ops[cmd]
+        if numeric[1] and lookups[0]:
+            lookup = self._compile_lookup(args[0])
+            value = args[1]
+            if lookup is None:
+                return lambda hostinfo: False
+
+            def compare(hostinfo):
+                found = lookup(hostinfo)
+                return found is not None and op(found, value)
+            return compare
+        if numeric[0] and lookups[1]:
+            lookup = self._compile_lookup(args[1])
+            value = args[0]
+            if lookup is None:
+                return lambda hostinfo: False
+
+            def compare(hostinfo):
+                found = lookup(hostinfo)
+                return found is not None and op(value, found)
+            return compare
+        return None
+
+    def _compile_filter(self, query):
+        """Compile the query structure into a tree of closures, each
+        taking a hostinfo. Arguments which evaluate to None are dropped
+        before the command is applied.
+        """
         if not query:
-            return True
+            return lambda hostinfo: True
         cmd = query[0]
         method = self.commands[cmd]
-        cooked_args = []
-        for arg in query[1:]:
+        args = query[1:]
+
+        fast = self._compile_compare(cmd, args)
+        if fast is not None:
+            return fast
+
+        getters = []
+        for arg in args:
             if isinstance(arg, list):
-                arg = self._process_filter(arg, host, hostinfo)
-            elif isinstance(arg, basestring):
-                arg = self._parse_string(arg, host, hostinfo)
-            if arg is not None:
-                cooked_args.append(arg)
-        result = method(self, cooked_args)
-        return result
+                getters.append(self._compile_filter(arg))
+            elif isinstance(arg, basestring) and arg.startswith("$"):
+                lookup = self._compile_lookup(arg)
+                if lookup is not None:
+                    getters.append(lookup)
+            elif isinstance(arg, basestring) and not arg:
+                continue
+            elif arg is not None:
+                getters.append(lambda hostinfo, arg=arg: arg)
+
+        def evaluate(hostinfo):
+            cooked_args = []
+            for getter in getters:
+                arg = getter(hostinfo)
+                if arg is not None:
+                    cooked_args.append(arg)
+            return method(self, cooked_args)
+        return evaluate
+
+    def _get_compiled_filter(self, query):
+        """Compile the JSON query, reusing the result for a query we
+        have already seen."""
+        cache = JsonFilter._compiled_queries
+        key = (self.__class__, query)
+        compiled = cache.get(key)
+        if compiled is None:
+            compiled = self._compile_filter(json.loads(query))
+            if len(cache) >= self.max_compiled_queries:
+                cache.clear()
+            cache[key] = compiled
+        return compiled
 
     def filter_hosts(self, host_list, query, options):
         """Return a list of hosts that can fulfill the requirements
         specified in the query.
         """
-        expanded = json.loads(query)
+        compiled = self._get_compiled_filter(query)
         filtered_hosts = []
         for host, hostinfo in host_list:
             if not hostinfo:
@@ -146,7 +227,7 @@ class JsonFilter(abstract_filter.AbstractHostFilter):
             if hostinfo.compute and not hostinfo.compute.get("enabled", True):
                 # Host is disabled
                 continue
-            result = self._process_filter(expanded, host, hostinfo)
+            result = compiled(hostinfo)
             if isinstance(result, list):
                 # If any succeeded, include the host
                 result = any(result)
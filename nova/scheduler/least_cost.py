@@ -20,8 +20,20 @@ The WeightedHost contains a combined weight for each cost-function.
 
 The cost-function and weights are tabulated, and the host with the least cost
 is then selected for provisioning.
+
+Cost functions are called once per host. A cost function may also provide
+a batched form as its 'batch' attribute, which takes the list of all
+HostInfo objects at once and returns the list of costs in the same order.
+
+NumPy is optional.  When it is installed the weighing is done with array
+operations, which is faster for many hosts; without it the same scores are
+computed in pure Python.  Either way ties go to the first host by name.
 """
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from nova import flags
 from nova import log as logging
@@ -73,12 +85,59 @@ def noop_cost_fn(host_info, options=None):
     return 1
 
 
+def _noop_cost_fn_batch(host_infos, options=None):
+    return [1] * len(host_infos)
+
+
+noop_cost_fn.batch = _noop_cost_fn_batch
+
+
 def compute_fill_first_cost_fn(host_info, options=None):
     """More free ram = higher weight. So servers will less free
     ram will be preferred."""
     return host_info.free_ram_mb
 
 
+def _compute_fill_first_cost_fn_batch(host_infos, options=None):
+    return [host_info.free_ram_mb for host_info in host_infos]
+
+
+compute_fill_first_cost_fn.batch = _compute_fill_first_cost_fn_batch
+
+
+def _get_costs(fn, host_infos, options):
+    """Return the costs of fn for every host, using its batched
+    form if it has one."""
+    batch_fn = getattr(fn, 'batch', None)
+    if batch_fn is not None:
+        return batch_fn(host_infos, options)
+    return [fn(host_info, options) for host_info in host_infos]
+
+
+def score_hosts(weighted_fns, host_infos, options):
+    """Return the weighted sum of all cost functions for each
+    HostInfo in host_infos, in the same order.
+
+    With NumPy this is a matrix-vector product of the weights against
+    a grid with one row per function and one column per host.
+    """
+    if numpy is not None:
+        if not weighted_fns:
+            return numpy.zeros(len(host_infos))
+        weights = numpy.array([weight for weight, fn in weighted_fns],
+                              dtype=float)
+        grid = numpy.array([_get_costs(fn, host_infos, options)
+                            for weight, fn in weighted_fns], dtype=float)
+        return numpy.dot(weights, grid)
+
+    final_scores = [0.0] * len(host_infos)
+    for weight, fn in weighted_fns:
+        costs = _get_costs(fn, host_infos, options)
+        for idx, cost in enumerate(costs):
+            final_scores[idx] += weight * cost
+    return final_scores
+
+
 def weighted_sum(weighted_fns, host_list, options):
     """Use the weighted-sum method to compute a score for an array of objects.
     Normalize the results of the objective-functions so that the weights are
@@ -92,31 +151,17 @@ def weighted_sum(weighted_fns, host_list, options):
     Returns a single WeightedHost object which represents the best
     candidate.
     """
-
-    # Make a grid of functions results.
-    # One row per host. One column per function.
-    scores = []
-    for weight, fn in weighted_fns:
-        scores.append([fn(host_info, options) for hostname, host_info
-                                                                in host_list])
-
-    # Adjust the weights in the grid by the functions weight adjustment
-    # and sum them up to get a final list of weights.
-    adjusted_scores = []
-    for (weight, fn), row in zip(weighted_fns, scores):
-        adjusted_scores.append([weight * score for score in row])
-
-    # Now, sum down the columns to get the final score. Column per host.
-    final_scores = [0.0] * len(host_list)
-    for row in adjusted_scores:
-        for idx, col in enumerate(row):
-            final_scores[idx] += col
-
-    # Super-impose the hostinfo into the scores so
-    # we don't lose it when we sort.
-    final_scores = [(final_scores[idx], host_tuple)
-                    for idx, host_tuple in enumerate(host_list)]
-
-    final_scores = sorted(final_scores)
-    weight, (host, hostinfo) = final_scores[0]  # Lowest score is the winner!
-    return WeightedHost(weight, host=host, hostinfo=hostinfo)
+    host_infos = [host_info for hostname, host_info in host_list]
+    final_scores = score_hosts(weighted_fns, host_infos, options)
+
+    # Lowest score is the winner, ties broken by host name! No need to
+    # sort the whole list.
+    if numpy is not None:
+        tied = numpy.flatnonzero(final_scores == final_scores.min())
+        idx = min(tied, key=lambda idx: host_list[idx][0])
+    else:
+        idx = min(xrange(len(final_scores)),
+                  key=lambda idx: (final_scores[idx], host_list[idx][0]))
+    host, hostinfo = host_list[idx]
+    return WeightedHost(float(final_scores[idx]), host=host,
+                        hostinfo=hostinfo)
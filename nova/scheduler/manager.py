@@ -29,6 +29,7 @@ from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import manager
+from nova import quota
 from nova import rpc
 from nova.scheduler import zone_manager
 from nova import utils
@@ -60,6 +61,16 @@ class SchedulerManager(manager.Manager):
         """Poll child zones periodically to get status."""
         self.zone_manager.ping(context)
 
+    @manager.periodic_task
+    def _reconcile_host_state(self, context):
+        """Periodically resync the cached host state with the db."""
+        self.zone_manager.reconcile_host_state(context)
+
+    @manager.periodic_task
+    def _expire_reservations(self, context):
+        """Roll back quota reservations that were never finished."""
+        quota.expire_reservations(context)
+
     def get_host_list(self, context=None):
         """Get a list of hosts from the ZoneManager."""
         return self.zone_manager.get_host_list()
@@ -80,6 +91,16 @@ class SchedulerManager(manager.Manager):
         self.zone_manager.update_service_capabilities(service_name,
                             host, capabilities)
 
+    def update_instance_info(self, context=None, host=None,
+                             instance_uuid=None, local_gb=0, memory_mb=0):
+        """Process an instance resource update from a compute node."""
+        self.zone_manager.update_instance_info(host, instance_uuid,
+                                               local_gb, memory_mb)
+
+    def delete_instance_info(self, context=None, instance_uuid=None):
+        """Process an instance removal from a compute node."""
+        self.zone_manager.delete_instance_info(instance_uuid)
+
     def select(self, context=None, *args, **kwargs):
         """Select a list of hosts best matching the provided specs."""
         return self.driver.select(context, *args, **kwargs)
@@ -113,6 +134,8 @@ class SchedulerManager(manager.Manager):
     def _set_instance_error(self, method, context, ex, *args, **kwargs):
         """Sets VM to Error state"""
         LOG.warning(_("Failed to schedule_%(method)s: %(ex)s") % locals())
+        # Quota reserved for the request will not be used now.
+        quota.rollback(context, kwargs.get('reservations'))
         if method != "start_instance" and method != "run_instance":
             return
         # FIXME(comstud): Clean this up after fully on UUIDs.
@@ -153,7 +176,8 @@ class SchedulerManager(manager.Manager):
         compute_ref = db.service_get_all_compute_by_host(context, host)
         compute_ref = compute_ref[0]
         instance_refs = db.instance_get_all_by_host(context,
-                                                    compute_ref['host'])
+                                                    compute_ref['host'],
+                                                    profile='minimal')
 
         # Getting total available/used resource
         compute_ref = compute_ref['compute_node'][0]
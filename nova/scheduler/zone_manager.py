@@ -39,6 +39,9 @@ flags.DEFINE_integer('reserved_host_disk_mb', 0,
         'Amount of disk in MB to reserve for host/dom0')
 flags.DEFINE_integer('reserved_host_memory_mb', 512,
         'Amount of memory in MB to reserve for host/dom0')
+flags.DEFINE_integer('host_state_reconcile_interval', 300,
+        'Seconds between full resyncs of the cached host resource usage '
+        'with the db. Set to 0 to hit the db on every request.')
 
 
 class ZoneState(object):
@@ -188,6 +191,14 @@ class ZoneManager(object):
         self.service_states = {}  # { <host> : { <service> : { cap k : v }}}
         self.green_pool = greenpool.GreenPool()
 
+        # Cached host resource state, seeded from the db and kept current
+        # by instance events from the compute nodes.
+        self.compute_nodes = {}  # { <host> : (local_gb, memory_mb) }
+        self.instance_usage = {}  # { <uuid> : (host, local_gb, memory_mb) }
+        self.host_usage = {}  # { <host> : [local_gb, memory_mb] }
+        self.last_host_state_sync = datetime.datetime.min
+        self.host_state_stale = True
+
     def get_zone_list(self):
         """Return the list of zones we know about."""
         return [zone.to_dict() for zone in self.zone_states.values()]
@@ -210,54 +221,102 @@ class ZoneManager(object):
 
     def _instance_get_all(self, context):
         """Broken out for testing."""
-        return db.instance_get_all(context)
+        return db.instance_get_all(context, profile='minimal')
+
+    def _consume_instance(self, host, local_gb, memory_mb, sign=1):
+        usage = self.host_usage.setdefault(host, [0, 0])
+        usage[0] += sign * local_gb
+        usage[1] += sign * memory_mb
+
+    def sync_host_state(self, context):
+        """Rebuild the cached compute node and instance usage maps
+        from the db. This is the expensive full scan; it is only done
+        when the cache is seeded and on periodic reconciliation."""
+        compute_nodes = {}
+        for compute in self._compute_node_get_all(context):
+            service = compute['service']
+            if not service:
+                logging.warn(_("No service for compute ID %s") % compute['id'])
+                continue
+            compute_nodes[service['host']] = (compute['local_gb'],
+                                              compute['memory_mb'])
+
+        self.compute_nodes = compute_nodes
+        self.instance_usage = {}
+        self.host_usage = {}
+        for instance in self._instance_get_all(context):
+            host = instance['host']
+            if not host:
+                continue
+            self.instance_usage[instance['uuid']] = (host,
+                    instance['local_gb'], instance['memory_mb'])
+            self._consume_instance(host, instance['local_gb'],
+                                   instance['memory_mb'])
+
+        self.last_host_state_sync = utils.utcnow()
+        self.host_state_stale = False
+
+    def host_state_needs_sync(self):
+        """Check if the cached host state must be rebuilt from the db."""
+        if self.host_state_stale:
+            return True
+        interval = datetime.timedelta(
+                seconds=FLAGS.host_state_reconcile_interval)
+        return utils.utcnow() - self.last_host_state_sync >= interval
+
+    def reconcile_host_state(self, context):
+        """Resync the host state cache if it is due. Should be called
+        periodically to correct any drift from missed instance events."""
+        if self.host_state_needs_sync():
+            logging.debug(_("Reconciling host state cache with db."))
+            self.sync_host_state(context)
+
+    def update_instance_info(self, host, instance_uuid, local_gb,
+                             memory_mb):
+        """Record that an instance occupies resources on a host,
+        replacing anything previously recorded for that instance."""
+        self.delete_instance_info(instance_uuid)
+        if not host:
+            return
+        self.instance_usage[instance_uuid] = (host, local_gb, memory_mb)
+        self._consume_instance(host, local_gb, memory_mb)
+
+    def delete_instance_info(self, instance_uuid):
+        """Release the resources recorded for an instance."""
+        usage = self.instance_usage.pop(instance_uuid, None)
+        if usage:
+            host, local_gb, memory_mb = usage
+            self._consume_instance(host, local_gb, memory_mb, sign=-1)
 
     def get_all_host_data(self, context):
         """Returns a dict of all the hosts the ZoneManager
         knows about. Also, each of the consumable resources in HostInfo
-        are pre-populated and adjusted based on data in the db.
+        are pre-populated and adjusted based on the cached host state.
 
         For example:
         {'192.168.1.100': HostInfo(), ...}
 
-        Note: this can be very slow with a lot of instances.
+        The cached state is seeded from the db on first use and kept
+        current through update_instance_info()/delete_instance_info(),
+        so this is O(hosts) rather than a scan of every instance.
         InstanceType table isn't required since a copy is stored
         with the instance (in case the InstanceType changed since the
         instance was created)."""
+        self.reconcile_host_state(context)
 
-        # Make a compute node dict with the bare essential metrics.
-        compute_nodes = self._compute_node_get_all(context)
         host_info_map = {}
-        for compute in compute_nodes:
-            all_disk = compute['local_gb']
-            all_ram = compute['memory_mb']
-            service = compute['service']
-            if not service:
-                logging.warn(_("No service for compute ID %s") % compute['id'])
-                continue
-
-            host = service['host']
+        for host, (all_disk, all_ram) in self.compute_nodes.iteritems():
             caps = self.service_states.get(host, None)
             host_info = HostInfo(host, caps=caps,
                     free_disk_gb=all_disk, free_ram_mb=all_ram)
             # Reserve resources for host/dom0
             host_info.consume_resources(FLAGS.reserved_host_disk_mb * 1024,
                     FLAGS.reserved_host_memory_mb)
+            # "Consume" resources used by the instances on this host.
+            used_disk, used_ram = self.host_usage.get(host, (0, 0))
+            host_info.consume_resources(used_disk, used_ram)
             host_info_map[host] = host_info
 
-        # "Consume" resources from the host the instance resides on.
-        instances = self._instance_get_all(context)
-        for instance in instances:
-            host = instance['host']
-            if not host:
-                continue
-            host_info = host_info_map.get(host, None)
-            if not host_info:
-                continue
-            disk = instance['local_gb']
-            ram = instance['memory_mb']
-            host_info.consume_resources(disk, ram)
-
         return host_info_map
 
     def get_zone_capabilities(self, context):
@@ -331,6 +390,11 @@ class ZoneManager(object):
         """Update the per-service capabilities based on this notification."""
         logging.debug(_("Received %(service_name)s service update from "
                 "%(host)s.") % locals())
+        if service_name == 'compute' and host not in self.compute_nodes \
+                and 'compute' not in self.service_states.get(host, {}):
+            # A compute node we haven't seen before, pick it up
+            # on the next request.
+            self.host_state_stale = True
         service_caps = self.service_states.get(host, {})
         capabilities["timestamp"] = utils.utcnow()  # Reported time
         service_caps[service_name] = capabilities
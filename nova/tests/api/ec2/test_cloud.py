@@ -645,6 +645,56 @@ class CloudTestCase(test.TestCase):
         self.assertEqual(result1[0]['instanceId'],
                          ec2utils.id_to_ec2_id(inst2.id))
 
+    def test_describe_instances_batches_lookups(self):
+        self._stub_instance_get_with_fixed_ips('get_all')
+
+        def not_called(*args, **kwargs):
+            self.fail('describe_instances looked something up per instance')
+
+        self.stubs.Set(self.cloud.compute_api, 'get', not_called)
+        self.stubs.Set(db, 'service_get_all_by_host', not_called)
+        self.stubs.Set(db, 'block_device_mapping_get_all_by_instance',
+                       not_called)
+        self.stubs.Set(self.cloud.volume_api, 'get', not_called)
+
+        image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
+        comp = db.service_create(self.context, {'host': 'host1',
+                                                'availability_zone': 'zone1',
+                                                'topic': 'compute'})
+        instances = []
+        for i in xrange(3):
+            instances.append(db.instance_create(self.context,
+                    {'reservation_id': 'a',
+                     'image_ref': image_uuid,
+                     'instance_type_id': 1,
+                     'host': 'host1',
+                     'vm_state': 'active'}))
+        vol = db.volume_create(self.context, {'status': 'in-use'})
+        db.block_device_mapping_create(self.context,
+                {'instance_id': instances[0]['id'],
+                 'device_name': '/dev/sdb',
+                 'volume_id': vol['id']})
+
+        ec2_ids = [ec2utils.id_to_ec2_id(instance['id'])
+                   for instance in instances[:2]]
+        result = self.cloud.describe_instances(self.context,
+                                               instance_id=ec2_ids)
+        result = result['reservationSet'][0]['instancesSet']
+        self.assertEqual(sorted(i['instanceId'] for i in result),
+                         sorted(ec2_ids))
+        for i in result:
+            self.assertEqual(i['placement']['availabilityZone'], 'zone1')
+            if i['instanceId'] == ec2_ids[0]:
+                self.assertEqual(i['blockDeviceMapping'][0]['ebs']['status'],
+                                 'in-use')
+            else:
+                self.assertFalse('blockDeviceMapping' in i)
+
+        db.volume_destroy(self.context, vol['id'])
+        for instance in instances:
+            db.instance_destroy(self.context, instance['id'])
+        db.service_destroy(self.context, comp['id'])
+
     def _block_device_mapping_create(self, instance_id, mappings):
         volumes = []
         for bdm in mappings:
@@ -19,10 +19,12 @@ Tests dealing with HTTP rate-limiting.
 
 import httplib
 import json
+import re
 import StringIO
 import unittest
 from xml.dom import minidom
 
+import eventlet
 from lxml import etree
 import stubout
 import webob
@@ -593,6 +595,51 @@ class LimiterTest(BaseLimitTestSuite):
         results = list(self._check(5, "PUT", "/anything", "user2"))
         self.assertEqual(expected, results)
 
+    def test_idle_users_expire(self):
+        """
+        Test that users whose buckets have drained are forgotten.
+        """
+        self.limiter.check_for_delay("PUT", "/anything", "user1")
+        self.assertTrue("user1" in self.limiter._buckets)
+
+        self.time += limits.PER_MINUTE
+        self.limiter.check_for_delay("PUT", "/anything", "user2")
+        self.assertFalse("user1" in self.limiter._buckets)
+        self.assertTrue("user2" in self.limiter._buckets)
+        self.assertEqual(self.limiter.get_limits("user1")[3]["remaining"], 10)
+
+
+class LimitDispatcherTest(BaseLimitTestSuite):
+    """
+    Tests for the `limits.LimitDispatcher` class.
+    """
+
+    def _check_matches(self, dispatcher, verb, url):
+        expected = [index for index, limit in enumerate(dispatcher.limits)
+                    if limit.verb == verb and re.match(limit.regex, url)]
+        self.assertEqual(dispatcher.match(verb, url), expected)
+        return expected
+
+    def test_match(self):
+        dispatcher = limits.LimitDispatcher(TEST_LIMITS)
+        self.assertEqual(self._check_matches(dispatcher, "PUT", "/servers/1"),
+                         [3, 4])
+        self.assertEqual(self._check_matches(dispatcher, "POST", "/images"),
+                         [1])
+        self.assertEqual(self._check_matches(dispatcher, "GET", "/delayed"),
+                         [0])
+        self.assertEqual(self._check_matches(dispatcher, "DELETE", "/"), [])
+
+    def test_match_backreference(self):
+        dispatcher = limits.LimitDispatcher([
+            limits.Limit("GET", "*", r"^/(\w+)/\1", 1, limits.PER_MINUTE),
+            limits.Limit("GET", "*", "^/a", 1, limits.PER_MINUTE),
+        ])
+        self.assertEqual(self._check_matches(dispatcher, "GET", "/a/a"),
+                         [0, 1])
+        self.assertEqual(self._check_matches(dispatcher, "GET", "/a/b"),
+                         [1])
+
 
 class WsgiLimiterTest(BaseLimitTestSuite):
     """
@@ -664,6 +711,25 @@ class WsgiLimiterTest(BaseLimitTestSuite):
         delay = self._request("GET", "/delayed", "user2")
         self.assertEqual(delay, '60.00')
 
+    def test_batch(self):
+        checks = [{"verb": "GET", "path": "/delayed", "username": "user1"},
+                  {"verb": "GET", "path": "/delayed", "username": "user1"},
+                  {"verb": "GET", "path": "/delayed", "username": "user2"}]
+        request = webob.Request.blank("/")
+        request.method = "POST"
+        request.body = json.dumps({"checks": checks})
+        response = request.get_response(self.app)
+
+        self.assertEqual(response.status_int, 200)
+        delays = json.loads(response.body)["delays"]
+        self.assertEqual(delays[0], [None, None])
+        self.assertEqual(delays[1][0], '60.00')
+        self.assertEqual(delays[2], [None, None])
+
+        # The batch counts against the same limits as single checks
+        delay = self._request("GET", "/delayed", "user2")
+        self.assertEqual(delay, '60.00')
+
 
 class FakeHttplibSocket(object):
     """
@@ -782,6 +848,37 @@ class WsgiLimiterProxyTest(BaseLimitTestSuite):
 
         self.assertEqual((delay, error), expected)
 
+    def test_check_for_delays(self):
+        delays = self.proxy.check_for_delays([("GET", "/delayed", "user1"),
+                                              ("GET", "/anything", "user1"),
+                                              ("GET", "/delayed", "user1")])
+        self.assertEqual(delays[0], (None, None))
+        self.assertEqual(delays[1], (None, None))
+        self.assertEqual(delays[2][0], "60.00")
+
+    def test_concurrent_checks_are_batched(self):
+        sent = []
+
+        def fake_check_one(verb, path, username=None):
+            sent.append([(verb, path, username)])
+            eventlet.sleep(0)
+            return None, None
+
+        def fake_check_for_delays(checks):
+            sent.append(checks)
+            return [(None, None)] * len(checks)
+
+        self.stubs.Set(self.proxy, '_check_one', fake_check_one)
+        self.stubs.Set(self.proxy, 'check_for_delays', fake_check_for_delays)
+
+        pool = eventlet.GreenPool()
+        for path in ("/a", "/b", "/c"):
+            pool.spawn(self.proxy.check_for_delay, "GET", path)
+        pool.waitall()
+
+        self.assertEqual(sent, [[("GET", "/a", None)],
+                                [("GET", "/b", None), ("GET", "/c", None)]])
+
 
 class LimitsViewBuilderTest(test.TestCase):
 
@@ -34,6 +34,7 @@ from nova.compute import vm_states
 import nova.db
 from nova.db.sqlalchemy.models import InstanceActions
 from nova.db.sqlalchemy.models import InstanceMetadata
+from nova import exception
 from nova import flags
 import nova.image.fake
 import nova.rpc
@@ -106,6 +107,16 @@ def return_servers(context, *args, **kwargs):
     for i in xrange(5):
         server = fakes.stub_instance(i, 'fake', 'fake', uuid=get_fake_uuid(i))
         servers.append(server)
+
+    marker = kwargs.get('marker')
+    if marker is not None:
+        uuids = [server['uuid'] for server in servers]
+        if marker not in uuids:
+            raise exception.MarkerNotFound(marker=marker)
+        servers = servers[uuids.index(marker) + 1:]
+    limit = kwargs.get('limit')
+    if limit is not None:
+        servers = servers[:limit]
     return servers
 
 
@@ -790,7 +801,7 @@ class ServersControllerTest(test.TestCase):
         self.assertEqual(servers[0]['id'], server_uuid)
 
     def test_tenant_id_filter_converts_to_project_id_for_admin(self):
-        def fake_get_all(context, filters=None, instances=None):
+        def fake_get_all(context, filters=None, instances=None, **kwargs):
             self.assertNotEqual(filters, None)
             self.assertEqual(filters['project_id'], 'fake')
             self.assertFalse(filters.get('tenant_id'))
@@ -41,3 +41,8 @@ FLAGS['sqlite_db'].SetDefault("tests.sqlite")
 FLAGS['use_ipv6'].SetDefault(True)
 FLAGS['flat_network_bridge'].SetDefault('br100')
 FLAGS['sqlite_synchronous'].SetDefault(False)
+flags.DECLARE('quota_cache_ttl', 'nova.quota')
+FLAGS['quota_cache_ttl'].SetDefault(0)
+FLAGS['glance_image_cache_ttl'].SetDefault(0)
+flags.DECLARE('auth_cache_ttl', 'nova.auth.manager')
+FLAGS['auth_cache_ttl'].SetDefault(0)
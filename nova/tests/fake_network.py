@@ -15,6 +15,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import re
+
 from nova import db
 from nova import exception
 from nova import flags
@@ -111,6 +113,30 @@ class FakeNetworkManager(network_manager.NetworkManager):
                                     'floating_ips': [floats[2]]}]}]
             return vifs
 
+        def fixed_ip_get_instance_ips_by_address(self, context, address,
+                                                 exact=True):
+            if exact:
+                matches = lambda ip: ip == address
+            else:
+                regex = re.escape(address).replace('_', '.')
+                regex = re.compile('^%s$' % regex.replace('\\%', '.*'))
+                matches = regex.match
+
+            results = []
+            for vif in self.virtual_interface_get_all(context):
+                for fixed_ip in vif['fixed_ips']:
+                    if matches(fixed_ip['address']):
+                        results.append({'instance_id': vif['instance_id'],
+                                        'address': fixed_ip['address'],
+                                        'floating': False})
+                    for floating_ip in fixed_ip['floating_ips']:
+                        if matches(floating_ip['address']):
+                            results.append(
+                                    {'instance_id': vif['instance_id'],
+                                     'address': floating_ip['address'],
+                                     'floating': True})
+            return results
+
         def instance_get_id_to_uuid_mapping(self, context, ids):
             # NOTE(jkoelker): This is just here until we can rely on UUIDs
             mapping = {}
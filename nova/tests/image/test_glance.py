@@ -537,6 +537,83 @@ class TestGlanceImageService(test.TestCase):
         self.flags(glance_num_retries=1)
         service.get(self.context, image_id, writer)
 
+    def test_show_caches_image_meta(self):
+        self.flags(glance_image_cache_ttl=30)
+        self.stubs.Set(glance, '_IMAGE_META_CACHE', glance._ImageMetaCache())
+        fixture = self._make_fixture(name='image1', is_public=True,
+                                     status='active')
+        image_id = self.service.create(self.context, fixture)['id']
+        self.service.show(self.context, image_id)
+
+        calls = []
+        get_image_meta = self.service._client.get_image_meta
+
+        def counting_get_image_meta(image_id):
+            calls.append(image_id)
+            return get_image_meta(image_id)
+
+        self.stubs.Set(self.service._client, 'get_image_meta',
+                       counting_get_image_meta)
+        image_meta = self.service.show(self.context, image_id)
+        self.assertEqual(image_meta['name'], 'image1')
+        self.assertEqual(calls, [])
+
+        self.service.update(self.context, image_id, {'name': 'image2'})
+        calls[:] = []
+        image_meta = self.service.show(self.context, image_id)
+        self.assertEqual(image_meta['name'], 'image2')
+        self.assertEqual(calls, [image_id])
+
+        # Images that are not active yet are always fetched again
+        fixture = self._make_fixture(name='image3', is_public=True,
+                                     status='saving')
+        image_id = self.service.create(self.context, fixture)['id']
+        calls[:] = []
+        self.service.show(self.context, image_id)
+        self.service.show(self.context, image_id)
+        self.assertEqual(calls, [image_id, image_id])
+
+    def test_pick_glance_api_server_avoids_failed_servers(self):
+        self.flags(glance_api_servers=['host1:9292', 'host2:9292'],
+                   glance_api_server_backoff=10)
+        self.stubs.Set(glance, '_SERVER_FAILURES', {})
+
+        glance._server_failed('host1', 9292)
+        for _i in xrange(10):
+            self.assertEqual(glance.pick_glance_api_server(),
+                             ('host2', 9292))
+
+        # With every server failing, the one failing longest is retried.
+        glance._server_failed('host2', 9292)
+        glance._server_failed('host2', 9292)
+        self.assertEqual(glance.pick_glance_api_server(), ('host1', 9292))
+
+        glance._server_ok('host2', 9292)
+        self.assertEqual(glance.pick_glance_api_server(), ('host2', 9292))
+
+    def test_glance_clients_are_reused(self):
+        self.stubs.Set(glance, '_CLIENTS', {})
+        self.stubs.Set(glance, '_create_glance_client',
+                       lambda context, host, port: object())
+        client1, _image_id = glance.get_glance_client(self.context, 1)
+        client2, _image_id = glance.get_glance_client(self.context, 2)
+        self.assertTrue(client1 is client2)
+
+        other_context = context.RequestContext('other', 'other',
+                                               auth_token='other')
+        client3, _image_id = glance.get_glance_client(other_context, 1)
+        self.assertFalse(client1 is client3)
+
+    def test_glance_client_cache_disabled(self):
+        self.flags(glance_client_cache_size=0)
+        self.stubs.Set(glance, '_CLIENTS', {})
+        self.stubs.Set(glance, '_create_glance_client',
+                       lambda context, host, port: object())
+        client1, _image_id = glance.get_glance_client(self.context, 1)
+        client2, _image_id = glance.get_glance_client(self.context, 2)
+        self.assertFalse(client1 is client2)
+        self.assertEqual(glance._CLIENTS, {})
+
     def test_glance_client_image_id(self):
         fixture = self._make_fixture(name='test image')
         image_id = self.service.create(self.context, fixture)['id']
@@ -22,6 +22,7 @@ Unit Tests for remote procedure calls using kombu
 from nova import context
 from nova import log as logging
 from nova import test
+from nova.rpc import common as rpc_common
 from nova.rpc import impl_kombu
 from nova.tests.rpc import common
 
@@ -82,6 +83,31 @@ class RpcKombuTestCase(common._BaseRpcTestCase):
 
         self.assertEqual(self.received_message, message)
 
+    def test_proxy_callback_records_stats(self):
+        self.flags(rpc_stats_reply_sample=1)
+        callback = impl_kombu.ProxyCallback(common.TestReceiver())
+        callback.stats = rpc_common.RpcStats()
+        ctxt = impl_kombu.RpcContext.from_dict(self.context.to_dict())
+        callback._process_data(ctxt, 'echo', {'value': 'abc'})
+        callback._process_data(ctxt, 'echo', {'value': 'abc'})
+
+        stats = callback.stats.to_dict()
+        echo_stats = stats['methods']['echo']
+        self.assertEqual(echo_stats['calls'], 2)
+        self.assertEqual(echo_stats['failures'], 0)
+        self.assertEqual(echo_stats['reply_bytes'], 2 * len('"abc"'))
+        self.assertEqual(sum(echo_stats['executing_histogram']), 2)
+        self.assertEqual(sum(echo_stats['queued_histogram']), 2)
+
+        callback.stats.report()
+        self.assertEqual(callback.stats.to_dict()['methods'], {})
+
+    def test_reply_size_is_sampled(self):
+        self.flags(rpc_stats_reply_sample=3)
+        stats = rpc_common.RpcStats()
+        sizes = [stats.reply_size('abc') for _i in xrange(6)]
+        self.assertEqual(sizes, [0, 0, 3 * len('"abc"')] * 2)
+
     @test.skip_test("kombu memory transport seems buggy with fanout queues "
             "as this test passes when you use rabbit (fake_rabbit=False)")
     def test_fanout_send_receive(self):
@@ -108,3 +134,109 @@ class RpcKombuTestCase(common._BaseRpcTestCase):
         conn2.consume(limit=1)
         conn2.close()
         self.assertEqual(self.received_message, message)
+
+
+class RpcKombuSingleReplyQueueTestCase(common._BaseRpcTestCase):
+    def setUp(self):
+        self.rpc = impl_kombu
+        self.flags(rabbit_single_reply_queue=True)
+        super(RpcKombuSingleReplyQueueTestCase, self).setUp()
+
+    def tearDown(self):
+        if impl_kombu._REPLY_PROXY is not None:
+            impl_kombu._REPLY_PROXY.close()
+            impl_kombu._REPLY_PROXY = None
+        super(RpcKombuSingleReplyQueueTestCase, self).tearDown()
+
+    def test_calls_share_reply_queue(self):
+        value = 42
+        self.rpc.call(self.context, 'test', {"method": "echo",
+                                             "args": {"value": value}})
+        reply_proxy = impl_kombu._REPLY_PROXY
+        self.assertNotEqual(reply_proxy, None)
+        result = self.rpc.call(self.context, 'test',
+                               {"method": "echo",
+                                "args": {"value": value}})
+        self.assertEqual(value, result)
+        self.assertTrue(reply_proxy is impl_kombu._REPLY_PROXY)
+        self.assertEqual(reply_proxy._waiters, {})
+
+    def test_abandoned_multicall_removes_waiter(self):
+        result = self.rpc.multicall(self.context, 'test',
+                                    {"method": "echo_three_times",
+                                     "args": {"value": 42}})
+        reply_proxy = impl_kombu._REPLY_PROXY
+        self.assertEqual(len(reply_proxy._waiters), 1)
+
+        results = iter(result)
+        self.assertEqual(results.next(), 42)
+        results.close()
+        self.assertEqual(reply_proxy._waiters, {})
+
+        result = self.rpc.multicall(self.context, 'test',
+                                    {"method": "echo",
+                                     "args": {"value": 42}})
+        self.assertEqual(len(reply_proxy._waiters), 1)
+        del result
+        self.assertEqual(reply_proxy._waiters, {})
+
+    def test_call_timeout(self):
+        self.flags(rpc_response_timeout=1)
+        self.assertRaises(rpc_common.Timeout, self.rpc.call, self.context,
+                          'no_such_topic', {"method": "echo",
+                                            "args": {"value": 42}})
+
+
+class RpcKombuCompactEnvelopeTestCase(common._BaseRpcTestCase):
+    def setUp(self):
+        self.rpc = impl_kombu
+        # Compress everything to exercise the zlib path as well.
+        self.flags(rpc_compact_envelope=True, rpc_compress_threshold=1)
+        super(RpcKombuCompactEnvelopeTestCase, self).setUp()
+
+    def test_pack_message_roundtrip(self):
+        msg = {'method': 'echo', 'args': {'value': 'x' * 100},
+               '_msg_id': 'abc'}
+        packed = self.rpc._pack_message(msg, self.context)
+        self.assertEqual(packed['_envelope'], impl_kombu.ENVELOPE_VERSION)
+        self.assertEqual(packed['_msg_id'], 'abc')
+        self.assertTrue('_body_zlib' in packed)
+        self.assertFalse('_context_user_id' in packed)
+
+        ctxt, body = self.rpc._unpack_message(packed)
+        self.assertEqual(body, {'method': 'echo',
+                                'args': {'value': 'x' * 100}})
+        self.assertEqual(ctxt.msg_id, 'abc')
+        self.assertEqual(ctxt.envelope, impl_kombu.ENVELOPE_VERSION)
+        self.assertEqual(ctxt.to_dict(), self.context.to_dict())
+
+    def test_unpack_legacy_message(self):
+        self.flags(rpc_compact_envelope=False)
+        msg = {'method': 'echo', 'args': {}, '_msg_id': 'abc'}
+        packed = self.rpc._pack_message(msg, self.context)
+        self.assertTrue('_context_user_id' in packed)
+        ctxt, body = self.rpc._unpack_message(packed)
+        self.assertEqual(body, {'method': 'echo', 'args': {}})
+        self.assertEqual(ctxt.envelope, None)
+
+    def test_unsupported_envelope_version(self):
+        msg = {'_envelope': impl_kombu.ENVELOPE_VERSION + 1,
+               '_context': {}, '_body': {}}
+        self.assertRaises(rpc_common.UnsupportedRpcEnvelopeVersion,
+                          self.rpc._unpack_message, msg)
+
+    def test_unsupported_envelope_version_replies_failure(self):
+        replies = []
+
+        def fake_msg_reply(msg_id, reply=None, failure=None, ending=False,
+                           reply_q=None, envelope=None):
+            replies.append((msg_id, failure[0], reply_q, envelope))
+
+        self.stubs.Set(impl_kombu, 'msg_reply', fake_msg_reply)
+        callback = impl_kombu.ProxyCallback(common.TestReceiver())
+        callback({'_envelope': impl_kombu.ENVELOPE_VERSION + 1,
+                  '_context': {}, '_body': {}, '_msg_id': 'abc',
+                  '_reply_q': 'reply_q'})
+        self.assertEqual(replies,
+                         [('abc', rpc_common.UnsupportedRpcEnvelopeVersion,
+                           'reply_q', None)])
@@ -33,6 +33,7 @@ from nova.tests.scheduler import fake_zone_manager as ds_fakes
 
 class FakeEmptyZoneManager(zone_manager.ZoneManager):
     def __init__(self):
+        super(FakeEmptyZoneManager, self).__init__()
         self.service_states = {}
 
     def get_host_list_from_db(self, context):
@@ -86,6 +87,15 @@ def fake_filter_hosts(topic, request_info, unfiltered_hosts, options):
             return unfiltered_hosts
 
 
+def fake_odd_cost_fn(host_info, options):
+    """Local hosts always get odd weights."""
+    return host_info.free_ram_mb + 1
+
+
+def fake_cost_functions(topic=None):
+    return [(1.0, fake_odd_cost_fn)]
+
+
 class DistributedSchedulerTestCase(test.TestCase):
     """Test case for Distributed Scheduler."""
 
@@ -212,19 +222,11 @@ class DistributedSchedulerTestCase(test.TestCase):
         """Make sure there's nothing glaringly wrong with _schedule()
         by doing a happy day pass through."""
 
-        self.next_weight = 1.0
-
-        def _fake_weighted_sum(functions, hosts, options):
-            self.next_weight += 2.0
-            host, hostinfo = hosts[0]
-            return least_cost.WeightedHost(self.next_weight, host=host,
-                                           hostinfo=hostinfo)
-
         sched = ds_fakes.FakeDistributedScheduler()
         fake_context = context.RequestContext('user', 'project')
         sched.zone_manager = ds_fakes.FakeZoneManager()
         self.stubs.Set(sched, '_filter_hosts', fake_filter_hosts)
-        self.stubs.Set(least_cost, 'weighted_sum', _fake_weighted_sum)
+        self.stubs.Set(sched, 'get_cost_functions', fake_cost_functions)
         self.stubs.Set(nova.db, 'zone_get_all', fake_zone_get_all)
         self.stubs.Set(sched, '_call_zone_method', fake_call_zone_method)
 
@@ -246,19 +248,11 @@ class DistributedSchedulerTestCase(test.TestCase):
         """Test to make sure _schedule makes no call out to zones if
         local_zone in the request spec is True."""
 
-        self.next_weight = 1.0
-
-        def _fake_weighted_sum(functions, hosts, options):
-            self.next_weight += 2.0
-            host, hostinfo = hosts[0]
-            return least_cost.WeightedHost(self.next_weight, host=host,
-                                           hostinfo=hostinfo)
-
         sched = ds_fakes.FakeDistributedScheduler()
         fake_context = context.RequestContext('user', 'project')
         sched.zone_manager = ds_fakes.FakeZoneManager()
         self.stubs.Set(sched, '_filter_hosts', fake_filter_hosts)
-        self.stubs.Set(least_cost, 'weighted_sum', _fake_weighted_sum)
+        self.stubs.Set(sched, 'get_cost_functions', fake_cost_functions)
         self.stubs.Set(nova.db, 'zone_get_all', fake_zone_get_all)
         self.stubs.Set(sched, '_call_zone_method', fake_call_zone_method)
 
@@ -273,6 +267,33 @@ class DistributedSchedulerTestCase(test.TestCase):
             self.assertTrue(weighted_host.host is not None)
             self.assertTrue(weighted_host.zone is None)
 
+    def test_schedule_refilters_only_consumed_host(self):
+        """Multiple instances are placed from a single filter pass,
+        re-checking just the host that was chosen each time."""
+        filtered = []
+
+        def _fake_filter_hosts(topic, request_info, hosts, options):
+            filtered.append(len(hosts))
+            return [(host, hostinfo) for host, hostinfo in hosts
+                    if hostinfo.free_ram_mb >= 512]
+
+        sched = ds_fakes.FakeDistributedScheduler()
+        fake_context = context.RequestContext('user', 'project')
+        sched.zone_manager = ds_fakes.FakeZoneManager()
+        self.stubs.Set(sched, '_filter_hosts', _fake_filter_hosts)
+        self.flags(reserved_host_disk_mb=0, reserved_host_memory_mb=0)
+
+        instance_type = dict(memory_mb=512, local_gb=512)
+        request_spec = dict(num_instances=4, instance_type=instance_type,
+                            local_zone=True)
+        weighted_hosts = sched._schedule(fake_context, 'compute',
+                                         request_spec)
+
+        # Fill first: host2 (1536 free) takes three, then host3.
+        self.assertEqual([wh.host for wh in weighted_hosts],
+                         ['host2', 'host2', 'host2', 'host3'])
+        self.assertEqual(filtered, [4, 1, 1, 1])
+
     def test_decrypt_blob(self):
         """Test that the decrypt method works."""
 
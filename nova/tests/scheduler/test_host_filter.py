@@ -251,3 +251,32 @@ class HostFilterTestCase(test.TestCase):
 
         self.assertFalse(hf.filter_hosts(all_hosts,
                 json.dumps(['=', {}, ['>', '$missing....foo']]), {}))
+
+    def test_json_filter_compare_either_order(self):
+        hf = nova.scheduler.filters.JsonFilter()
+        all_hosts = self._get_all_hosts()
+        hosts = hf.filter_hosts(all_hosts,
+                json.dumps(['<=', 30, '$compute.host_memory_free']), {})
+        just_hosts = sorted([host for host, caps in hosts])
+        self.assertEquals(['host3', 'host4'], just_hosts)
+
+        hosts = hf.filter_hosts(all_hosts,
+                json.dumps(['<', '$compute.host_memory_free', 30]), {})
+        just_hosts = sorted([host for host, caps in hosts])
+        self.assertEquals(['host1', 'host2'], just_hosts)
+
+        self.assertFalse(hf.filter_hosts(all_hosts,
+                json.dumps(['>=', '$foo.host_memory_free', 0]), {}))
+
+    def test_json_filter_reuses_compiled_query(self):
+        hf = nova.scheduler.filters.JsonFilter()
+        all_hosts = self._get_all_hosts()
+        cooked = hf.instance_type_to_filter(self.instance_type)
+        hf.filter_hosts(all_hosts, cooked, {})
+
+        def _fail_compile(query):
+            self.fail("Query compiled twice")
+
+        self.stubs.Set(hf, '_compile_filter', _fail_compile)
+        hosts = hf.filter_hosts(all_hosts, cooked, {})
+        self.assertEquals(2, len(hosts))
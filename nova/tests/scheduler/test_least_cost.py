@@ -80,3 +80,45 @@ class LeastCostTestCase(test.TestCase):
                                                                     options)
         self.assertEqual(weighted_host.weight, 10000)
         self.assertEqual(weighted_host.host, 'host1')
+
+    def test_weighted_sum_without_numpy(self):
+        self.stubs.Set(least_cost, 'numpy', None)
+        fn_tuples = [(1.0, offset), (1.0, scale)]
+        hostinfo_list = self.zone_manager.get_all_host_data(None).items()
+
+        weighted_host = least_cost.weighted_sum(fn_tuples, hostinfo_list, {})
+        self.assertEqual(weighted_host.weight, 10000)
+        self.assertEqual(weighted_host.host, 'host1')
+
+    def test_weighted_sum_breaks_ties_by_host(self):
+        fn_tuples = [(1.0, least_cost.noop_cost_fn)]
+        hostinfo_list = sorted(
+                self.zone_manager.get_all_host_data(None).items(),
+                reverse=True)
+
+        weighted_host = least_cost.weighted_sum(fn_tuples, hostinfo_list, {})
+        self.assertEqual(weighted_host.host, 'host1')
+
+        self.stubs.Set(least_cost, 'numpy', None)
+        weighted_host = least_cost.weighted_sum(fn_tuples, hostinfo_list, {})
+        self.assertEqual(weighted_host.host, 'host1')
+
+    def test_weighted_sum_uses_batch_form(self):
+        calls = []
+
+        def batched(host_infos, options):
+            calls.append(len(host_infos))
+            return [hostinfo.free_ram_mb * -1 for hostinfo in host_infos]
+
+        def single(hostinfo, options):
+            self.fail("Batched cost function called per host")
+
+        single.batch = batched
+        fn_tuples = [(2.0, single)]
+        hostinfo_list = self.zone_manager.get_all_host_data(None).items()
+
+        # host4 has the most free ram, so the lowest cost.
+        weighted_host = least_cost.weighted_sum(fn_tuples, hostinfo_list, {})
+        self.assertEqual(calls, [4])
+        self.assertEqual(weighted_host.weight, -16384)
+        self.assertEqual(weighted_host.host, 'host4')
@@ -20,6 +20,7 @@ from M2Crypto import X509
 import unittest
 
 from nova import crypto
+from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import test
@@ -93,6 +94,8 @@ class _AuthManagerBaseTestCase(test.TestCase):
                 connection_type='fake')
         self.manager = manager.AuthManager(new=True)
         self.manager.mc.cache = {}
+        manager._CREDENTIALS.clear()
+        manager._ROLES.clear()
 
     def test_create_and_find_user(self):
         with user_generator(self.manager):
@@ -371,6 +374,62 @@ class _AuthManagerBaseTestCase(test.TestCase):
             self.assertEqual('secret', user.secret)
             self.assertTrue(user.is_admin())
 
+    def test_authenticate_caches_credentials(self):
+        self.flags(auth_cache_ttl=60)
+        # captured sig and query string using boto 1.9b/euca2ools 1.2
+        sig = 'd67Wzd9Bwz8xid9QU+lzWXcF2Y3tRicYABPJgrqfrwM='
+        auth_params = {'AWSAccessKeyId': 'admin:admin',
+                       'Action': 'DescribeAvailabilityZones',
+                       'SignatureMethod': 'HmacSHA256',
+                       'SignatureVersion': '2',
+                       'Timestamp': '2011-04-22T11:29:29',
+                       'Version': '2009-11-30'}
+        with user_generator(self.manager, name='admin', secret='admin',
+                            access='admin'):
+            with project_generator(self.manager, name='admin',
+                                   manager_user='admin'):
+                lookups = []
+                real_lookup = self.manager.get_user_from_access_key
+
+                def fake_lookup(access_key):
+                    lookups.append(access_key)
+                    return real_lookup(access_key)
+
+                self.stubs.Set(self.manager, 'get_user_from_access_key',
+                               fake_lookup)
+                for _i in xrange(3):
+                    user, project = self.manager.authenticate(
+                            'admin:admin', sig, auth_params, 'GET',
+                            '127.0.0.1:8773', '/services/Cloud/')
+                    self.assertEqual('admin', user.id)
+                    self.assertEqual('admin', project.id)
+                self.assertEqual(['admin'], lookups)
+
+                self.assertRaises(exception.InvalidSignature,
+                                  self.manager.authenticate,
+                                  'admin:admin', 'bad', auth_params, 'GET',
+                                  '127.0.0.1:8773', '/services/Cloud/')
+
+                self.manager.modify_user('admin', secret_key='changed')
+                self.assertRaises(exception.InvalidSignature,
+                                  self.manager.authenticate,
+                                  'admin:admin', sig, auth_params, 'GET',
+                                  '127.0.0.1:8773', '/services/Cloud/')
+                self.assertEqual(['admin', 'admin'], lookups)
+
+    def test_role_changes_invalidate_cached_roles(self):
+        self.flags(auth_cache_ttl=60)
+        with user_and_project_generator(self.manager) as (user, project):
+            self.assertFalse('sysadmin' in
+                             self.manager.get_active_roles(user, project))
+            self.manager.add_role(user, 'sysadmin')
+            self.manager.add_role(user, 'sysadmin', project)
+            self.assertTrue('sysadmin' in
+                            self.manager.get_active_roles(user, project))
+            self.manager.remove_role(user, 'sysadmin', project)
+            self.assertFalse('sysadmin' in
+                             self.manager.get_active_roles(user, project))
+
 
 class AuthManagerLdapTestCase(_AuthManagerBaseTestCase):
     auth_driver = 'nova.auth.ldapdriver.FakeLdapDriver'
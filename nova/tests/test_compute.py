@@ -1088,6 +1088,69 @@ class ComputeTestCase(BaseTestCase):
 
         self.compute.terminate_instance(context, inst_ref['uuid'])
 
+    def test_resize_quota_follows_flavor(self):
+        """Ensure cores are reserved on resize and released on revert"""
+        context = self.context.elevated()
+        instance = self._create_fake_instance()
+        instance_uuid = instance['uuid']
+        casts = []
+
+        def fake(*args, **kwargs):
+            pass
+
+        def fake_cast(context, args):
+            casts.append(args['args'])
+
+        def fake_cast_compute(method, context, instance_uuid, host=None,
+                              params=None):
+            casts.append(params)
+
+        self.stubs.Set(self.compute.driver, 'finish_migration', fake)
+        self.stubs.Set(self.compute.driver, 'finish_revert_migration', fake)
+        self.stubs.Set(self.compute.network_api, 'get_instance_nw_info', fake)
+        self.stubs.Set(self.compute_api, '_cast_scheduler_message', fake_cast)
+        self.stubs.Set(self.compute_api, '_cast_compute_message',
+                       fake_cast_compute)
+
+        self.compute.run_instance(self.context, instance_uuid)
+        db.instance_update(self.context, instance_uuid, {'host': 'foo'})
+        inst_ref = db.instance_get_by_uuid(context, instance_uuid)
+        old_type = instance_types.get_instance_type_by_flavor_id(1)
+        new_type = instance_types.get_instance_type_by_flavor_id(3)
+        added = new_type['vcpus'] - old_type['vcpus']
+
+        def get_cores():
+            return db.quota_usage_get_all_by_project(context,
+                    self.project_id)['cores']
+
+        self.compute_api.resize(context, inst_ref, '3')
+        cores = get_cores()
+        self.assertEqual(cores['reserved'], added)
+        in_use = cores['in_use']
+
+        reservations = casts[-1]['reservations']
+        self.compute.prep_resize(context, instance_uuid, new_type['id'],
+                                 reservations=reservations)
+        migration_ref = db.migration_get_by_instance_and_status(context,
+                instance_uuid, 'pre-migrating')
+        self.compute.resize_instance(context, instance_uuid,
+                migration_ref['id'], reservations=reservations)
+        self.compute.finish_resize(context, instance_uuid,
+                int(migration_ref['id']), {}, reservations=reservations)
+        self.assertEqual(get_cores(),
+                         dict(in_use=in_use + added, reserved=0))
+
+        inst_ref = db.instance_get_by_uuid(context, instance_uuid)
+        self.compute_api.revert_resize(context, inst_ref)
+        reservations = casts[-1]['reservations']
+        self.compute.revert_resize(context, instance_uuid,
+                migration_ref['id'], reservations=reservations)
+        self.compute.finish_revert_resize(context, instance_uuid,
+                migration_ref['id'], reservations=reservations)
+        self.assertEqual(get_cores(), dict(in_use=in_use, reserved=0))
+
+        self.compute.terminate_instance(context, instance_uuid)
+
     def test_get_by_flavor_id(self):
         type = instance_types.get_instance_type_by_flavor_id(1)
         self.assertEqual(type['name'], 'm1.tiny')
@@ -1311,6 +1374,23 @@ class ComputeTestCase(BaseTestCase):
         self.assertEqual(len(instances), 1)
         self.assertEqual(power_state.NOSTATE, instances[0]['power_state'])
 
+    def test_sync_power_states_backs_off(self):
+        """Syncs that find nothing to change skip more and more ticks"""
+        self.flags(power_state_sync_max_backoff=2)
+        calls = []
+
+        def fake_get_power_states(context, host):
+            calls.append(host)
+            return []
+
+        self.stubs.Set(nova.db, 'instance_get_power_states_by_host',
+                       fake_get_power_states)
+        ctxt = context.get_admin_context()
+        for tick in xrange(7):
+            self.compute._sync_power_states(ctxt)
+        # Runs on ticks 0, 2 and 5: skipping 1 tick, then 2 (the max).
+        self.assertEqual(len(calls), 3)
+
     def test_add_instance_fault(self):
         instance_uuid = str(utils.gen_uuid())
 
@@ -23,6 +23,7 @@ import datetime
 from nova import test
 from nova import context
 from nova import db
+from nova import exception
 from nova import flags
 from nova import utils
 
@@ -149,6 +150,44 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(0, len(results))
         db.instance_update(ctxt, instance.id, {"task_state": None})
 
+    def test_instance_update_power_states(self):
+        ctxt = context.get_admin_context()
+        inst1 = db.instance_create(ctxt, {'host': 'host1', 'power_state': 1})
+        inst2 = db.instance_create(ctxt, {'host': 'host1', 'power_state': 1})
+        inst3 = db.instance_create(ctxt, {'host': 'host2', 'power_state': 1})
+
+        results = db.instance_get_power_states_by_host(ctxt, 'host1')
+        self.assertEqual(sorted([r['id'] for r in results]),
+                         sorted([inst1.id, inst2.id]))
+        self.assertEqual(results[0]['name'],
+                         db.instance_get(ctxt, results[0]['id'])['name'])
+
+        db.instance_update_power_states(ctxt, {0: [inst1.id],
+                                               4: [inst2.id, inst3.id]})
+        self.assertEqual(0, db.instance_get(ctxt, inst1.id)['power_state'])
+        self.assertEqual(4, db.instance_get(ctxt, inst2.id)['power_state'])
+        self.assertEqual(4, db.instance_get(ctxt, inst3.id)['power_state'])
+
+    def test_bw_usage_update_all(self):
+        ctxt = context.get_admin_context()
+        start_period = datetime.datetime(2012, 1, 1)
+        db.bw_usage_update(ctxt, 1, 'private', start_period, 10, 20)
+        db.bw_usage_update_all(ctxt, start_period, [
+                dict(instance_id=1, network_label='private',
+                     bw_in=100, bw_out=200),
+                dict(instance_id=1, network_label='public',
+                     bw_in=1, bw_out=2),
+                dict(instance_id=2, network_label='private',
+                     bw_in=3, bw_out=4)])
+
+        usages = dict((u['network_label'], (u['bw_in'], u['bw_out']))
+                      for u in db.bw_usage_get_by_instance(ctxt, 1,
+                                                           start_period))
+        self.assertEqual({'private': (100, 200), 'public': (1, 2)}, usages)
+        usages = db.bw_usage_get_by_instance(ctxt, 2, start_period)
+        self.assertEqual([(3, 4)], [(u['bw_in'], u['bw_out'])
+                                    for u in usages])
+
     def test_network_create_safe(self):
         ctxt = context.get_admin_context()
         values = {'host': 'localhost', 'project_id': 'project1'}
@@ -158,6 +197,96 @@ class DbApiTestCase(test.TestCase):
         db_network = db.network_get(ctxt, network.id)
         self.assertEqual(network.uuid, db_network.uuid)
 
+    def test_instance_get_all_by_filters_paginated(self):
+        ctxt = context.get_admin_context()
+        created_at = datetime.datetime(2012, 1, 1)
+        instances = [db.instance_create(ctxt, {'display_name': name,
+                                               'created_at': created_at})
+                     for name in ['a1', 'b1', 'a2', 'b2', 'a3']]
+        # Newest first, ties broken by id.
+        expected = [inst.uuid for inst in reversed(instances)]
+
+        page = db.instance_get_all_by_filters(ctxt, {}, limit=2)
+        self.assertEqual([inst.uuid for inst in page], expected[:2])
+        page = db.instance_get_all_by_filters(ctxt, {}, limit=2,
+                                              marker=page[-1].uuid)
+        self.assertEqual([inst.uuid for inst in page], expected[2:4])
+        page = db.instance_get_all_by_filters(ctxt, {}, sort_dir='asc',
+                                              marker=instances[2].uuid)
+        self.assertEqual([inst.uuid for inst in page],
+                         [inst.uuid for inst in instances[3:]])
+
+        # Filters done outside SQL still fill the page.
+        self.flags(instance_filter_chunk_size=1)
+        page = db.instance_get_all_by_filters(ctxt, {'display_name': 'a'},
+                                              limit=2)
+        self.assertEqual([inst.display_name for inst in page], ['a3', 'a2'])
+
+        self.assertRaises(exception.MarkerNotFound,
+                          db.instance_get_all_by_filters, ctxt, {},
+                          marker='does-not-exist')
+
+    def test_instance_get_all_load_profiles(self):
+        ctxt = context.get_admin_context()
+        db.instance_create(ctxt, {'host': 'host1'})
+
+        instance = db.instance_get_all_by_host(ctxt, 'host1')[0]
+        self.assertTrue('metadata' in instance.__dict__)
+        self.assertTrue('fixed_ips' in instance.__dict__)
+        instance = db.instance_get_all_by_host(ctxt, 'host1',
+                                               profile='network')[0]
+        self.assertFalse('metadata' in instance.__dict__)
+        self.assertTrue('fixed_ips' in instance.__dict__)
+        instance = db.instance_get_all_by_host(ctxt, 'host1',
+                                               profile='minimal')[0]
+        self.assertFalse('metadata' in instance.__dict__)
+        self.assertFalse('fixed_ips' in instance.__dict__)
+        self.assertEqual(instance['host'], 'host1')
+
+        self.assertRaises(exception.InvalidInput,
+                          db.instance_get_all, ctxt, profile='everything')
+
+    def test_full_profile_keeps_original_joins(self):
+        ctxt = context.get_admin_context()
+        instance = db.instance_create(ctxt, {'host': 'host1'})
+        _setup_networking(instance['id'])
+
+        instance = db.instance_get_all_by_host(ctxt, 'host1')[0]
+        fixed_ip = instance['fixed_ips'][0]
+        self.assertTrue('network' in fixed_ip.__dict__)
+        self.assertFalse('virtual_interface' in fixed_ip.__dict__)
+        instance = db.instance_get_all_by_filters(ctxt, {'host': 'host1'})[0]
+        fixed_ip = instance['fixed_ips'][0]
+        self.assertTrue('virtual_interface' in fixed_ip.__dict__)
+
+    def test_fixed_ip_associate_pool(self):
+        ctxt = context.get_admin_context()
+        network = db.network_create_safe(ctxt, {'host': 'localhost'})
+        addresses = ['10.1.0.%d' % i for i in xrange(2, 6)]
+        db.fixed_ip_bulk_create(ctxt, [{'address': address,
+                                         'network_id': network.id}
+                                        for address in addresses])
+        instance = db.instance_create(ctxt, {})
+
+        first = db.fixed_ip_associate_pool(ctxt, network.id, instance.id)
+        self.assertEqual(first, addresses[0])
+        fixed_ip = db.fixed_ip_get_by_address(ctxt, first)
+        self.assertEqual(fixed_ip.instance_id, instance.id)
+
+        # An ip taken behind the allocator's back is skipped.
+        db.fixed_ip_update(ctxt, addresses[1], {'host': 'other'})
+        second = db.fixed_ip_associate_pool(ctxt, network.id, host='foo')
+        self.assertEqual(second, addresses[2])
+        self.assertEqual(db.fixed_ip_get_by_address(ctxt, second).host, 'foo')
+
+        self.assertRaises(exception.InvalidInput,
+                          db.fixed_ip_associate_pool, ctxt, network.id)
+
+        db.fixed_ip_associate_pool(ctxt, network.id, host='foo')
+        self.assertRaises(exception.NoMoreFixedIps,
+                          db.fixed_ip_associate_pool, ctxt, network.id,
+                          host='foo')
+
     def test_instance_update_with_instance_id(self):
         """ test instance_update() works when an instance id is passed """
         ctxt = context.get_admin_context()
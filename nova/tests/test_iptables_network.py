@@ -162,3 +162,53 @@ class IptablesManagerTestCase(test.TestCase):
             self.assertTrue('-A %s -j runner.py-%s' \
                             % (chain, chain) in new_lines,
                             "Built-in chain %s not wrapped" % (chain,))
+
+    def _fake_execute(self, *cmd, **kwargs):
+        self.executed.append(cmd[0])
+        if cmd == ('iptables-save', '-t', 'filter'):
+            return '\n'.join(self.sample_filter), None
+        if cmd == ('iptables-save', '-t', 'nat'):
+            return '\n'.join(self.sample_nat), None
+        return '', ''
+
+    def test_apply_skips_unchanged_tables(self):
+        self.flags(use_ipv6=False, iptables_resync_interval=300)
+        self.executed = []
+        self.manager.execute = self._fake_execute
+
+        self.manager.apply()
+        self.assertEqual(self.executed.count('iptables-restore'), 2)
+
+        self.executed = []
+        self.manager.apply()
+        self.assertEqual(self.executed, [])
+
+        self.manager.ipv4['filter'].add_rule('FORWARD', '-s 1.2.3.4/5 -j DROP')
+        self.manager.apply()
+        self.assertEqual(self.executed, ['iptables-save', 'iptables-restore'])
+
+        self.executed = []
+        self.manager.apply(force=True)
+        self.assertEqual(self.executed.count('iptables-restore'), 2)
+
+    def test_apply_resyncs_after_interval(self):
+        self.flags(use_ipv6=False, iptables_resync_interval=0)
+        self.executed = []
+        self.manager.execute = self._fake_execute
+
+        self.manager.apply()
+        self.manager.apply()
+        self.assertEqual(self.executed.count('iptables-restore'), 4)
+
+    def test_apply_coalesces_waiting_requests(self):
+        self.flags(use_ipv6=False)
+        self.executed = []
+        self.manager.execute = self._fake_execute
+
+        # A request already covered by a completed apply does no work.
+        self.manager._apply_requested += 1
+        self.manager._apply(self.manager._apply_requested, False)
+        self.executed = []
+        self.manager.ipv4['filter'].add_rule('FORWARD', '-s 1.2.3.4/5 -j DROP')
+        self.manager._apply(self.manager._apply_requested, False)
+        self.assertEqual(self.executed, [])
@@ -20,8 +20,10 @@ import mox
 import os
 import re
 import shutil
+import struct
 import sys
 import tempfile
+import time
 
 from xml.etree.ElementTree import fromstring as xml_to_tree
 from xml.dom.minidom import parseString as xml_to_dom
@@ -41,6 +43,7 @@ from nova.virt import images
 from nova.virt import driver
 from nova.virt.libvirt import connection
 from nova.virt.libvirt import firewall
+from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import volume
 from nova.volume import driver as volume_driver
 from nova.virt.libvirt import utils as libvirt_utils
@@ -1750,9 +1753,12 @@ class LibvirtUtilsTestCase(test.TestCase):
         libvirt_utils.create_image('qcow2', '/some/stuff', '1234567891234')
 
     def test_create_cow_image(self):
+        self.mox.StubOutWithMock(images, 'detect_format')
         self.mox.StubOutWithMock(utils, 'execute')
+        images.detect_format('/some/path').AndReturn('raw')
         utils.execute('qemu-img', 'create', '-f', 'qcow2',
-                      '-o', 'cluster_size=2M,backing_file=/some/path',
+                      '-o', 'cluster_size=2M,backing_file=/some/path,'
+                            'backing_fmt=raw',
                       '/the/new/cow')
         # Start test
         self.mox.ReplayAll()
@@ -1916,3 +1922,94 @@ disk size: 4.4M''', ''))
                                   user_id, project_id)
         libvirt_utils.fetch_image(context, target, image_id,
                                   user_id, project_id, size='10G')
+
+
+class ImageCacheManagerTestCase(test.TestCase):
+    def setUp(self):
+        super(ImageCacheManagerTestCase, self).setUp()
+        self.instances_path = tempfile.mkdtemp()
+        self.flags(instances_path=self.instances_path,
+                   image_cache_max_age=100,
+                   image_cache_min_age=10,
+                   image_cache_max_size_gb=0,
+                   image_cache_prefetch_images=[])
+        os.mkdir(imagecache.get_base_dir())
+        self.manager = imagecache.ImageCacheManager()
+
+    def tearDown(self):
+        shutil.rmtree(self.instances_path)
+        super(ImageCacheManagerTestCase, self).tearDown()
+
+    def _make_base_image(self, name, age):
+        path = os.path.join(imagecache.get_base_dir(), name)
+        with open(path, 'w') as f:
+            f.write('image')
+        last_used = time.time() - age
+        os.utime(path, (last_used, last_used))
+        return path
+
+    def _make_instance_disk(self, instance, disk, backing_file):
+        instance_dir = os.path.join(self.instances_path, instance)
+        if not os.path.exists(instance_dir):
+            os.mkdir(instance_dir)
+        offset = 72
+        header = struct.pack('>4sIQI', 'QFI\xfb', 2, offset,
+                             len(backing_file))
+        with open(os.path.join(instance_dir, disk), 'wb') as f:
+            f.write(header.ljust(offset, '\0'))
+            f.write(backing_file)
+
+    def test_get_backing_file(self):
+        base = self._make_base_image('abc', 0)
+        self._make_instance_disk('instance-00000001', 'disk', base)
+        disk = os.path.join(self.instances_path, 'instance-00000001', 'disk')
+        self.assertEqual(imagecache.get_backing_file(disk), 'abc')
+        self.assertEqual(imagecache.get_backing_file(base), None)
+
+    def test_referenced_base_images(self):
+        base = self._make_base_image('abc', 0)
+        self._make_instance_disk('instance-00000001', 'disk', base)
+        self._make_instance_disk('instance-00000001', 'disk.local', 'eph')
+        self._make_instance_disk('instance-00000002', 'disk', base)
+        self.assertEqual(self.manager.referenced_base_images(),
+                         {'abc': 2, 'eph': 1})
+
+    def test_evict_unused_old_images(self):
+        in_use = self._make_base_image('in_use', 1000)
+        self._make_base_image('old', 1000)
+        self._make_base_image('recent', 50)
+        self._make_base_image('old.part', 1000)
+        pinned = imagecache.root_image_name('pinned')
+        self._make_base_image(pinned, 1000)
+        self.flags(image_cache_prefetch_images=['pinned'])
+        self._make_instance_disk('instance-00000001', 'disk', in_use)
+
+        self.assertEqual(self.manager.evict(), ['old'])
+        self.assertEqual(sorted(self.manager.list_base_images()),
+                         sorted(['in_use', 'recent', pinned]))
+
+    def test_evict_least_recently_used_over_size(self):
+        gb = 1024 * 1024 * 1024
+        images = {'a': (time.time() - 30, gb),
+                  'b': (time.time() - 20, gb),
+                  'c': (time.time() - 5, gb),
+                  'd': (time.time() - 40, gb)}
+        removed = []
+
+        def fake_remove(name, min_age):
+            removed.append(name)
+            return True
+
+        self.flags(image_cache_max_age=0, image_cache_max_size_gb=2)
+        self.stubs.Set(self.manager, 'list_base_images', lambda: images)
+        self.stubs.Set(self.manager, 'referenced_base_images',
+                       lambda: {'d': 1})
+        self.stubs.Set(self.manager, '_remove_base_image', fake_remove)
+
+        self.assertEqual(self.manager.evict(), ['a', 'b'])
+        self.assertEqual(removed, ['a', 'b'])
+
+    def test_missing_prefetch_images(self):
+        self._make_base_image(imagecache.root_image_name('cached'), 0)
+        self.flags(image_cache_prefetch_images=['cached', 'missing'])
+        self.assertEqual(self.manager.missing_prefetch_images(), ['missing'])
@@ -0,0 +1,91 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tests for the periodic task scheduler in nova.manager
+"""
+
+import eventlet
+
+from nova import context
+from nova import manager
+from nova import test
+from nova import utils
+
+
+class FakePeriodicManager(manager.Manager):
+    def __init__(self, *args, **kwargs):
+        self.calls = []
+        super(FakePeriodicManager, self).__init__(*args, **kwargs)
+
+    @manager.periodic_task
+    def _every_tick(self, context):
+        self.calls.append('every_tick')
+
+    @manager.periodic_task(spacing=60)
+    def _spaced(self, context):
+        self.calls.append('spaced')
+
+    @manager.periodic_task(timeout=0.01)
+    def _stalls(self, context):
+        self.calls.append('stalls')
+        eventlet.sleep(1)
+
+
+class PeriodicTaskTestCase(test.TestCase):
+    def setUp(self):
+        super(PeriodicTaskTestCase, self).setUp()
+        self.flags(periodic_task_jitter=0)
+        self.context = context.get_admin_context()
+        self.manager = FakePeriodicManager()
+        utils.set_time_override()
+
+    def tearDown(self):
+        utils.clear_time_override()
+        super(PeriodicTaskTestCase, self).tearDown()
+
+    def test_spacing_in_seconds(self):
+        self.manager.periodic_tasks(self.context)
+        self.manager.periodic_tasks(self.context)
+        utils.advance_time_seconds(61)
+        self.manager.periodic_tasks(self.context)
+        self.assertEqual(self.manager.calls.count('every_tick'), 3)
+        self.assertEqual(self.manager.calls.count('spaced'), 2)
+
+    def test_timeout_and_stats(self):
+        self.manager.periodic_tasks(self.context)
+        stats = self.manager.periodic_task_stats()
+        self.assertEqual(stats['_stalls']['runs'], 1)
+        self.assertEqual(stats['_stalls']['timeouts'], 1)
+        self.assertTrue(stats['_stalls']['max_duration'] < 1)
+        self.assertEqual(stats['_every_tick']['runs'], 1)
+        self.assertEqual(stats['_every_tick']['failures'], 0)
+
+    def test_timeout_raises_on_error(self):
+        self.assertRaises(eventlet.Timeout, self.manager.periodic_tasks,
+                          self.context, raise_on_error=True)
+
+    def test_concurrent_does_not_restart_running_task(self):
+        self.flags(periodic_tasks_concurrent=True, periodic_task_timeout=0)
+        self.stubs.Set(FakePeriodicManager._stalls.im_func,
+                       '_periodic_timeout', 0)
+        self.manager.periodic_tasks(self.context)
+        eventlet.sleep(0)
+        self.manager.periodic_tasks(self.context)
+        eventlet.sleep(0)
+        self.assertEqual(self.manager.calls.count('every_tick'), 2)
+        self.assertEqual(self.manager.calls.count('stalls'), 1)
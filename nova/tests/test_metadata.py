@@ -19,8 +19,10 @@
 """Tests for the testing the metadata code."""
 
 import base64
+import time
 import webob
 
+from nova.api.metadata import cache
 from nova.api.metadata import handler
 from nova.db.sqlalchemy import api
 from nova import db
@@ -189,3 +191,87 @@ class MetadataTestCase(test.TestCase):
         self.assertEqual(self.app._format_instance_mapping(ctxt,
                                                            instance_ref1),
                          expected)
+
+    def test_metadata_is_cached(self):
+        now = [1000.0]
+        self.stubs.Set(time, 'time', lambda: now[0])
+        self.app.cache = cache.MetadataCache(ttl=60)
+        calls = []
+        real_get_metadata = self.app.get_metadata
+
+        def counting_get_metadata(address):
+            calls.append(address)
+            return real_get_metadata(address)
+
+        self.stubs.Set(self.app, 'get_metadata', counting_get_metadata)
+        self.assertEqual(self.request('/meta-data/local-hostname'),
+            "%s.%s" % (self.instance['hostname'], FLAGS.dhcp_domain))
+        self.assertEqual(self.request('/'), 'meta-data/\nuser-data')
+        self.assertEqual(len(calls), 1)
+
+        now[0] += 61
+        self.request('/')
+        self.assertEqual(len(calls), 2)
+
+        self.app.cache.invalidate('127.0.0.1')
+        self.request('/')
+        self.assertEqual(len(calls), 3)
+
+    def test_metadata_cache_follows_ip_reassignment(self):
+        self.app.cache = cache.MetadataCache(ttl=60)
+        owner = [1]
+
+        def fake_instance_ips(context, address, exact=True):
+            return [{'instance_id': owner[0], 'address': address,
+                     'floating': False}]
+
+        self.stubs.Set(api, 'fixed_ip_get_instance_ips_by_address',
+                       fake_instance_ips)
+        self.instance['user_data'] = base64.b64encode('first tenant')
+        self.assertEqual(self.request('/user-data'), 'first tenant')
+
+        # The ip goes to another instance well within the ttl.
+        owner[0] = 2
+        self.instance = dict(self.instance, id=2,
+                             user_data=base64.b64encode('second tenant'))
+        self.assertEqual(self.request('/user-data'), 'second tenant')
+
+    def test_metadata_cache_disabled(self):
+        self.app.cache = cache.MetadataCache(ttl=0)
+        self.request('/')
+        self.assertEqual(len(self.app.cache), 0)
+
+    def test_metadata_cache_lru_and_expiry(self):
+        now = [1000.0]
+        self.stubs.Set(time, 'time', lambda: now[0])
+        metadata_cache = cache.MetadataCache(ttl=60, size=2)
+        metadata_cache.set('10.0.0.1', 'a')
+        metadata_cache.set('10.0.0.2', 'b')
+        metadata_cache.get('10.0.0.1')
+        metadata_cache.set('10.0.0.3', 'c')
+        self.assertEqual(metadata_cache.get('10.0.0.1'), 'a')
+        self.assertEqual(metadata_cache.get('10.0.0.2'), None)
+        self.assertEqual(metadata_cache.get('10.0.0.3'), 'c')
+
+        now[0] += 59
+        self.assertEqual(metadata_cache.get('10.0.0.1'), 'a')
+        now[0] += 2
+        self.assertEqual(metadata_cache.get('10.0.0.1'), None)
+        self.assertEqual(len(metadata_cache), 1)
+
+    def test_rendered_lookup_matches_lookup(self):
+        data = {'meta-data': {'public-keys': {'0': {'_name': 'key',
+                                                    'openssh-key': 'ssh'}},
+                              'security-groups': ['default', 'other'],
+                              'hostname': 'test'},
+                'user-data': 'happy'}
+        rendered = self.app.render_data(data)
+        for path in ['/', '/user-data', '/user-data/extra', '/meta-data/',
+                     '/meta-data/public-keys', '/meta-data/public-keys/0',
+                     '/meta-data/public-keys/0/openssh-key',
+                     '/meta-data/security-groups', '/meta-data/missing']:
+            expected = self.app.lookup(path, data)
+            if expected is not None:
+                expected = self.app.print_data(expected)
+            self.assertEqual(self.app.lookup_rendered(path, rendered),
+                             expected)
@@ -1081,6 +1081,31 @@ class CommonNetworkTestCase(test.TestCase):
         self.assertEqual(len(res), 1)
         self.assertEqual(res[0]['instance_id'], _vifs[2]['instance_id'])
 
+    def test_get_instance_uuids_by_ip_uses_index_for_literals(self):
+        manager = fake_network.FakeNetworkManager()
+        fake_context = context.RequestContext('user', 'project')
+
+        def no_regex(*args, **kwargs):
+            self.fail('literal ip filter should not scan every vif')
+
+        self.stubs.Set(manager, '_get_instance_ips_by_regex', no_regex)
+
+        ip = '^172\\.16\\.1\\.2$'
+        res = manager.get_instance_uuids_by_ip_filter(fake_context,
+                                                      {'ip': ip})
+        self.assertEqual(len(res), 1)
+        self.assertEqual(res[0]['instance_id'], 20)
+        self.assertEqual(res[0]['ip'], '172.16.1.2')
+
+    def test_ip_filter_to_like(self):
+        self.assertEqual(network_manager._ip_filter_to_like('10.0.0.1'),
+                         ('10_0_0_1%', False))
+        self.assertEqual(network_manager._ip_filter_to_like(
+                                '^10\\.0\\.0\\.1$'), ('10.0.0.1', True))
+        self.assertEqual(network_manager._ip_filter_to_like('10.0.0.*'), None)
+        self.assertEqual(network_manager._ip_filter_to_like('fe80::1$'),
+                         ('fe80::1', True))
+
 
 class TestRPCFixedManager(network_manager.RPCAllocateFixedIP,
         network_manager.NetworkManager):
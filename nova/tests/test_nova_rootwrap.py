@@ -14,7 +14,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
+import os
+import shutil
+import socket
+import tempfile
+
 from nova.rootwrap.filters import CommandFilter, RegExpFilter, DnsmasqFilter
+from nova.rootwrap import daemon
 from nova.rootwrap.wrapper import match_filter
 from nova import test
 
@@ -63,3 +70,63 @@ class RootwrapTestCase(test.TestCase):
         usercmd = ["cat", "/"]
         filtermatch = match_filter(self.filters, usercmd)
         self.assertTrue(filtermatch is self.filters[-1])
+
+    def test_daemon_runs_allowed_command(self):
+        returncode, stdout, stderr = daemon.run_command(
+                self.filters, ['cat'], 'some\x00input')
+        self.assertEqual(0, returncode)
+        self.assertEqual('some\x00input', stdout)
+
+    def test_daemon_rejects_unauthorized_command(self):
+        returncode, stdout, stderr = daemon.run_command(
+                self.filters, ['ls', 'root'])
+        self.assertEqual(daemon.RC_UNAUTHORIZED, returncode)
+        returncode, stdout, stderr = daemon.run_command(self.filters, [])
+        self.assertEqual(daemon.RC_NOCOMMAND, returncode)
+
+    def test_daemon_split_env(self):
+        env, command = daemon._split_env(['FLAGFILE=A', '/usr/bin/dnsmasq',
+                                          'foo=bar'])
+        self.assertEqual('A', env['FLAGFILE'])
+        self.assertEqual(['/usr/bin/dnsmasq', 'foo=bar'], command)
+
+    def test_daemon_handles_request(self):
+        server = daemon.Daemon(self.filters)
+        client, conn = socket.socketpair()
+        try:
+            client.sendall(json.dumps({'cmd': ['ls', 'root'],
+                                       'stdin': None}))
+            client.shutdown(socket.SHUT_WR)
+            server.handle(conn)
+            response = json.loads(daemon._recv_all(client))
+        finally:
+            client.close()
+        self.assertEqual(daemon.RC_UNAUTHORIZED, response['returncode'])
+
+    def test_daemon_refuses_writable_socket_dir(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.chmod(tmpdir, 0777)
+            server = daemon.Daemon(self.filters, socket_dir=tmpdir)
+            self.assertRaises(daemon.UnsafeSocketDir, server.bind)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_daemon_only_replaces_sockets(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.chmod(tmpdir, 0755)
+            server = daemon.Daemon(self.filters, socket_dir=tmpdir)
+            os.symlink('/etc/passwd', server.socket_path)
+            self.assertRaises(socket.error, server.bind)
+            self.assertTrue(os.path.islink(server.socket_path))
+            os.unlink(server.socket_path)
+
+            server.bind()
+            server.sock.close()
+            self.assertTrue(daemon.stat.S_ISSOCK(
+                    os.lstat(server.socket_path).st_mode))
+            self.assertEqual(0600, os.lstat(server.socket_path).st_mode &
+                                   0777)
+        finally:
+            shutil.rmtree(tmpdir)
@@ -26,6 +26,10 @@ from nova import rpc
 from nova import test
 from nova import volume
 from nova.compute import instance_types
+from nova.compute import utils as compute_utils
+from nova.compute import vm_states
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import session as db_session
 from nova.scheduler import driver as scheduler_driver
 
 
@@ -401,3 +405,117 @@ class QuotaTestCase(test.TestCase):
         files = [(path, 'config = quotatest')]
         self.assertRaises(exception.QuotaError,
                           self._create_with_injected_files, files)
+
+    def _get_usage(self, resource):
+        usages = db.quota_usage_get_all_by_project(self.context,
+                                                   self.project_id)
+        return usages[resource]
+
+    def test_reserve_commit_and_rollback(self):
+        self._create_instance(cores=1)
+        reservations = quota.reserve(self.context, instances=1, cores=1)
+        self.assertEqual(self._get_usage('instances'),
+                         dict(in_use=1, reserved=1))
+        self.assertEqual(self._get_usage('cores'),
+                         dict(in_use=1, reserved=1))
+        # The reservation counts against the quota until it is finished
+        self.assertRaises(exception.OverQuota, quota.reserve,
+                          self.context, instances=1)
+        self.assertEqual(quota.allowed_instances(self.context, 2,
+                self._get_instance_type('m1.tiny')), 0)
+
+        quota.commit(self.context, reservations)
+        self.assertEqual(self._get_usage('instances'),
+                         dict(in_use=2, reserved=0))
+
+        reservations = quota.reserve(self.context, instances=-1, cores=-1)
+        quota.rollback(self.context, reservations)
+        self.assertEqual(self._get_usage('instances'),
+                         dict(in_use=2, reserved=0))
+        reservations = quota.reserve(self.context, instances=-1, cores=-1)
+        quota.commit(self.context, reservations)
+        self.assertEqual(self._get_usage('instances'),
+                         dict(in_use=1, reserved=0))
+        self.assertEqual(self._get_usage('cores'),
+                         dict(in_use=1, reserved=0))
+
+    def test_first_reservations_race_for_usage_rows(self):
+        real_create = sqlalchemy_api._quota_usage_create
+        raced = []
+
+        def racing_create(context, project_id, resource, until_refresh,
+                          session):
+            if not raced:
+                # Another reservation creates the row first
+                raced.append(resource)
+                real_create(context, project_id, resource, until_refresh,
+                            db_session.get_session())
+            return real_create(context, project_id, resource,
+                               until_refresh, session)
+
+        self.stubs.Set(sqlalchemy_api, '_quota_usage_create', racing_create)
+        quota.reserve(self.context, volumes=1, gigabytes=10)
+        self.assertEqual(len(raced), 1)
+        self.assertEqual(self._get_usage('volumes'),
+                         dict(in_use=0, reserved=1))
+        self.assertEqual(self._get_usage('gigabytes'),
+                         dict(in_use=0, reserved=10))
+
+    def test_expire_reservations(self):
+        self.flags(quota_reservation_expire=-1)
+        quota.reserve(self.context, volumes=1, gigabytes=10)
+        self.assertEqual(self._get_usage('volumes'),
+                         dict(in_use=0, reserved=1))
+        quota.expire_reservations(self.context)
+        self.assertEqual(self._get_usage('volumes'),
+                         dict(in_use=0, reserved=0))
+
+    def test_usage_follows_create_and_delete(self):
+        compute_api = compute.API()
+        inst_type = instance_types.get_instance_type_by_name('m1.small')
+        image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
+        instances, reservation_id = compute_api.create(self.context,
+                instance_type=inst_type, image_href=image_uuid)
+        self.assertEqual(self._get_usage('instances'),
+                         dict(in_use=1, reserved=0))
+        instance = db.instance_update(self.context, instances[0]['id'],
+                                      {'vm_state': vm_states.ACTIVE})
+        compute_api.delete(self.context, instance)
+        self.assertEqual(self._get_usage('instances'),
+                         dict(in_use=0, reserved=0))
+
+        # Destroying the deleted record again releases nothing more
+        instance = db.instance_get(self.context.elevated(read_deleted='yes'),
+                                   instance['id'])
+        compute_utils.destroy_instance_record(self.context, instance)
+        self.assertEqual(self._get_usage('instances'),
+                         dict(in_use=0, reserved=0))
+
+    def test_usage_counts_only_scheduled_instances(self):
+        compute_api = compute.API()
+        inst_type = instance_types.get_instance_type_by_name('m1.tiny')
+        image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
+        # The stubbed scheduler creates one instance however many are asked
+        instances, reservation_id = compute_api.create(self.context,
+                instance_type=inst_type, image_href=image_uuid,
+                min_count=1, max_count=2)
+        self.assertEqual(len(instances), 1)
+        self.assertEqual(self._get_usage('instances'),
+                         dict(in_use=1, reserved=0))
+        self.assertEqual(self._get_usage('cores'),
+                         dict(in_use=inst_type['vcpus'], reserved=0))
+
+    def test_quotas_are_cached(self):
+        self.flags(quota_cache_ttl=60)
+        try:
+            items = quota.allowed_metadata_items(self.context, 100)
+            self.assertEqual(items, FLAGS.quota_metadata_items)
+            db.quota_create(self.context, self.project_id,
+                            'metadata_items', 5)
+            items = quota.allowed_metadata_items(self.context, 100)
+            self.assertEqual(items, FLAGS.quota_metadata_items)
+            quota.invalidate_quotas(self.project_id)
+            items = quota.allowed_metadata_items(self.context, 100)
+            self.assertEqual(items, 5)
+        finally:
+            quota.invalidate_quotas()
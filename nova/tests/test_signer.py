@@ -67,6 +67,16 @@ class SignerTestCase(test.TestCase):
                                            'SignatureMethod': 'HmacSHA1'},
                                            'GET', 'server', '/foo'))
 
+    def test_generate_is_repeatable(self):
+        for params in ({'SignatureVersion': '0', 'Action': 'Foo',
+                        'Timestamp': '2011-04-22T11:29:29'},
+                       {'SignatureVersion': '1', 'Action': 'Foo'},
+                       {'SignatureVersion': '2',
+                        'SignatureMethod': 'HmacSHA256'}):
+            first = self.signer.generate(params, 'GET', 'server', '/foo')
+            second = self.signer.generate(params, 'GET', 'server', '/foo')
+            self.assertEquals(first, second)
+
     def test_generate_invalid_signature_method_defined(self):
         self.assertRaises(exception.Error,
                           self.signer.generate,
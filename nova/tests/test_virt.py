@@ -15,9 +15,22 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+
+import eventlet
+
+from nova import context
+from nova import exception
 from nova import flags
+import nova.image
 from nova import test
+from nova import utils
 from nova.virt import driver
+from nova.virt import images
 
 FLAGS = flags.FLAGS
 
@@ -81,3 +94,123 @@ class TestVirtDriver(test.TestCase):
                                                 'swap_size': 0}))
         self.assertTrue(driver.swap_is_usable({'device_name': '/dev/sdb',
                                                 'swap_size': 1}))
+
+
+class FakeImageService(object):
+    def __init__(self, chunks, metadata=None):
+        self.chunks = chunks
+        self.metadata = metadata or {}
+        self.calls = 0
+        self.event = None
+
+    def get(self, context, image_id, data):
+        self.calls += 1
+        if self.event:
+            self.event.wait()
+        for chunk in self.chunks:
+            data.write(chunk)
+        return self.metadata
+
+
+class TestImages(test.TestCase):
+    def setUp(self):
+        super(TestImages, self).setUp()
+        self.context = context.get_admin_context()
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'image')
+        self.executed = []
+
+        def fake_execute(*cmd, **kwargs):
+            self.executed.append(cmd)
+            return '', ''
+
+        self.stubs.Set(utils, 'execute', fake_execute)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        super(TestImages, self).tearDown()
+
+    def _set_image(self, chunks, **metadata):
+        self.image_service = FakeImageService(chunks, metadata)
+        self.stubs.Set(nova.image, 'get_image_service',
+                       lambda context, href: (self.image_service, href))
+
+    def test_fetch_to_raw_of_raw_image_runs_no_qemu_img(self):
+        chunks = ['data', '\0' * 4096, 'more', '\0' * 4096]
+        checksum = hashlib.md5(''.join(chunks)).hexdigest()
+        self._set_image(chunks, disk_format='raw', checksum=checksum)
+
+        images.fetch_to_raw(self.context, 'image', self.path, None, None)
+
+        with open(self.path) as f:
+            self.assertEqual(f.read(), ''.join(chunks))
+        self.assertEqual(os.listdir(self.tempdir), ['image'])
+        self.assertEqual(self.executed, [])
+
+    def test_fetch_checksum_mismatch(self):
+        self._set_image(['data'], checksum='0' * 32)
+        self.assertRaises(exception.ImageUnacceptable, images.fetch,
+                          self.context, 'image', self.path, None, None)
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_fetch_to_raw_converts_qcow2(self):
+        header = struct.pack('>4sIQI', 'QFI\xfb', 2, 0, 0)
+        self._set_image([header.ljust(512, '\0')], disk_format='qcow2')
+
+        def fake_execute(*cmd, **kwargs):
+            self.executed.append(cmd)
+            open(cmd[-1], 'w').close()
+            return '', ''
+
+        self.stubs.Set(utils, 'execute', fake_execute)
+        images.fetch_to_raw(self.context, 'image', self.path, None, None)
+
+        self.assertEqual(len(self.executed), 1)
+        self.assertEqual(self.executed[0][:6],
+                         ('qemu-img', 'convert', '-f', 'qcow2', '-O', 'raw'))
+        self.assertEqual(os.listdir(self.tempdir), ['image'])
+
+    def test_fetch_to_raw_probes_raw_labelled_image_with_header(self):
+        self._set_image(['QED\0'.ljust(512, '\0')], disk_format='raw')
+
+        def fake_execute(*cmd, **kwargs):
+            self.executed.append(cmd)
+            if 'info' in cmd:
+                return 'file format: qed\nbacking file: /etc/shadow\n', ''
+            return '', ''
+
+        self.stubs.Set(utils, 'execute', fake_execute)
+        self.assertRaises(exception.ImageUnacceptable, images.fetch_to_raw,
+                          self.context, 'image', self.path, None, None)
+        self.assertEqual(self.executed[0][3:5], ('qemu-img', 'info'))
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_detect_format(self):
+        with open(self.path, 'w') as f:
+            f.write('data'.ljust(4096, '\0'))
+        self.assertEqual(images.detect_format(self.path), 'raw')
+        with open(self.path, 'w') as f:
+            f.write('\0' * 4096 + 'koly'.ljust(512, '\0'))
+        self.assertEqual(images.detect_format(self.path), 'dmg')
+
+    def test_fetch_to_raw_rejects_backing_file(self):
+        header = struct.pack('>4sIQI', 'QFI\xfb', 2, 32, 4)
+        self._set_image([header.ljust(32, '\0') + 'base'])
+        self.assertRaises(exception.ImageUnacceptable, images.fetch_to_raw,
+                          self.context, 'image', self.path, None, None)
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_concurrent_fetches_share_one_download(self):
+        self._set_image(['data'])
+        self.image_service.event = eventlet.event.Event()
+
+        first = eventlet.spawn(images.fetch, self.context, 'image',
+                               self.path, None, None)
+        second = eventlet.spawn(images.fetch, self.context, 'image',
+                                self.path, None, None)
+        eventlet.sleep(0)
+        self.image_service.event.send()
+
+        self.assertEqual(first.wait(), {})
+        self.assertEqual(second.wait(), {})
+        self.assertEqual(self.image_service.calls, 1)
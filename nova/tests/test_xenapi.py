@@ -23,6 +23,7 @@ import functools
 import json
 import os
 import re
+import StringIO
 import stubout
 
 from nova import db
@@ -94,7 +95,8 @@ class XenAPIVolumeTestCase(test.TestCase):
         self.context = context.RequestContext(self.user_id, self.project_id)
         self.flags(target_host='127.0.0.1',
                 xenapi_connection_url='test_url',
-                xenapi_connection_password='test_pass')
+                xenapi_connection_password='test_pass',
+                xenapi_task_use_events=False)
         db_fakes.stub_out_db_instance_api(self.stubs)
         stubs.stub_out_get_target(self.stubs)
         xenapi_fake.reset()
@@ -205,6 +207,7 @@ class XenAPIVMTestCase(test.TestCase):
         self.stubs = stubout.StubOutForTesting()
         self.flags(xenapi_connection_url='test_url',
                    xenapi_connection_password='test_pass',
+                   xenapi_task_use_events=False,
                    instance_name_template='%d')
         xenapi_fake.reset()
         xenapi_fake.create_local_srs()
@@ -757,7 +760,8 @@ class XenAPIMigrateInstance(test.TestCase):
         self.stubs = stubout.StubOutForTesting()
         self.flags(target_host='127.0.0.1',
                 xenapi_connection_url='test_url',
-                xenapi_connection_password='test_pass')
+                xenapi_connection_password='test_pass',
+                xenapi_task_use_events=False)
         db_fakes.stub_out_db_instance_api(self.stubs)
         stubs.stub_out_get_target(self.stubs)
         xenapi_fake.reset()
@@ -1079,6 +1083,76 @@ class CompareVersionTestCase(test.TestCase):
         self.assertTrue(vmops.cmp_version('1.2.3', '1.2.3.4') < 0)
 
 
+class _FakeXenAPIObject(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeTaskEventSession(object):
+    """Fake session whose event.from returns canned batches of events."""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.logged_out = False
+        self.xenapi = _FakeXenAPIObject(
+                event=_FakeXenAPIObject(),
+                session=_FakeXenAPIObject(logout=self._logout))
+        setattr(self.xenapi.event, 'from', self._event_from)
+
+    def _event_from(self, classes, token, timeout):
+        if not self.batches:
+            raise xenapi_fake.Failure(['SESSION_INVALID', 'fake'])
+        return {'events': self.batches.pop(0), 'token': str(len(token))}
+
+    def _logout(self):
+        self.logged_out = True
+
+
+class XenAPITaskWatcherTestCase(test.TestCase):
+    """Unit tests for waiting on XenAPI task events."""
+    def setUp(self):
+        super(XenAPITaskWatcherTestCase, self).setUp()
+        self.stubs.Set(xenapi_conn.tpool, 'execute',
+                       lambda f, *args: f(*args))
+
+    def _task_event(self, ref, status, operation='mod'):
+        return {'class': 'task', 'ref': ref, 'operation': operation,
+                'snapshot': {'name_label': 'Async.VM.start',
+                             'status': status,
+                             'result': '', 'error_info': []}}
+
+    def test_finished_task_wakes_waiter(self):
+        session = FakeTaskEventSession([
+                [self._task_event('task1', 'pending'),
+                 self._task_event('task2', 'success')],
+                [self._task_event('task1', 'success')]])
+        watcher = xenapi_conn.TaskWatcher(lambda: session,
+                                          xenapi_fake.Failure)
+        waiter = watcher.watch('task1')
+        record = waiter.wait()
+        self.assertEqual('success', record['status'])
+
+    def test_failed_watcher_falls_back_to_polling(self):
+        self.flags(xenapi_task_event_retry_interval=60)
+        session = FakeTaskEventSession([
+                [self._task_event('task1', 'pending')]])
+        watcher = xenapi_conn.TaskWatcher(lambda: session,
+                                          xenapi_fake.Failure)
+        waiter = watcher.watch('task1')
+        self.assertEqual(None, waiter.wait())
+        self.assertFalse(watcher.running)
+        self.assertTrue(session.logged_out)
+        self.assertEqual(None, watcher.watch('task1'))
+
+    def test_deleted_task_wakes_waiter(self):
+        session = FakeTaskEventSession([
+                [self._task_event('task1', 'pending', operation='del')]])
+        watcher = xenapi_conn.TaskWatcher(lambda: session,
+                                          xenapi_fake.Failure)
+        waiter = watcher.watch('task1')
+        self.assertEqual(None, waiter.wait())
+
+
 class FakeXenApi(object):
     """Fake XenApi for testing HostState."""
 
@@ -1139,7 +1213,8 @@ class XenAPIAutoDiskConfigTestCase(test.TestCase):
         self.stubs = stubout.StubOutForTesting()
         self.flags(target_host='127.0.0.1',
                    xenapi_connection_url='test_url',
-                   xenapi_connection_password='test_pass')
+                   xenapi_connection_password='test_pass',
+                   xenapi_task_use_events=False)
         stubs.stubout_session(self.stubs, stubs.FakeSessionForVMTests)
         xenapi_fake.reset()
         self.conn = xenapi_conn.get_connection(False)
@@ -1230,7 +1305,8 @@ class XenAPIBWUsageTestCase(test.TestCase):
                        XenAPIBWUsageTestCase._fake_compile_metrics)
         self.flags(target_host='127.0.0.1',
                    xenapi_connection_url='test_url',
-                   xenapi_connection_password='test_pass')
+                   xenapi_connection_password='test_pass',
+                   xenapi_task_use_events=False)
         stubs.stubout_session(self.stubs, stubs.FakeSessionForVMTests)
         xenapi_fake.reset()
         self.conn = xenapi_conn.get_connection(False)
@@ -1239,6 +1315,18 @@ class XenAPIBWUsageTestCase(test.TestCase):
     def _fake_compile_metrics(cls, session, start_time, stop_time=None):
         raise exception.CouldNotFetchMetrics()
 
+    def test_parse_rrd_update(self):
+        xml = StringIO.StringIO(
+            '<xport><meta><start>1000</start><step>5</step><end>1020</end>'
+            '<legend><entry>AVERAGE:vm:uuid1:cpu0</entry>'
+            '<entry>AVERAGE:vm:uuid1:vif_0_tx</entry></legend></meta>'
+            '<data><row><t>1020</t><v>0.5</v><v>100.0</v></row>'
+            '<row><t>1015</t><v>NaN</v><v>50.0</v></row>'
+            '<row><t>1010</t><v>0.25</v><v>10.0</v></row></data></xport>')
+        metrics = vm_utils.parse_rrd_update(xml, 1000)
+        self.assertEqual({'uuid1': {'cpu0': 0.375, 'vif_0_tx': 625.0}},
+                         metrics)
+
     def test_get_all_bw_usage_in_failure_case(self):
         """Test that get_all_bw_usage returns an empty list when metrics
         compilation failed.  c.f. bug #910045.
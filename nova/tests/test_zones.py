@@ -379,3 +379,65 @@ class ZoneManagerTestCase(test.TestCase):
         utils.set_time_override(time_future)
         caps = zm.get_zone_capabilities(None)
         self.assertEquals(caps, {})
+
+    def _host_state_zone_manager(self):
+        zm = zone_manager.ZoneManager()
+        self.mox.StubOutWithMock(zm, '_compute_node_get_all')
+        self.mox.StubOutWithMock(zm, '_instance_get_all')
+        zm._compute_node_get_all(mox.IgnoreArg()).AndReturn([
+                dict(local_gb=2048, memory_mb=2048,
+                     service=dict(host='host1')),
+                dict(local_gb=4096, memory_mb=4096,
+                     service=dict(host='host2'))])
+        zm._instance_get_all(mox.IgnoreArg()).AndReturn([
+                dict(uuid='uuid1', local_gb=512, memory_mb=512,
+                     host='host1')])
+        self.mox.ReplayAll()
+        return zm
+
+    def test_get_all_host_data_uses_cache(self):
+        self.flags(reserved_host_disk_mb=0, reserved_host_memory_mb=0)
+        zm = self._host_state_zone_manager()
+        hosts = zm.get_all_host_data(None)
+        self.assertEquals(hosts['host1'].free_ram_mb, 1536)
+        self.assertEquals(hosts['host2'].free_ram_mb, 4096)
+
+        # The db is not hit again, events update the cache.
+        zm.update_instance_info('host2', 'uuid2', 1024, 1024)
+        zm.delete_instance_info('uuid1')
+        hosts = zm.get_all_host_data(None)
+        self.mox.VerifyAll()
+        self.assertEquals(hosts['host1'].free_ram_mb, 2048)
+        self.assertEquals(hosts['host2'].free_ram_mb, 3072)
+        self.assertEquals(hosts['host2'].free_disk_gb, 3072)
+
+    def test_update_instance_info_moves_instance(self):
+        self.flags(reserved_host_disk_mb=0, reserved_host_memory_mb=0)
+        zm = self._host_state_zone_manager()
+        zm.sync_host_state(None)
+        zm.update_instance_info('host2', 'uuid1', 1024, 1024)
+        hosts = zm.get_all_host_data(None)
+        self.mox.VerifyAll()
+        self.assertEquals(hosts['host1'].free_ram_mb, 2048)
+        self.assertEquals(hosts['host2'].free_ram_mb, 3072)
+
+    def test_host_state_reconciled_after_interval(self):
+        self.flags(host_state_reconcile_interval=60)
+        zm = zone_manager.ZoneManager()
+        self.assertTrue(zm.host_state_needs_sync())
+        zm.host_state_stale = False
+        zm.last_host_state_sync = utils.utcnow()
+        self.assertFalse(zm.host_state_needs_sync())
+        utils.set_time_override(utils.utcnow() +
+                                datetime.timedelta(seconds=61))
+        self.assertTrue(zm.host_state_needs_sync())
+        utils.clear_time_override()
+
+    def test_new_compute_host_marks_host_state_stale(self):
+        zm = zone_manager.ZoneManager()
+        zm.host_state_stale = False
+        zm.update_service_capabilities("compute", "host1", dict(a=1))
+        self.assertTrue(zm.host_state_stale)
+        zm.host_state_stale = False
+        zm.update_service_capabilities("compute", "host1", dict(a=1))
+        self.assertFalse(zm.host_state_stale)
@@ -46,6 +46,7 @@ import netaddr
 from nova import exception
 from nova import flags
 from nova import log as logging
+from nova.rootwrap import daemon as rootwrap_daemon
 
 
 LOG = logging.getLogger("nova.utils")
@@ -163,7 +164,8 @@ def execute(*cmd, **kwargs):
     :attempts           How many times to retry cmd.
     :run_as_root        True | False. Defaults to False. If set to True,
                         the command is prefixed by the command specified
-                        in the root_helper FLAG.
+                        in the root_helper FLAG, or sent to the rootwrap
+                        daemon if the use_rootwrap_daemon FLAG is set.
 
     :raises exception.Error on receiving unknown arguments
     :raises exception.ProcessExecutionError
@@ -189,6 +191,8 @@ def execute(*cmd, **kwargs):
         raise exception.Error(_('Got unknown keyword args '
                                 'to utils.execute: %r') % kwargs)
 
+    use_daemon = run_as_root and FLAGS.use_rootwrap_daemon and not shell
+    root_cmd = map(str, cmd)
     if run_as_root:
         cmd = shlex.split(FLAGS.root_helper) + list(cmd)
     cmd = map(str, cmd)
@@ -196,21 +200,28 @@ def execute(*cmd, **kwargs):
     while attempts > 0:
         attempts -= 1
         try:
-            LOG.debug(_('Running cmd (subprocess): %s'), ' '.join(cmd))
-            _PIPE = subprocess.PIPE  # pylint: disable=E1101
-            obj = subprocess.Popen(cmd,
-                                   stdin=_PIPE,
-                                   stdout=_PIPE,
-                                   stderr=_PIPE,
-                                   close_fds=True,
-                                   shell=shell)
             result = None
-            if process_input is not None:
-                result = obj.communicate(process_input)
+            if use_daemon:
+                result = _execute_with_rootwrap_daemon(root_cmd,
+                                                       process_input)
+            if result is not None:
+                (_returncode, stdout, stderr) = result
+                result = (stdout, stderr)
             else:
-                result = obj.communicate()
-            obj.stdin.close()  # pylint: disable=E1101
-            _returncode = obj.returncode  # pylint: disable=E1101
+                LOG.debug(_('Running cmd (subprocess): %s'), ' '.join(cmd))
+                _PIPE = subprocess.PIPE  # pylint: disable=E1101
+                obj = subprocess.Popen(cmd,
+                                       stdin=_PIPE,
+                                       stdout=_PIPE,
+                                       stderr=_PIPE,
+                                       close_fds=True,
+                                       shell=shell)
+                if process_input is not None:
+                    result = obj.communicate(process_input)
+                else:
+                    result = obj.communicate()
+                obj.stdin.close()  # pylint: disable=E1101
+                _returncode = obj.returncode  # pylint: disable=E1101
             if _returncode:
                 LOG.debug(_('Result was %s') % _returncode)
                 if not ignore_exit_code \
@@ -236,6 +247,75 @@ def execute(*cmd, **kwargs):
             greenthread.sleep(0)
 
 
+_rootwrap_daemon_lock = semaphore.Semaphore()
+# Until when not to try starting the rootwrap daemon again after it failed.
+_rootwrap_daemon_retry_at = 0
+
+
+def _execute_with_rootwrap_daemon(cmd, process_input):
+    """Run cmd as root through the rootwrap daemon, starting it if needed.
+
+    Returns (returncode, stdout, stderr), or None if the daemon is not
+    available and the command should be run through root_helper instead.
+    """
+    LOG.debug(_('Running cmd (rootwrap daemon): %s'), ' '.join(cmd))
+    for _attempt in xrange(2):
+        try:
+            return rootwrap_daemon.execute(cmd, process_input)
+        except rootwrap_daemon.DaemonUnavailable:
+            if not _start_rootwrap_daemon():
+                return None
+        except (socket.error, ValueError), e:
+            # NOTE: the command was sent and may have run, so it must
+            # not simply be run again through root_helper.
+            raise exception.ProcessExecutionError(
+                    stderr=_('Lost connection to rootwrap daemon: %s') % e,
+                    cmd=' '.join(cmd))
+    return None
+
+
+def _start_rootwrap_daemon():
+    """Start the rootwrap daemon through root_helper.
+
+    Returns whether the daemon is running.
+    """
+    with _rootwrap_daemon_lock:
+        return _start_rootwrap_daemon_locked()
+
+
+def _start_rootwrap_daemon_locked():
+    global _rootwrap_daemon_retry_at
+    if rootwrap_daemon.is_running():
+        return True
+    if time.time() < _rootwrap_daemon_retry_at:
+        return False
+
+    cmd = shlex.split(FLAGS.root_helper) + ['--daemon']
+    LOG.info(_('Starting rootwrap daemon: %s'), ' '.join(cmd))
+    try:
+        with open(os.devnull, 'r+') as devnull:
+            obj = subprocess.Popen(cmd,
+                                   stdin=devnull,
+                                   stdout=devnull,
+                                   stderr=devnull,
+                                   close_fds=True)
+        # Reap it whenever it exits.
+        greenthread.spawn(obj.wait)
+        for _i in xrange(50):
+            if rootwrap_daemon.is_running():
+                return True
+            if obj.poll() is not None:
+                break
+            greenthread.sleep(0.1)
+    except OSError, e:
+        LOG.warn(_('Could not start rootwrap daemon: %s'), e)
+
+    LOG.warn(_('Rootwrap daemon is not running, running commands through '
+               'root_helper instead'))
+    _rootwrap_daemon_retry_at = time.time() + 60
+    return False
+
+
 def trycmd(*args, **kwargs):
     """
     A wrapper around execute() to more easily handle warnings and errors.
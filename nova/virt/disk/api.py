@@ -33,6 +33,7 @@ from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import utils
+from nova.virt import images
 from nova.virt.disk import guestfs
 from nova.virt.disk import loop
 from nova.virt.disk import nbd
@@ -95,7 +96,9 @@ def extend(image, size):
     file_size = os.path.getsize(image)
     if file_size >= size:
         return
-    utils.execute('qemu-img', 'resize', image, size)
+    # NOTE: pass the format so qemu-img never probes the image
+    utils.execute('qemu-img', 'resize', '-f', images.detect_format(image),
+                  image, size)
     # NOTE(vish): attempts to resize filesystem
     utils.execute('e2fsck', '-fp', image, check_exit_code=False)
     utils.execute('resize2fs', image, check_exit_code=False)
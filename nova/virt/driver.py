@@ -532,6 +532,15 @@ class ComputeDriver(object):
         """Return currently known host stats"""
         raise NotImplementedError()
 
+    def manage_image_cache(self, context):
+        """Clean up and refill the local cache of images, if any."""
+        pass
+
+    def prefetch_images(self, context, image_ids):
+        """Download the given images into the local image cache so the
+        first instance booted from them does not wait on the download."""
+        raise NotImplementedError()
+
     def list_disks(self, instance_name):
         """
         Return the IDs of all the virtual disks attached to the specified
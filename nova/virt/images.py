@@ -21,7 +21,12 @@
 Handling of VM disk images.
 """
 
+import hashlib
 import os
+import struct
+import sys
+
+from eventlet import event
 
 from nova import exception
 from nova import flags
@@ -33,69 +38,262 @@ from nova import utils
 FLAGS = flags.FLAGS
 LOG = logging.getLogger('nova.virt.images')
 
+# disk_format values of images that are stored as plain raw disks
+_RAW_DISK_FORMATS = ('raw', 'ami', 'aki', 'ari')
 
-def fetch(context, image_href, path, _user_id, _project_id):
+# Bytes at either end of an image needed to recognize the formats in
+# _detect_format
+_HEADER_SIZE = 512
+
+_QCOW_MAGIC = 'QFI\xfb'
+# magic, version, backing_file_offset, backing_file_size
+_QCOW_HEADER = struct.Struct('>4sIQI')
+
+# path -> event sent when the download to that path in progress finishes
+_IN_FLIGHT = {}
+
+
+# (format, magic at the start of the image) for every format qemu probes
+# from the image header
+_HEADER_MAGICS = (
+    ('qed', 'QED\0'),
+    ('vmdk', 'KDMV'),
+    ('vmdk', 'COWD'),
+    ('vmdk', '# Disk Descriptor'),
+    ('vpc', 'conectix'),
+    ('vhdx', 'vhdxfile'),
+    ('cow', 'OOOM'),
+    ('bochs', 'Bochs Virtual HD Image'),
+    ('parallels', 'WithoutFreeSpace'),
+    ('parallels', 'WithouFreSpacExt'),
+    ('cloop', '#!/bin/sh\n#V2.0 Format\n'),
+    ('luks', 'LUKS\xba\xbe'),
+)
+
+
+def _detect_format(header, trailer=''):
+    """Recognize the disk format of an image from its first and last bytes.
+
+    Every format qemu would probe an image as is recognized, so None
+    means that qemu would treat the image as raw too.
+    """
+    if header.startswith(_QCOW_MAGIC):
+        return 'qcow2' if header[4:8] != '\0\0\0\1' else 'qcow'
+    for fmt, magic in _HEADER_MAGICS:
+        if header.startswith(magic):
+            return fmt
+    if header[0x40:0x44] == '\x7f\x10\xda\xbe':
+        return 'vdi'
+    # NOTE: vmdk descriptors need not start with a comment; qemu looks
+    # for the createType line anywhere in the first sector.
+    if 'createType=' in header:
+        return 'vmdk'
+    if trailer.startswith('koly'):
+        return 'dmg'
+    if trailer.startswith('conectix'):
+        return 'vpc'
+    return None
+
+
+def detect_format(path):
+    """Return the disk format of the image at path, 'raw' if it has none.
+
+    Pass the result to qemu explicitly rather than letting qemu probe the
+    image, which would let a raw image that looks like another format
+    refer to files on the host.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER_SIZE)
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        trailer = ''
+        if size >= 2 * _HEADER_SIZE:
+            f.seek(size - _HEADER_SIZE)
+            trailer = f.read(_HEADER_SIZE)
+    return _detect_format(header, trailer) or 'raw'
+
+
+def get_qcow2_backing_file(path):
+    """Return the backing file recorded in a qcow2 image, or None."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_QCOW_HEADER.size)
+            if len(header) < _QCOW_HEADER.size:
+                return None
+            magic, _version, offset, size = _QCOW_HEADER.unpack(header)
+            if magic != _QCOW_MAGIC or not offset or not size:
+                return None
+            f.seek(offset)
+            return f.read(size)
+    except IOError:
+        return None
+
+
+class _ImageWriter(object):
+    """File-like object image services write image data into.
+
+    Recognizes the disk format from the first and last bytes and computes
+    the md5 checksum while the data streams past, so neither takes another pass
+    over the file.  Blocks of zeros are skipped rather than written, which
+    leaves the file sparse.
+    """
+
+    def __init__(self, image_file):
+        self._file = image_file
+        self._md5 = hashlib.md5()
+        self._header = ''
+        self._trailer = ''
+        self._size = 0
+
+    def write(self, data):
+        if len(self._header) < _HEADER_SIZE:
+            self._header += data[:_HEADER_SIZE - len(self._header)]
+        self._trailer = (self._trailer + data[-_HEADER_SIZE:])[-_HEADER_SIZE:]
+        self._md5.update(data)
+        if data.lstrip('\0'):
+            self._file.write(data)
+        else:
+            self._file.seek(len(data), os.SEEK_CUR)
+        self._size += len(data)
+
+    def close(self):
+        # Zeros skipped at the end of the image still count for its size.
+        self._file.truncate(self._size)
+
+    @property
+    def checksum(self):
+        return self._md5.hexdigest()
+
+    @property
+    def format(self):
+        trailer = self._trailer if self._size >= 2 * _HEADER_SIZE else ''
+        return _detect_format(self._header, trailer)
+
+
+def _single_flight(path, fn, *args):
+    """Run fn(*args) to create path, unless that is already happening.
+
+    Callers that arrive while a download to path is in progress wait for
+    it and share its result or exception instead of starting another.
+    """
+    in_flight = _IN_FLIGHT.get(path)
+    if in_flight is not None:
+        LOG.debug(_('Waiting for the download to %s in progress'), path)
+        return in_flight.wait()
+
+    in_flight = _IN_FLIGHT[path] = event.Event()
+    try:
+        result = fn(*args)
+    except Exception:
+        with utils.save_and_reraise_exception():
+            del _IN_FLIGHT[path]
+            in_flight.send_exception(*sys.exc_info())
+    del _IN_FLIGHT[path]
+    in_flight.send(result)
+    return result
+
+
+def _download(context, image_href, path):
+    """Stream an image into path, returning its metadata and format."""
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
     #             auth checking in glance, so we assume that access was
     #             checked before we got here.
     (image_service, image_id) = nova.image.get_image_service(context,
                                                              image_href)
-    with open(path, "wb") as image_file:
-        metadata = image_service.get(context, image_id, image_file)
-    return metadata
+    try:
+        with open(path, "wb") as image_file:
+            writer = _ImageWriter(image_file)
+            metadata = image_service.get(context, image_id, writer)
+            writer.close()
 
+        expected = metadata.get('checksum')
+        if expected and expected != writer.checksum:
+            raise exception.ImageUnacceptable(image_id=image_href,
+                reason=_("checksum %(actual)s does not match %(expected)s") %
+                {'actual': writer.checksum, 'expected': expected})
+    except Exception:
+        with utils.save_and_reraise_exception():
+            if os.path.exists(path):
+                os.unlink(path)
+    return metadata, writer.format
 
-def fetch_to_raw(context, image_href, path, user_id, project_id):
+
+def _qemu_img_info(path):
+
+    out, err = utils.execute('env', 'LC_ALL=C', 'LANG=C',
+        'qemu-img', 'info', path)
+
+    # output of qemu-img is 'field: value'
+    # the fields of interest are 'file format' and 'backing file'
+    data = {}
+    for line in out.splitlines():
+        (field, val) = line.split(':', 1)
+        if val[0] == " ":
+            val = val[1:]
+        data[field] = val
+
+    return(data)
+
+
+def fetch(context, image_href, path, _user_id, _project_id):
+    """Download an image to path as it is stored."""
+    return _single_flight(path, _fetch, context, image_href, path)
+
+
+def _fetch(context, image_href, path):
     path_tmp = "%s.part" % path
-    metadata = fetch(context, image_href, path_tmp, user_id, project_id)
+    metadata, _fmt = _download(context, image_href, path_tmp)
+    os.rename(path_tmp, path)
+    return metadata
 
-    def _qemu_img_info(path):
 
-        out, err = utils.execute('env', 'LC_ALL=C', 'LANG=C',
-            'qemu-img', 'info', path)
+def fetch_to_raw(context, image_href, path, user_id, project_id):
+    """Download an image to path, converting it to a raw disk if needed."""
+    return _single_flight(path, _fetch_to_raw, context, image_href, path)
 
-        # output of qemu-img is 'field: value'
-        # the fields of interest are 'file format' and 'backing file'
-        data = {}
-        for line in out.splitlines():
-            (field, val) = line.split(':', 1)
-            if val[0] == " ":
-                val = val[1:]
-            data[field] = val
 
-        return(data)
+def _fetch_to_raw(context, image_href, path):
+    path_tmp = "%s.part" % path
+    metadata, fmt = _download(context, image_href, path_tmp)
 
-    data = _qemu_img_info(path_tmp)
+    backing_file = None
+    # NOTE: disk_format is chosen by whoever uploaded the image, so it is
+    # only trusted when no header qemu could probe is present either.
+    if fmt is None and metadata.get('disk_format') in _RAW_DISK_FORMATS:
+        fmt = 'raw'
+    elif fmt in ('qcow', 'qcow2'):
+        backing_file = get_qcow2_backing_file(path_tmp)
+    else:
+        # NOTE: not a format recognized from the header, leave it to
+        # qemu-img to work out what it is.
+        data = _qemu_img_info(path_tmp)
+        fmt = data.get("file format", None)
+        if fmt is None:
+            os.unlink(path_tmp)
+            raise exception.ImageUnacceptable(
+                reason=_("'qemu-img info' parsing failed."),
+                image_id=image_href)
+        backing_file = data.get('backing file')
 
-    fmt = data.get("file format", None)
-    if fmt is None:
+    if backing_file:
         os.unlink(path_tmp)
-        raise exception.ImageUnacceptable(
-            reason=_("'qemu-img info' parsing failed."), image_id=image_href)
+        raise exception.ImageUnacceptable(image_id=image_href,
+            reason=_("fmt=%(fmt)s backed by: %(backing_file)s") % locals())
 
     if fmt != "raw":
         staged = "%s.converted" % path
-        if "backing file" in data:
-            backing_file = data['backing file']
-            os.unlink(path_tmp)
-            raise exception.ImageUnacceptable(image_id=image_href,
-                reason=_("fmt=%(fmt)s backed by: %(backing_file)s") % locals())
-
         LOG.debug("%s was %s, converting to raw" % (image_href, fmt))
-        out, err = utils.execute('qemu-img', 'convert', '-O', 'raw',
-                                 path_tmp, staged)
-        os.unlink(path_tmp)
-
-        data = _qemu_img_info(staged)
-        if data.get('file format', None) != "raw":
-            os.unlink(staged)
-            raise exception.ImageUnacceptable(image_id=image_href,
-                reason=_("Converted to raw, but format is now %s") %
-                data.get('file format', None))
-
+        try:
+            utils.execute('qemu-img', 'convert', '-f', fmt, '-O', 'raw',
+                          path_tmp, staged)
+        except Exception:
+            with utils.save_and_reraise_exception():
+                if os.path.exists(staged):
+                    os.unlink(staged)
+        finally:
+            os.unlink(path_tmp)
         os.rename(staged, path)
-
     else:
         os.rename(path_tmp, path)
 
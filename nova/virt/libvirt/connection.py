@@ -39,7 +39,6 @@ Supports KVM, LXC, QEMU, UML, and XEN.
 
 """
 
-import hashlib
 import functools
 import multiprocessing
 import os
@@ -66,6 +65,7 @@ from nova import utils
 from nova.virt.disk import api as disk
 from nova.virt import driver
 from nova.virt import images
+from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import utils as libvirt_utils
 
 
@@ -202,6 +202,7 @@ class LibvirtConnection(driver.ComputeDriver):
         self.default_root_device = self._disk_prefix + 'a'
         self.default_local_device = self._disk_prefix + 'b'
         self.default_swap_device = self._disk_prefix + 'c'
+        self.image_cache_manager = imagecache.ImageCacheManager()
 
     @property
     def host_state(self):
@@ -805,23 +806,35 @@ class LibvirtConnection(driver.ComputeDriver):
         """
 
         if not os.path.exists(target):
-            base_dir = os.path.join(FLAGS.instances_path, '_base')
-            if not os.path.exists(base_dir):
-                libvirt_utils.ensure_tree(base_dir)
-            base = os.path.join(base_dir, fname)
-
-            @utils.synchronized(fname)
-            def call_if_not_exists(base, fn, *args, **kwargs):
-                if not os.path.exists(base):
-                    fn(target=base, *args, **kwargs)
-
-            call_if_not_exists(base, fn, *args, **kwargs)
+            base = LibvirtConnection._cache_base_image(fn, fname,
+                                                       *args, **kwargs)
 
             if cow:
                 libvirt_utils.create_cow_image(base, target)
             else:
                 libvirt_utils.copy_image(base, target)
 
+    @staticmethod
+    def _cache_base_image(fn, fname, *args, **kwargs):
+        """Create the base image fname with fn unless it is cached already.
+
+        Returns the path of the base image.  The image is marked as used so
+        the image cache manager keeps it around.
+        """
+        base_dir = imagecache.get_base_dir()
+        if not os.path.exists(base_dir):
+            libvirt_utils.ensure_tree(base_dir)
+        base = os.path.join(base_dir, fname)
+
+        @utils.synchronized(fname)
+        def call_if_not_exists(base, fn, *args, **kwargs):
+            if not os.path.exists(base):
+                fn(target=base, *args, **kwargs)
+            imagecache.mark_used(base)
+
+        call_if_not_exists(base, fn, *args, **kwargs)
+        return base
+
     @staticmethod
     def _fetch_image(context, target, image_id, user_id, project_id,
                      size=None):
@@ -901,14 +914,15 @@ class LibvirtConnection(driver.ComputeDriver):
                                   user_id=inst['user_id'],
                                   project_id=inst['project_id'])
 
-        root_fname = hashlib.sha1(str(disk_images['image_id'])).hexdigest()
+        root_fname = imagecache.root_image_name(disk_images['image_id'])
         size = FLAGS.minimum_root_size
 
         inst_type_id = inst['instance_type_id']
         inst_type = instance_types.get_instance_type(inst_type_id)
         if inst_type['name'] == 'm1.tiny' or suffix == '.rescue':
             size = None
-            root_fname += "_sm"
+            root_fname = imagecache.root_image_name(disk_images['image_id'],
+                                                    resized=False)
 
         if not self._volume_in_mapping(self.default_root_device,
                                        block_device_info):
@@ -1921,6 +1935,49 @@ class LibvirtConnection(driver.ComputeDriver):
         """Sets the specified host's ability to accept new instances."""
         pass
 
+    def manage_image_cache(self, context):
+        """Evict unused base images and warm FLAGS.image_cache_prefetch_images.
+
+        Prefetching runs in the background so a slow download does not
+        hold up the periodic task.
+        """
+        self.image_cache_manager.evict()
+        missing = self.image_cache_manager.missing_prefetch_images()
+        if missing:
+            greenthread.spawn(self.prefetch_images, context, missing)
+
+    def prefetch_images(self, context, image_ids):
+        """Download images into the base image cache ahead of first boot.
+
+        The root disk is cached the way a non-tiny instance type uses it,
+        together with the kernel and ramdisk of the image, if any.
+        """
+        for image_id in image_ids:
+            try:
+                (image_service, service_image_id) = \
+                        nova.image.get_image_service(context, image_id)
+                image = image_service.show(context, service_image_id)
+                properties = image.get('properties', {})
+                for key in ('kernel_id', 'ramdisk_id'):
+                    if properties.get(key):
+                        self._cache_base_image(libvirt_utils.fetch_image,
+                                               str(properties[key]),
+                                               context=context,
+                                               image_id=properties[key],
+                                               user_id=context.user_id,
+                                               project_id=context.project_id)
+                self._cache_base_image(libvirt_utils.fetch_image,
+                                       imagecache.root_image_name(image_id),
+                                       context=context,
+                                       image_id=image_id,
+                                       user_id=context.user_id,
+                                       project_id=context.project_id,
+                                       size=FLAGS.minimum_root_size)
+                LOG.info(_('Prefetched image %s into the image cache'),
+                         image_id)
+            except Exception:
+                LOG.exception(_('Failed to prefetch image %s'), image_id)
+
 
 class HostState(object):
     """Manages information about the compute node through libvirt"""
@@ -0,0 +1,224 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Management of the base image cache in FLAGS.instances_path/_base.
+
+The modification time of a base image is its last use: LibvirtConnection
+touches the file every time it builds an instance disk from it.  Base
+images that back a copy-on-write disk of any instance are in use and are
+never removed.  Unused base images are removed least recently used first
+once they are older than FLAGS.image_cache_max_age or while the cache is
+larger than FLAGS.image_cache_max_size_gb.
+"""
+
+import hashlib
+import os
+import stat
+import time
+
+from nova import flags
+from nova import log as logging
+from nova import utils
+from nova.virt import images
+
+
+LOG = logging.getLogger('nova.virt.libvirt.imagecache')
+FLAGS = flags.FLAGS
+flags.DEFINE_boolean('remove_unused_base_images', True,
+                     'Remove unused base images from the image cache')
+flags.DEFINE_integer('image_cache_max_size_gb', 0,
+                     'Remove unused base images, least recently used '
+                     'first, while the image cache is larger than this '
+                     '(0 means no limit)')
+flags.DEFINE_integer('image_cache_max_age', 24 * 60 * 60,
+                     'Remove base images unused for this many seconds '
+                     '(0 means no limit)')
+flags.DEFINE_integer('image_cache_min_age', 60 * 60,
+                     'Never remove base images used within this many '
+                     'seconds, whatever the size of the cache')
+flags.DEFINE_list('image_cache_prefetch_images', [],
+                  'Images to keep in the image cache of every host so '
+                  'their first boot does not wait on a download')
+
+# Left behind by downloads and conversions still in progress.
+_PARTIAL_SUFFIXES = ('.part', '.converted')
+
+
+def get_base_dir():
+    return os.path.join(FLAGS.instances_path, '_base')
+
+
+def root_image_name(image_id, resized=True):
+    """Return the name of the cached root disk base image for image_id."""
+    name = hashlib.sha1(str(image_id)).hexdigest()
+    if not resized:
+        name += '_sm'
+    return name
+
+
+def mark_used(path):
+    """Record that the base image at path was just used."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        # NOTE: the image may not have been created at all, which the
+        # caller will find out about soon enough.
+        pass
+
+
+def get_backing_file(path):
+    """Return the name of the backing file of a qcow2 disk, or None.
+
+    Reads the qcow2 header directly, which is much cheaper than running
+    qemu-img info against every disk on the host.
+    """
+    backing_file = images.get_qcow2_backing_file(path)
+    if backing_file:
+        return os.path.basename(backing_file)
+    return None
+
+
+class ImageCacheManager(object):
+    """Tracks use of the base images on this host and evicts unused ones."""
+
+    def list_base_images(self):
+        """Return {name: (last_used, bytes on disk)} for each base image."""
+        base_dir = get_base_dir()
+        try:
+            names = os.listdir(base_dir)
+        except OSError:
+            return {}
+
+        images = {}
+        for name in names:
+            if name.endswith(_PARTIAL_SUFFIXES):
+                continue
+            try:
+                st = os.stat(os.path.join(base_dir, name))
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            images[name] = (st.st_mtime, st.st_blocks * 512)
+        return images
+
+    def referenced_base_images(self):
+        """Return {name: number of instance disks backed by it}.
+
+        Every instance directory under FLAGS.instances_path is scanned, not
+        just those of running domains, so stopped instances and those of
+        other hosts sharing the same instances_path keep their base images.
+        """
+        references = {}
+        try:
+            names = os.listdir(FLAGS.instances_path)
+        except OSError:
+            return references
+
+        for name in names:
+            instance_dir = os.path.join(FLAGS.instances_path, name)
+            if name == '_base' or not os.path.isdir(instance_dir):
+                continue
+            try:
+                disks = os.listdir(instance_dir)
+            except OSError:
+                continue
+            for disk in disks:
+                if not disk.startswith('disk'):
+                    continue
+                backing_file = get_backing_file(os.path.join(instance_dir,
+                                                             disk))
+                if backing_file:
+                    references[backing_file] = \
+                            references.get(backing_file, 0) + 1
+        return references
+
+    def pinned_base_images(self):
+        """Return the names of base images that are never removed."""
+        return set(root_image_name(image_id)
+                   for image_id in FLAGS.image_cache_prefetch_images)
+
+    def _remove_base_image(self, name, min_age):
+        path = os.path.join(get_base_dir(), name)
+
+        # NOTE: LibvirtConnection._cache_image fetches and touches base
+        # images under this lock, so an image cannot be picked for a new
+        # instance while it is removed here.
+        @utils.synchronized(name)
+        def remove_if_unused():
+            try:
+                if time.time() - os.stat(path).st_mtime < min_age:
+                    return False
+                os.unlink(path)
+            except OSError, e:
+                LOG.warn(_('Could not remove base image %(path)s: %(e)s'),
+                         locals())
+                return False
+            return True
+
+        return remove_if_unused()
+
+    def evict(self):
+        """Remove unused base images past the age or size limits.
+
+        Returns the names of the removed images.
+        """
+        if not FLAGS.remove_unused_base_images:
+            return []
+
+        now = time.time()
+        max_age = FLAGS.image_cache_max_age
+        max_size = FLAGS.image_cache_max_size_gb * 1024 * 1024 * 1024
+        min_age = FLAGS.image_cache_min_age
+
+        images = self.list_base_images()
+        in_use = self.referenced_base_images()
+        pinned = self.pinned_base_images()
+        total = sum(size for _last_used, size in images.itervalues())
+
+        candidates = sorted((last_used, name)
+                            for name, (last_used, _size) in images.iteritems()
+                            if name not in in_use and name not in pinned and
+                               now - last_used >= min_age)
+
+        removed = []
+        for last_used, name in candidates:
+            too_old = max_age > 0 and now - last_used > max_age
+            too_big = max_size > 0 and total > max_size
+            if not (too_old or too_big):
+                # Candidates are oldest first and the cache only shrinks,
+                # so nothing after this one qualifies either.
+                break
+            if self._remove_base_image(name, min_age):
+                age = now - last_used
+                LOG.info(_('Removed base image %(name)s, unused for '
+                           '%(age)d seconds'), locals())
+                total -= images[name][1]
+                removed.append(name)
+
+        if max_size > 0 and total > max_size:
+            LOG.warn(_('Image cache is %(total)d bytes, over its limit of '
+                       '%(max_size)d, but the remaining base images are in '
+                       'use or were used recently'), locals())
+        return removed
+
+    def missing_prefetch_images(self):
+        """Return the prefetch images that are not cached yet."""
+        base_dir = get_base_dir()
+        return [image_id for image_id in FLAGS.image_cache_prefetch_images
+                if not os.path.exists(os.path.join(base_dir,
+                                                   root_image_name(image_id)))]
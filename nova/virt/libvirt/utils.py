@@ -57,13 +57,16 @@ def create_image(disk_format, path, size):
 def create_cow_image(backing_file, path):
     """Create COW image
 
-    Creates a COW image with the given backing file
+    Creates a COW image with the given backing file.  The format of the
+    backing file is recorded in the COW image so qemu never probes it.
 
     :param backing_file: Existing image on which to base the COW image
     :param path: Desired location of the COW image
     """
+    backing_fmt = images.detect_format(backing_file)
     execute(FLAGS.qemu_img, 'create', '-f', 'qcow2', '-o',
-             'cluster_size=2M,backing_file=%s' % backing_file, path)
+             'cluster_size=2M,backing_file=%s,backing_fmt=%s' %
+             (backing_file, backing_fmt), path)
 
 
 def get_disk_size(path):
@@ -20,6 +20,7 @@ Helper methods for operations related to the management of VM records and
 their attributes like VDIs, VIFs, as well as their lookup functions.
 """
 
+import array
 import contextlib
 import json
 import os
@@ -30,8 +31,8 @@ import tempfile
 import time
 import urllib
 import uuid
-from decimal import Decimal
 from xml.dom import minidom
+from xml.etree import ElementTree
 
 from nova import exception
 from nova import flags
@@ -899,11 +900,15 @@ class VMHelper(HelperBase):
             raise exception.CouldNotFetchMetrics()
 
         xml = get_rrd_updates(host_ip, start_time)
-        if xml:
-            doc = minidom.parseString(xml)
-            return parse_rrd_update(doc, start_time, stop_time)
-
-        raise exception.CouldNotFetchMetrics()
+        if not xml:
+            raise exception.CouldNotFetchMetrics()
+        try:
+            return parse_rrd_update(xml, start_time, stop_time)
+        except (IOError, SyntaxError, ValueError, IndexError) as e:
+            LOG.warn(_("Unable to parse RRD updates: %s"), e)
+            raise exception.CouldNotFetchMetrics()
+        finally:
+            xml.close()
 
     @classmethod
     def scan_sr(cls, session, instance=None, sr_ref=None):
@@ -1002,85 +1007,87 @@ def get_rrd(host, vm_uuid):
 
 
 def get_rrd_updates(host, start_time):
-    """Return the RRD updates XML as a string"""
+    """Return the RRD updates XML as a file-like object.
+
+    The response is parsed as it is read, since it holds a row for every
+    five seconds since start_time for every VM on the host.
+    """
     try:
-        xml = urllib.urlopen("http://%s:%s@%s/rrd_updates?start=%s" % (
+        return urllib.urlopen("http://%s:%s@%s/rrd_updates?start=%s" % (
             FLAGS.xenapi_connection_username,
             FLAGS.xenapi_connection_password,
             host,
             start_time))
-        return xml.read()
     except IOError:
         return None
 
 
-def parse_rrd_meta(doc):
-    data = {}
-    meta = doc.getElementsByTagName('meta')[0]
-    for tag in ('start', 'end', 'step'):
-        data[tag] = int(meta.getElementsByTagName(tag)[0].firstChild.data)
-    legend = meta.getElementsByTagName('legend')[0]
-    data['legend'] = [child.firstChild.data for child in legend.childNodes]
-    return data
-
-
-def parse_rrd_data(doc):
-    dnode = doc.getElementsByTagName('data')[0]
-    return [dict(
-            time=int(child.getElementsByTagName('t')[0].firstChild.data),
-            values=[Decimal(valnode.firstChild.data)
-                  for valnode in child.getElementsByTagName('v')])
-            for child in dnode.childNodes]
+def parse_rrd_update(xml, start, until=None):
+    """Return {vm uuid: {metric name: value}} from RRD updates XML.
 
+    Bandwidth (vif) columns are integrated over time, everything else is
+    averaged.  xml is a file-like object or a file name; it is parsed
+    incrementally and each row is discarded once its values are stored.
+    """
+    legend = []
+    times = []
+    columns = None
+    for _event, elem in ElementTree.iterparse(xml):
+        if elem.tag == 'entry':
+            legend.append(elem.text)
+        elif elem.tag == 'row':
+            if columns is None:
+                columns = [array.array('d') for _label in legend]
+            times.append(int(elem.findtext('t')))
+            for column, valnode in zip(columns, elem.findall('v')):
+                column.append(float(valnode.text))
+            elem.clear()
 
-def parse_rrd_update(doc, start, until=None):
     sum_data = {}
-    meta = parse_rrd_meta(doc)
-    data = parse_rrd_data(doc)
-    for col, collabel in enumerate(meta['legend']):
+    for col, collabel in enumerate(legend):
         datatype, objtype, uuid, name = collabel.split(':')
-        vm_data = sum_data.get(uuid, dict())
+        values = columns[col] if columns else ()
+        vm_data = sum_data.setdefault(uuid, {})
         if name.startswith('vif'):
-            vm_data[name] = integrate_series(data, col, start, until)
+            vm_data[name] = integrate_series(times, values, start, until)
         else:
-            vm_data[name] = average_series(data, col, start, until)
-        sum_data[uuid] = vm_data
+            vm_data[name] = average_series(times, values, until)
     return sum_data
 
 
-def average_series(data, col, start, until=None):
-    vals = [row['values'][col] for row in data
-            if (not until or (row['time'] <= until)) and
-                not row['values'][col].is_nan()]
-    if vals:
-        return (sum(vals) / len(vals)).quantize(Decimal('1.0000'))
-    else:
-        return Decimal('0.0000')
-
-
-def integrate_series(data, col, start, until=None):
-    total = Decimal('0.0000')
+def average_series(times, values, until=None):
+    """Average the values of a series recorded no later than until."""
+    total = 0.0
+    count = 0
+    for row_time, val in zip(times, values):
+        # NOTE: NaN is the only value that is not equal to itself.
+        if (not until or row_time <= until) and val == val:
+            total += val
+            count += 1
+    if count:
+        return round(total / count, 4)
+    return 0.0
+
+
+def integrate_series(times, values, start, until=None):
+    """Integrate a per second rate series, recorded newest first, over
+    time from start to until with the trapezoidal rule."""
+    total = 0.0
     prev_time = int(start)
     prev_val = None
-    for row in reversed(data):
-        if not until or (row['time'] <= until):
-            time = row['time']
-            val = row['values'][col]
-            if val.is_nan():
-                val = Decimal('0.0000')
-            if prev_val is None:
-                prev_val = val
-            if prev_val >= val:
-                total += ((val * (time - prev_time)) +
-                          (Decimal('0.5000') * (prev_val - val) *
-                          (time - prev_time)))
-            else:
-                total += ((prev_val * (time - prev_time)) +
-                          (Decimal('0.5000') * (val - prev_val) *
-                          (time - prev_time)))
-            prev_time = time
+    for i in xrange(len(times) - 1, -1, -1):
+        row_time = times[i]
+        if until and row_time > until:
+            continue
+        val = values[i]
+        if val != val:
+            val = 0.0
+        if prev_val is None:
             prev_val = val
-    return total.quantize(Decimal('1.0000'))
+        total += 0.5 * (prev_val + val) * (row_time - prev_time)
+        prev_time = row_time
+        prev_val = val
+    return round(total, 4)
 
 
 #TODO(sirp): This code comes from XS5.6 pluginlib.py, we should refactor to
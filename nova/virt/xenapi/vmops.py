@@ -1326,21 +1326,34 @@ class VMOps(object):
             LOG.exception(_("Could not get bandwidth info."),
                           exc_info=sys.exc_info())
             return {}
+        # NOTE: fetch every VM and VIF record in two calls rather than
+        # three calls per VM and one per VIF.
+        vm_recs = {}
+        for vm_rec in self._session.call_xenapi("VM.get_all_records").\
+                      itervalues():
+            vm_recs[vm_rec['uuid']] = vm_rec
+        vif_recs = self._session.call_xenapi("VIF.get_all_records")
+
         bw = {}
         for uuid, data in metrics.iteritems():
-            vm_ref = self._session.call_xenapi("VM.get_by_uuid", uuid)
-            vm_rec = self._session.call_xenapi("VM.get_record", vm_ref)
-            vif_map = {}
-            for vif in [self._session.call_xenapi("VIF.get_record", vrec)
-                        for vrec in vm_rec['VIFs']]:
-                vif_map[vif['device']] = vif['MAC']
+            vm_rec = vm_recs.get(uuid)
+            if vm_rec is None:
+                # The VM went away since its metrics were recorded.
+                continue
             name = vm_rec['name_label']
             if name.startswith('Control domain'):
                 continue
+            vif_map = {}
+            for vif_ref in vm_rec['VIFs']:
+                vif = vif_recs.get(vif_ref)
+                if vif:
+                    vif_map[vif['device']] = vif['MAC']
             vifs_bw = bw.setdefault(name, {})
             for key, val in data.iteritems():
                 if key.startswith('vif_'):
                     vname = key.split('_')[1]
+                    if vname not in vif_map:
+                        continue
                     vif_bw = vifs_bw.setdefault(vif_map[vname], {})
                     if key.endswith('tx'):
                         vif_bw['bw_out'] = int(val)
@@ -25,8 +25,10 @@ thread pool). They are remote calls, and so may hang for the usual
 reasons.
 
 All long-running XenAPI calls (VM.start, VM.reboot, etc) are called async
-(using XenAPI.VM.async_start etc). These return a task, which can then be
-polled for completion.
+(using XenAPI.VM.async_start etc). These return a task. A single green
+thread per session watches XenAPI task events and wakes the callers waiting
+on tasks as they finish; tasks are polled for completion when the event
+watcher is not running.
 
 This combination of techniques means that we don't block the main thread at
 all, and at the same time we don't hold lots of threads waiting for
@@ -45,6 +47,8 @@ reactor thread if the VM.get_by_name_label or VM.get_record calls block.
 :xenapi_task_poll_interval:  The interval (seconds) used for polling of
                              remote tasks (Async.VM.start, etc)
                              (default: 0.5).
+:xenapi_task_use_events:     Wait for XenAPI task events rather than polling
+                             tasks (default: True).
 :target_host:                the iSCSI Target Host IP address, i.e. the IP
                              address for the nova-volume host
 :target_port:                iSCSI Target Port, 3260 Default
@@ -60,12 +64,12 @@ reactor thread if the VM.get_by_name_label or VM.get_record calls block.
 import contextlib
 import json
 import random
-import sys
 import time
 import urlparse
 import xmlrpclib
 
 from eventlet import event
+from eventlet import greenthread
 from eventlet import queue
 from eventlet import tpool
 from eventlet import timeout
@@ -73,7 +77,6 @@ from eventlet import timeout
 from nova import context
 from nova import db
 from nova import exception
-from nova import utils
 from nova import flags
 from nova import log as logging
 from nova.virt import driver
@@ -147,6 +150,21 @@ flags.DEFINE_string('xenapi_remap_vbd_dev_prefix', 'sd',
 flags.DEFINE_integer('xenapi_login_timeout',
                      10,
                      'Timeout in seconds for XenAPI login.')
+flags.DEFINE_bool('xenapi_task_use_events',
+                  True,
+                  'Wait for XenAPI task events rather than polling tasks.'
+                  ' Polling is used whenever the event watcher is down.')
+flags.DEFINE_float('xenapi_task_event_timeout',
+                   30.0,
+                   'Seconds each XenAPI event.from call waits for events.')
+flags.DEFINE_float('xenapi_task_event_poll_interval',
+                   10.0,
+                   'The interval used for polling of remote tasks while'
+                   ' also waiting for their events, in case one is missed.')
+flags.DEFINE_integer('xenapi_task_event_retry_interval',
+                     60,
+                     'Seconds to wait before restarting a failed XenAPI'
+                     ' event watcher.')
 
 
 def get_connection(_):
@@ -450,12 +468,120 @@ class XenAPIConnection(driver.ComputeDriver):
         return self._vmops.set_host_enabled(host, enabled)
 
 
+class TaskWatcher(object):
+    """Wakes up wait_for_task callers as XenAPI reports their tasks done.
+
+    One green thread long-polls event.from (or event.next on hosts that
+    predate it) for task events on a session of its own, so waiting on
+    any number of tasks costs one XenAPI call every
+    xenapi_task_event_timeout seconds instead of two per task every
+    xenapi_task_poll_interval seconds.  The watcher is started when the
+    first task is waited on.  If it fails, waiters are woken up to fall
+    back to polling and it is restarted after
+    xenapi_task_event_retry_interval seconds.
+    """
+
+    def __init__(self, create_session, failure):
+        self._create_session = create_session
+        self._failure = failure
+        # task ref -> event.Event sent the task record once it finishes
+        self._waiters = {}
+        self._retry_at = 0
+        self.running = False
+
+    def watch(self, task):
+        """Return an event sent when the task finishes, or None."""
+        if not FLAGS.xenapi_task_use_events:
+            return None
+        if not self.running:
+            if time.time() < self._retry_at:
+                return None
+            self.running = True
+            greenthread.spawn(self._run)
+        waiter = self._waiters.get(task)
+        if waiter is None or waiter.ready():
+            waiter = self._waiters[task] = event.Event()
+        return waiter
+
+    def unwatch(self, task):
+        self._waiters.pop(task, None)
+
+    def _run(self):
+        try:
+            session = self._create_session()
+            try:
+                self._watch(session)
+            finally:
+                try:
+                    tpool.execute(session.xenapi.session.logout)
+                except Exception:
+                    pass
+        except Exception:
+            LOG.exception(_("XenAPI task event watcher failed, polling "
+                            "tasks instead"))
+        self._retry_at = time.time() + FLAGS.xenapi_task_event_retry_interval
+        self.running = False
+        self._wake_all()
+
+    def _watch(self, session):
+        event_from = getattr(session.xenapi.event, 'from')
+        token = ''
+        try:
+            result = tpool.execute(event_from, ['task'], token,
+                                   FLAGS.xenapi_task_event_timeout)
+        except self._failure, exc:
+            if exc.details[0] != 'MESSAGE_METHOD_UNKNOWN':
+                raise
+            # NOTE: hosts older than XenServer 6.0 only have event.next.
+            tpool.execute(session.xenapi.event.register, ['task'])
+            while FLAGS.xenapi_task_use_events:
+                try:
+                    self._dispatch(tpool.execute(session.xenapi.event.next))
+                except self._failure, exc:
+                    if exc.details[0] != 'EVENTS_LOST':
+                        raise
+                    # Some events were dropped, so have every waiter
+                    # check its task again.
+                    self._wake_all()
+            return
+
+        while FLAGS.xenapi_task_use_events:
+            self._dispatch(result['events'])
+            token = result['token']
+            result = tpool.execute(event_from, ['task'], token,
+                                   FLAGS.xenapi_task_event_timeout)
+
+    def _dispatch(self, events):
+        for ev in events:
+            if ev.get('class') != 'task':
+                continue
+            waiter = self._waiters.get(ev.get('ref'))
+            if waiter is None or waiter.ready():
+                continue
+            record = ev.get('snapshot')
+            if ev.get('operation') == 'del' or not record:
+                # Have the waiter look at the task itself.
+                waiter.send(None)
+            elif record.get('status', 'pending') != 'pending':
+                waiter.send(record)
+
+    def _wake_all(self):
+        for waiter in self._waiters.values():
+            if not waiter.ready():
+                waiter.send(None)
+
+
 class XenAPISession(object):
     """The session to invoke XenAPI SDK calls"""
 
     def __init__(self, url, user, pw):
         self.XenAPI = self.get_imported_xenapi()
+        self._url = url
+        self._user = user
+        self._pw = pw
         self._sessions = queue.Queue()
+        self._task_watcher = TaskWatcher(self._create_event_session,
+                                         self.XenAPI.Failure)
         exception = self.XenAPI.Failure(_("Unable to log in to XenAPI "
                             "(is the Dom0 disk full?)"))
         for i in xrange(FLAGS.xenapi_connection_concurrent):
@@ -515,56 +641,84 @@ class XenAPISession(object):
                                  self.get_xenapi_host(), plugin, fn, args)
 
     def wait_for_task(self, task, uuid=None):
-        """Return the result of the given task. The task is polled
-        until it completes."""
-        done = event.Event()
-        loop = utils.LoopingCall(f=None)
-
-        def _poll_task():
-            """Poll the given XenAPI task, and return the result if the
-            action was completed successfully or not.
-            """
-            try:
-                ctxt = context.get_admin_context()
-                name = self.call_xenapi("task.get_name_label", task)
+        """Return the result of the given task.
+
+        The task event watcher wakes us up when the task finishes.  The
+        task is still polled, every xenapi_task_event_poll_interval seconds
+        in case an event is missed, or every xenapi_task_poll_interval
+        seconds when the watcher is not running.
+        """
+        waiter = self._task_watcher.watch(task)
+        try:
+            record = None
+            while record is None:
                 status = self.call_xenapi("task.get_status", task)
+                if status != "pending":
+                    break
+                if waiter is not None and self._task_watcher.running:
+                    with timeout.Timeout(
+                            FLAGS.xenapi_task_event_poll_interval, False):
+                        record = waiter.wait()
+                    if waiter.ready():
+                        # NOTE: the event can only be sent once, so wait
+                        # on a fresh one if the task is somehow still
+                        # pending after it.
+                        waiter = self._task_watcher.watch(task)
+                else:
+                    greenthread.sleep(FLAGS.xenapi_task_poll_interval)
+            if record is None:
+                record = self.call_xenapi("task.get_record", task)
+        except self.XenAPI.Failure, exc:
+            LOG.warn(exc)
+            raise
+        finally:
+            self._task_watcher.unwatch(task)
+        return self._task_result(task, record, uuid)
 
-                # Ensure action is never > 255
-                action = dict(action=name[:255], error=None)
-                log_instance_actions = (FLAGS.xenapi_log_instance_actions and
-                                        uuid)
-                if log_instance_actions:
-                    action["instance_uuid"] = uuid
+    def _task_result(self, task, record, uuid):
+        """Log a finished task and return its result or raise its error."""
+        name = record['name_label']
+        status = record['status']
+        ctxt = context.get_admin_context()
 
-                if status == "pending":
-                    return
-                elif status == "success":
-                    result = self.call_xenapi("task.get_result", task)
-                    LOG.info(_("Task [%(name)s] %(task)s status:"
-                            " success    %(result)s") % locals())
+        # Ensure action is never > 255
+        action = dict(action=name[:255], error=None)
+        log_instance_actions = FLAGS.xenapi_log_instance_actions and uuid
+        if log_instance_actions:
+            action["instance_uuid"] = uuid
 
-                    if log_instance_actions:
-                        db.instance_action_create(ctxt, action)
+        if status == "success":
+            result = record['result']
+            LOG.info(_("Task [%(name)s] %(task)s status:"
+                    " success    %(result)s") % locals())
 
-                    done.send(_parse_xmlrpc_value(result))
-                else:
-                    error_info = self.call_xenapi("task.get_error_info", task)
-                    LOG.warn(_("Task [%(name)s] %(task)s status:"
-                            " %(status)s    %(error_info)s") % locals())
-
-                    if log_instance_actions:
-                        action["error"] = str(error_info)
-                        db.instance_action_create(ctxt, action)
-
-                    done.send_exception(self.XenAPI.Failure(error_info))
-            except self.XenAPI.Failure, exc:
-                LOG.warn(exc)
-                done.send_exception(*sys.exc_info())
-            loop.stop()
-
-        loop.f = _poll_task
-        loop.start(FLAGS.xenapi_task_poll_interval, now=True)
-        return done.wait()
+            if log_instance_actions:
+                db.instance_action_create(ctxt, action)
+
+            return _parse_xmlrpc_value(result)
+
+        error_info = record['error_info']
+        LOG.warn(_("Task [%(name)s] %(task)s status:"
+                " %(status)s    %(error_info)s") % locals())
+
+        if log_instance_actions:
+            action["error"] = str(error_info)
+            db.instance_action_create(ctxt, action)
+
+        raise self.XenAPI.Failure(error_info)
+
+    def _create_event_session(self):
+        """Log in a session of its own for the task event watcher.
+
+        event.from blocks for up to xenapi_task_event_timeout seconds, so
+        it must not hold one of the sessions used for calls.
+        """
+        session = self._create_session(self._url)
+        exception = self.XenAPI.Failure(_("Unable to log in to XenAPI "
+                            "(is the Dom0 disk full?)"))
+        with timeout.Timeout(FLAGS.xenapi_login_timeout, exception):
+            session.login_with_password(self._user, self._pw)
+        return session
 
     def _create_session(self, url):
         """Stubout point. This can be replaced with a mock session."""
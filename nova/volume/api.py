@@ -50,7 +50,12 @@ class API(base.Base):
             if not size:
                 size = snapshot['volume_size']
 
-        if quota.allowed_volumes(context, 1, size) < 1:
+        try:
+            if quota.allowed_volumes(context, 1, size) < 1:
+                raise exception.OverQuota(overs='volumes')
+            reservations = quota.reserve(context, volumes=1,
+                                         gigabytes=int(size))
+        except exception.OverQuota:
             pid = context.project_id
             LOG.warn(_("Quota exceeded for %(pid)s, tried to create"
                     " %(size)sG volume") % locals())
@@ -79,7 +84,12 @@ class API(base.Base):
             'metadata': metadata,
             }
 
-        volume = self.db.volume_create(context, options)
+        try:
+            volume = self.db.volume_create(context, options)
+        except Exception:
+            with utils.save_and_reraise_exception():
+                quota.rollback(context, reservations)
+        quota.commit(context, reservations)
         rpc.cast(context,
                  FLAGS.scheduler_topic,
                  {"method": "create_volume",
@@ -45,6 +45,7 @@ from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import manager
+from nova import quota
 from nova import rpc
 from nova import utils
 from nova.volume import volume_types
@@ -186,7 +187,12 @@ class VolumeManager(manager.SchedulerDependentManager):
                                       volume_ref['id'],
                                       {'status': 'error_deleting'})
 
+        reservations = quota.reserve(context,
+                                     project_id=volume_ref['project_id'],
+                                     volumes=-1,
+                                     gigabytes=-(volume_ref['size'] or 0))
         self.db.volume_destroy(context, volume_id)
+        quota.commit(context, reservations)
         LOG.debug(_("volume %s: deleted successfully"), volume_ref['name'])
         return True
 